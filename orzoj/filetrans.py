@@ -22,12 +22,30 @@
 
 """implementation of OFTP (orzoj file transfer protocol)"""
 
-import datetime, hashlib, os.path
+import datetime, hashlib, os, os.path, threading, time, shutil, errno
 
 from orzoj import log, msg, snc
 
 _PACKET_SIZE = 1024 * 16
 _OFTP_VERSION = 0x0f000001
+_OFTP_VERSION_2 = 0x0f000002
+
+_CHUNK_MIN = 4 * 1024
+_CHUNK_MAX = 4 * 1024 * 1024
+_PART_MAX_AGE = 24 * 3600 # partial files not touched for so many seconds are removed
+
+# optional features (see msg.FEATURES_QUERY); "oftp-2": OFTP version 2 is supported
+FEATURES = ("oftp-2", )
+
+# size of the chunks proposed by the sender in OFTP version 2
+chunk_size = 256 * 1024
+
+# if not None, the directory where recv() keeps the partially received
+# files, so that an interrupted transfer could be resumed
+resume_dir = None
+
+_receiving = set() # checksums of the files being received to resume_dir
+_receiving_lock = threading.Lock()
 
 # orzoj file transfer protocol (OFTP) :
 #
@@ -55,6 +73,21 @@ _OFTP_VERSION = 0x0f000001
 #   client computes SHA-1 checksum of the received
 #   file and sends it back to server,
 #   server replies with OFTP_CHECK_OK or OFTP_CHECK_FAIL
+#
+# OFTP version 2, used if the client has feature "oftp-2":
+#   in step 1, the client reads the version of the server first and replies
+#   with the same version if it is supported, so that a version 1 server
+#   could still talk to it
+#
+#   step 2 becomes:
+#       server sends (size:uint64, SHA-1 digest of the file, proposed chunk
+#       size:uint32); client replies with (OFTP_TRANS_BEGIN, chunk size:uint32,
+#       offset:uint64), where offset is the number of bytes of the file
+#       already received in an interrupted transfer (see resume_dir)
+#
+#   in step 3, the file from offset is sent in chunks of the chunk size
+#
+# a uint64 is sent as two uint32, the high half first
 
 class OFTPError(Exception):
     pass
@@ -62,8 +95,27 @@ class OFTPError(Exception):
 def _td2seconds(td):
     return td.microseconds * 1e-6 + td.seconds + td.days * 24 * 3600
 
-def send(fpath, conn):
+def _write_uint64(conn, val):
+    conn.write_uint32(val >> 32)
+    conn.write_uint32(val & 0xffffffff)
+
+def _read_uint64(conn):
+    hi = conn.read_uint32()
+    return (hi << 32) | conn.read_uint32()
+
+def _sha1_file(fpath):
+    sha_ctx = hashlib.sha1()
+    with open(fpath, "rb") as f:
+        while True:
+            buf = f.read(65536)
+            if not buf:
+                return sha_ctx.digest()
+            sha_ctx.update(buf)
+
+def send(fpath, conn, features = ()):
     """send the file at @fpath, return the speed in kb/s
+    @features: the features of the client (see msg.FEATURES_QUERY); OFTP
+    version 2 is used if "oftp-2" is in @features
     OFTPError may be raised"""
 
     def _write_msg(m):
@@ -84,10 +136,16 @@ def send(fpath, conn):
         with open(fpath, "rb") as fptr:
             _write_msg(msg.OFTP_BEGIN)
             _check_msg(msg.OFTP_BEGIN)
-            _write_msg(_OFTP_VERSION)
-            if conn.read_uint32() != _OFTP_VERSION:
+            version = _OFTP_VERSION_2 if "oftp-2" in features else _OFTP_VERSION
+            _write_msg(version)
+            if conn.read_uint32() != version:
                 log.warning("version check error.")
                 raise OFTPError
+            if version == _OFTP_VERSION_2:
+                return _send_v2(fpath, fptr, fsize, conn)
+            if fsize > 0xffffffff:
+                log.error("file too large for OFTP version 1: {0!r}" . format(fpath))
+                raise OFTPError
             conn.write_uint32(fsize)
             _check_msg(msg.OFTP_TRANS_BEGIN)
             
@@ -119,6 +177,126 @@ def send(fpath, conn):
         log.warning("failed to transfer file because of network error.")
         raise OFTPError
 
+def _send_v2(fpath, fptr, fsize, conn):
+    time_start = time.time()
+    checksum = _sha1_file(fpath)
+    _write_uint64(conn, fsize)
+    conn.write(checksum)
+    conn.write_uint32(chunk_size)
+    if msg.read_msg(conn) != msg.OFTP_TRANS_BEGIN:
+        log.warning("message check error.")
+        raise OFTPError
+    chunk = conn.read_uint32()
+    offset = _read_uint64(conn)
+    if chunk < _CHUNK_MIN or chunk > _CHUNK_MAX or offset > fsize:
+        log.warning("invalid chunk size or offset: {0}, {1}" . format(chunk, offset))
+        raise OFTPError
+    if offset:
+        log.info("resuming transfer of {0!r} at {1}/{2} bytes" . format(fpath, offset, fsize))
+
+    fptr.seek(offset)
+    s = offset
+    while s < fsize:
+        buf = fptr.read(min(chunk, fsize - s))
+        if not buf:
+            raise IOError(errno.EIO, "file truncated while sending", fpath)
+        conn.write(buf)
+        s += len(buf)
+    msg.write_msg(conn, msg.OFTP_END)
+    if msg.read_msg(conn) != msg.OFTP_END:
+        log.warning("message check error.")
+        raise OFTPError
+
+    if conn.read(len(checksum)) != checksum:
+        msg.write_msg(conn, msg.OFTP_CHECK_FAIL)
+    else:
+        msg.write_msg(conn, msg.OFTP_CHECK_OK)
+    return (fsize - offset) / 1024.0 / max(time.time() - time_start, 1e-6)
+
+def _remove_old_parts():
+    now = time.time()
+    for i in os.listdir(resume_dir):
+        pf = os.path.join(resume_dir, i)
+        try:
+            if i.endswith(".part") and now - os.path.getmtime(pf) > _PART_MAX_AGE:
+                os.remove(pf)
+        except OSError:
+            pass
+
+def _recv_v2(fpath, fptr, conn):
+    time_start = time.time()
+    fsize = _read_uint64(conn)
+    checksum = conn.read(hashlib.sha1().digest_size)
+    chunk = min(max(conn.read_uint32(), _CHUNK_MIN), _CHUNK_MAX)
+
+    part = None
+    if resume_dir:
+        with _receiving_lock:
+            if checksum not in _receiving:
+                _receiving.add(checksum)
+                part = os.path.join(resume_dir, checksum.encode("hex") + ".part")
+    try:
+        sha_ctx = hashlib.sha1()
+        offset = 0
+        if part:
+            _remove_old_parts()
+            if os.path.exists(part):
+                offset = os.path.getsize(part)
+                if offset > fsize:
+                    os.remove(part)
+                    offset = 0
+                else:
+                    with open(part, "rb") as f:
+                        while True:
+                            buf = f.read(65536)
+                            if not buf:
+                                break
+                            sha_ctx.update(buf)
+            out = open(part, "ab")
+        else:
+            out = fptr
+
+        try:
+            msg.write_msg(conn, msg.OFTP_TRANS_BEGIN)
+            conn.write_uint32(chunk)
+            _write_uint64(conn, offset)
+            s = offset
+            while s < fsize:
+                buf = conn.read(min(chunk, fsize - s))
+                sha_ctx.update(buf)
+                out.write(buf)
+                s += len(buf)
+        finally:
+            if part:
+                # keep what has been received for a later transfer
+                out.close()
+
+        if msg.read_msg(conn) != msg.OFTP_END:
+            log.warning("message check error.")
+            raise OFTPError
+        msg.write_msg(conn, msg.OFTP_END)
+        conn.write(sha_ctx.digest())
+        m = msg.read_msg(conn)
+        if m != msg.OFTP_CHECK_OK or sha_ctx.digest() != checksum:
+            log.warning("SHA1 check failed while receiving file.")
+            if part:
+                os.remove(part)
+            raise OFTPError
+        if part:
+            try:
+                os.rename(part, fpath)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                with open(part, "rb") as f:
+                    shutil.copyfileobj(f, fptr)
+                os.remove(part)
+        return (fsize - offset) / 1024.0 / max(time.time() - time_start, 1e-6)
+    finally:
+        if part:
+            with _receiving_lock:
+                _receiving.discard(checksum)
+
 def recv(fpath, conn):
     """receive file and save it at @fpath, return the speed in kb/s
     OFTPError may be raised"""
@@ -140,8 +318,12 @@ def recv(fpath, conn):
         with open(fpath, "wb") as fptr:
             _check_msg(msg.OFTP_BEGIN)
             _write_msg(msg.OFTP_BEGIN)
+            version = conn.read_uint32()
+            if version == _OFTP_VERSION_2:
+                _write_msg(version)
+                return _recv_v2(fpath, fptr, conn)
             _write_msg(_OFTP_VERSION)
-            if conn.read_uint32() != _OFTP_VERSION:
+            if version != _OFTP_VERSION:
                 log.warning("version check error.")
                 raise OFTPError
             fsize = conn.read_uint32()
@@ -41,35 +41,93 @@ _DEFAULT_PROG_NAME = "prog"  # file name of program being judged (without extent
 _dir_temp = None  # relative to ChrootDir
 _dir_temp_abs = None
 
-_prog_path = None  # path of program being judged, without extention (relative to ChrootDir)
-_prog_path_abs = None
-
 _lock_file_obj = None
 _lock_file_fd = None
+_lock_file_cnt = 0 # number of slots holding the lock
+_lock_file_mutex = threading.Lock()
 
 _executor_dict = dict()
 lang_dict = dict()
 
 _cmd_vars = dict()
 
+worker_slots = 1 # number of tasks judged at the same time
+_slots = list()
+_slot_local = threading.local()
+
+class _Slot:
+    """working state of a worker slot, which judges one task at a time
+    in its own temporary directory; slot 0 uses TempDir, and
+    slot i (i > 0) uses TempDir.i"""
+    def __init__(self, idx):
+        if idx:
+            suffix = ".{0}" . format(idx)
+        else:
+            suffix = ""
+        self.dir_temp = os.path.normpath(_dir_temp) + suffix  # relative to ChrootDir
+        self.dir_temp_abs = os.path.normpath(_dir_temp_abs) + suffix
+        # path of program being judged, without extention (relative to ChrootDir)
+        self.prog_path = _join_path(self.dir_temp, _DEFAULT_PROG_NAME)
+        self.prog_path_abs = _join_path(self.dir_temp_abs, _DEFAULT_PROG_NAME)
+        self.cmd_vars = dict(_cmd_vars)
+        self.cmd_vars["WORKDIR"] = self.dir_temp
+        self.cmd_vars["WORKDIR_ABS"] = self.dir_temp_abs
+
+def set_slot(idx):
+    """make the current thread work in slot @idx"""
+    _slot_local.slot = _slots[idx]
+
+def _cur_slot():
+    try:
+        return _slot_local.slot
+    except AttributeError:
+        return _slots[0]
+
 def _join_path(p1, p2):
     return os.path.normpath(os.path.join(p1, p2))
 
 def _clean_temp():
     """clean temporary directory"""
-    global _dir_temp_abs
+    dir_temp_abs = _cur_slot().dir_temp_abs
     try:
-        for i in os.listdir(_dir_temp_abs):
-            p = _join_path(_dir_temp_abs, i)
+        for i in os.listdir(dir_temp_abs):
+            p = _join_path(dir_temp_abs, i)
             if os.path.isdir(p) and not os.path.islink(p):
                 shutil.rmtree(p)
             else:
                 os.remove(p)
     except Exception as e:
         log.error("failed to clean temporary directory [{0!r}]: {1}" .
-                format(_dir_temp_abs, e))
+                format(dir_temp_abs, e))
         raise Error
 
+def _lock_file_acquire(conn):
+    """lock LockFile, sending START_JUDGE_WAIT through @conn while waiting
+    the file is locked once for all the slots judging at the same time
+    may raise IOError"""
+    global _lock_file_cnt
+    while True:
+        with _lock_file_mutex:
+            if _lock_file_cnt:
+                _lock_file_cnt += 1
+                return
+            try:
+                fcntl.flock(_lock_file_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                _lock_file_cnt = 1
+                return
+            except IOError as e:
+                if e.errno != errno.EACCES and e.errno != errno.EAGAIN:
+                    raise
+        msg.write_msg(conn, msg.START_JUDGE_WAIT)
+        time.sleep(msg.TELL_ONLINE_INTERVAL)
+
+def _lock_file_release():
+    global _lock_file_cnt
+    with _lock_file_mutex:
+        _lock_file_cnt -= 1
+        if not _lock_file_cnt:
+            fcntl.flock(_lock_file_fd, fcntl.LOCK_UN)
+
 class _thread_report_case_result(threading.Thread):
     def __init__(self, conn, ncase):
         threading.Thread.__init__(self)
@@ -145,9 +203,7 @@ class _Executor:
             
         no exceptions are raised"""
 
-        global _cmd_vars
-
-        var_dict = dict(_cmd_vars)
+        var_dict = dict(_cur_slot().cmd_vars)
         var_dict['SRC'] = fsrc;
         try:
             args = limiter.eval_arg_list(self._args, var_dict)
@@ -179,9 +235,11 @@ class _Executor:
             return (False, "failed to compile: caught exception: {0}" .
                     format(e))
 
-    def run(self, prog, stdin = None, stdout = None, retrieve_stdout = False, extra_args = None):
+    def run(self, prog, stdin = None, stdout = None, retrieve_stdout = False, extra_args = None,
+            umask = None):
         """execute user's program @prog, stdin and stdout can be redirected to file
         allowed @stdin and @stdout values are the same as that of subprocess.Popen
+        @umask is passed to the limiter (see limiter._Limiter.run)
 
         if retrieve_stdout is False,
             return an instance of structures.case_result
@@ -191,7 +249,6 @@ class _Executor:
         
         no exceptions are raised"""
 
-        global _cmd_vars
         res = structures.case_result()
 
         def mkerror(msg):
@@ -205,7 +262,7 @@ class _Executor:
                 return (res, None)
             return res
 
-        var_dict = dict(_cmd_vars)
+        var_dict = dict(_cur_slot().cmd_vars)
         var_dict['SRC'] = prog
         try:
             args = limiter.eval_arg_list(self._args, var_dict)
@@ -223,9 +280,11 @@ class _Executor:
             var_dict["TARGET"] = args
 
             if retrieve_stdout:
-                l.run(var_dict, stdout = limiter.SAVE_OUTPUT, stderr = limiter.get_null_dev())
+                l.run(var_dict, stdout = limiter.SAVE_OUTPUT, stderr = limiter.get_null_dev(),
+                        umask = umask)
             else:
-                l.run(var_dict, stdin = stdin, stdout = stdout, stderr = limiter.get_null_dev())
+                l.run(var_dict, stdin = stdin, stdout = stdout, stderr = limiter.get_null_dev(),
+                        umask = umask)
 
             res.score = 0
             res.full_score = 0
@@ -292,50 +351,39 @@ class _Lang:
 
         locked = False
 
-        global _lock_file_fd
         if _lock_file_fd:
-            while True:
-                try:
-                    fcntl.flock(_lock_file_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
-                except IOError as e:
-                    if e.errno == errno.EACCES or e.errno == errno.EAGAIN:
-                        _write_msg(msg.START_JUDGE_WAIT)
-                        time.sleep(msg.TELL_ONLINE_INTERVAL)
-                        continue
-                    else:
-                        log.error("failed to lock file: {0}" . format(e))
-                        _write_msg(msg.ERROR)
-                        raise Error
-
-                except Exception as e:
-                    log.error("failed to lock file: {0}" . format(e))
-                    _write_msg(msg.ERROR)
-                    raise Error
+            try:
+                _lock_file_acquire(conn)
+            except snc.Error:
+                raise Error
+            except Exception as e:
+                log.error("failed to lock file: {0}" . format(e))
+                _write_msg(msg.ERROR)
+                raise Error
+            locked = True
 
-                locked = True
-                break  # successfully locked 
+        slot = _cur_slot()
+        cmd_vars = slot.cmd_vars
 
         try:
             _write_msg(msg.START_JUDGE_OK)
 
             _clean_temp()
 
-            global _prog_path_abs, _cmd_vars
-
             if self._compiler:
-                with open(_prog_path_abs + self._src_ext, "w") as f:
+                with open(slot.prog_path_abs + self._src_ext, "w") as f:
                     f.write(src)
 
-                _cmd_vars["MEMORY"] = 0
-                _cmd_vars["DATADIR"] = os.path.abspath(pcode)
+                cmd_vars["MEMORY"] = 0
+                cmd_vars["DATADIR"] = os.path.abspath(pcode)
 
                 th_tell_online = _thread_tell_online(conn)
                 th_tell_online.start()
 
                 if pconf.compiler and self._name in pconf.compiler:
-                    (ok, info) = self._compiler.run_as_compiler(_prog_path_abs, pconf.compiler[self._name])
+                    (ok, info) = self._compiler.run_as_compiler(slot.prog_path_abs, pconf.compiler[self._name])
                 else:
-                    (ok, info) = self._compiler.run_as_compiler(_prog_path_abs)
+                    (ok, info) = self._compiler.run_as_compiler(slot.prog_path_abs)
 
                 th_tell_online.stop()
                 th_tell_online.join()
@@ -347,13 +395,12 @@ class _Lang:
 
             _write_msg(msg.COMPILE_SUCCEED)
 
-            global _dir_temp_abs
+            dir_temp_abs = slot.dir_temp_abs
 
-            os.chmod(_prog_path_abs + self._exe_ext,
+            os.chmod(slot.prog_path_abs + self._exe_ext,
                     stat.S_IRUSR | stat.S_IXUSR |
                     stat.S_IRGRP | stat.S_IXGRP |
                     stat.S_IROTH | stat.S_IXOTH)
-            global _prog_path
 
             th_report_case = _thread_report_case_result(conn, len(pconf.case))
             th_report_case.start()
@@ -363,23 +410,23 @@ class _Lang:
                 try:
                     if pconf.extra_input:
                         for i in pconf.extra_input:
-                            shutil.copy(_join_path(pcode, i), _dir_temp_abs)
+                            shutil.copy(_join_path(pcode, i), dir_temp_abs)
 
                     stdin_path = _join_path(pcode, case.stdin)
                     if not input: # use stdin
                         prog_fin = open(stdin_path)
                     else:
-                        tpath = _join_path(_dir_temp_abs, input)
+                        tpath = _join_path(dir_temp_abs, input)
                         shutil.copy(stdin_path, tpath)
                         os.chmod(tpath, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
                         prog_fin = limiter.get_null_dev(False)
 
                     if not output: # use stdout
-                        prog_fout_path = _join_path(_dir_temp_abs, "output.{0}" .
+                        prog_fout_path = _join_path(dir_temp_abs, "output.{0}" .
                                 format(time.time()))
                         prog_fout = open(prog_fout_path, "w")
                     else:
-                        prog_fout_path = _join_path(_dir_temp_abs, output)
+                        prog_fout_path = _join_path(dir_temp_abs, output)
                         prog_fout = limiter.get_null_dev()
                 except Exception as e:
                     log.error("failed to open data file: {0}" . format(stdin_path, e))
@@ -393,13 +440,14 @@ class _Lang:
 
                 else:
 
-                    _cmd_vars["TIME"] = case.time
-                    _cmd_vars["MEMORY"] = case.mem
+                    cmd_vars["TIME"] = case.time
+                    cmd_vars["MEMORY"] = case.mem
 
-                    umask_prev = os.umask(0)
-                    case_result = self._executor.run(_prog_path, stdin = prog_fin, stdout = prog_fout)
+                    # the umask is changed only for the program, since the
+                    # other slots may be creating files at the same time
+                    case_result = self._executor.run(slot.prog_path, stdin = prog_fin,
+                            stdout = prog_fout, umask = 0)
                     case_result.full_score = case.score
-                    os.umask(umask_prev)
 
                     if prog_fin:
                         prog_fin.close()
@@ -432,19 +480,19 @@ class _Lang:
             _write_msg(msg.REPORT_JUDGE_FINISH)
 
             if locked:
-                fcntl.flock(_lock_file_fd, fcntl.LOCK_UN)
+                _lock_file_release()
 
         except Error:
             if locked:
-                fcntl.flock(_lock_file_fd, fcntl.LOCK_UN)
+                _lock_file_release()
             raise
         except snc.Error:
             if locked:
-                fcntl.flock(_lock_file_fd, fcntl.LOCK_UN)
+                _lock_file_release()
             raise Error
         except Exception as e:
             if locked:
-                fcntl.flock(_lock_file_fd, fcntl.LOCK_UN)
+                _lock_file_release()
             log.error("[lang {0!r}] failed to judge: {1}" .
                     format(self._name, e))
             log.debug(traceback.format_exc())
@@ -487,8 +535,9 @@ class _Lang:
                     format(e))
             raise Error
 
-        _cmd_vars["MEMORY"] = 0
-        _cmd_vars["DATADIR"] = os.path.abspath(pcode)
+        cmd_vars = _cur_slot().cmd_vars
+        cmd_vars["MEMORY"] = 0
+        cmd_vars["DATADIR"] = os.path.abspath(pcode)
 
         ret = self._compiler.run_as_compiler(fexe, extra_args)
 
@@ -508,41 +557,41 @@ class _Lang:
         """return a tuple (res:structures.case_result, verifier_output:str)
         
         no exceptions are raised"""
-        global _cmd_vars
+        cmd_vars = _cur_slot().cmd_vars
         user = None
         try:
-            user = _cmd_vars["USER"]
-            _cmd_vars["USER"] = os.geteuid()
+            user = cmd_vars["USER"]
+            cmd_vars["USER"] = os.geteuid()
         except KeyError:
             pass
 
         group = None
         try:
-            group = _cmd_vars["GROUP"]
-            _cmd_vars["GROUP"] = os.getegid()
+            group = cmd_vars["GROUP"]
+            cmd_vars["GROUP"] = os.getegid()
         except KeyError:
             pass
 
         chroot_dir = None
         try:
-            chroot_dir = _cmd_vars["CHROOT_DIR"]
-            _cmd_vars["CHROOT_DIR"] = "/"
+            chroot_dir = cmd_vars["CHROOT_DIR"]
+            cmd_vars["CHROOT_DIR"] = "/"
         except KeyError:
             pass
 
-        _cmd_vars["TIME"] = time
-        _cmd_vars["MEMORY"] = mem
+        cmd_vars["TIME"] = time
+        cmd_vars["MEMORY"] = mem
 
-        _cmd_vars["DATADIR"] = os.path.abspath(pcode)
+        cmd_vars["DATADIR"] = os.path.abspath(pcode)
 
         ret = self._executor.run(fexe, retrieve_stdout = True, extra_args = args)
 
         if user is not None:
-            _cmd_vars["USER"] = user
+            cmd_vars["USER"] = user
         if group is not None:
-            _cmd_vars["GROUP"] = group
+            cmd_vars["GROUP"] = group
         if chroot_dir is not None:
-            _cmd_vars["CHROOT_DIR"] = chroot_dir
+            cmd_vars["CHROOT_DIR"] = chroot_dir
 
         return ret
 
@@ -571,7 +620,7 @@ def _set_chroot_dir(arg):
         _cmd_vars["CHROOT_DIR"] = arg[1]
 
 def _set_temp_dir(arg):
-    global _cmd_vars, _dir_temp, _dir_temp_abs, _prog_path, _prog_path_abs
+    global _cmd_vars, _dir_temp, _dir_temp_abs
     _dir_temp = arg[1]
     if "CHROOT_DIR" in _cmd_vars:
         if os.path.isabs(_dir_temp):
@@ -586,19 +635,24 @@ def _set_temp_dir(arg):
     if not os.path.isdir(_dir_temp_abs):
         raise conf.UserError("path {0!r} is not a directory" . format(_dir_temp_abs))
 
+    _chmod_temp_dir(_dir_temp_abs)
+
+def _chmod_temp_dir(path):
     try:
-        os.chmod(_dir_temp_abs,
+        os.chmod(path,
                 stat.S_IRUSR | stat.S_IWUSR | stat.S_IXUSR |
                 stat.S_IRGRP | stat.S_IWGRP | stat.S_IXGRP |
                 stat.S_IROTH | stat.S_IWOTH | stat.S_IXOTH)
     except Exception as e:
         raise conf.UserError("failed to change permission for temporary directory: {0}" . format(e))
 
-    _prog_path = _join_path(_dir_temp, _DEFAULT_PROG_NAME)
-    _prog_path_abs = _join_path(_dir_temp_abs, _DEFAULT_PROG_NAME)
-
-    _cmd_vars["WORKDIR"] = _dir_temp
-    _cmd_vars["WORKDIR_ABS"] = _dir_temp_abs
+def _set_worker_slots(arg):
+    global worker_slots
+    worker_slots = int(arg[1])
+    if worker_slots < 1:
+        raise conf.UserError("Option {0} can not be less than 1" . format(arg[0]))
+    if worker_slots > 1 and not conf.is_unix:
+        raise conf.UserError("Option {0} is only avaliable on Unix systems" . format(arg[0]))
 
 def _set_lock_file(arg):
     if len(arg) == 2:
@@ -631,4 +685,22 @@ conf.simple_conf_handler("TempDir", _set_temp_dir, no_dup = True)
 conf.simple_conf_handler("LockFile", _set_lock_file, required = False, no_dup = True, require_os = conf.REQUIRE_UNIX)
 conf.simple_conf_handler("User", _set_user, required = False, no_dup = True, require_os = conf.REQUIRE_UNIX)
 conf.simple_conf_handler("Group", _set_group, required = False, no_dup = True, require_os = conf.REQUIRE_UNIX)
+conf.simple_conf_handler("WorkerSlots", _set_worker_slots, default = "1")
+
+def _init_slots():
+    global _slots
+    _slots = list()
+    for i in range(worker_slots):
+        slot = _Slot(i)
+        if i:
+            if not os.path.isdir(slot.dir_temp_abs):
+                try:
+                    os.mkdir(slot.dir_temp_abs)
+                except Exception as e:
+                    raise conf.UserError("failed to create temporary directory for worker slot {0}: {1}" .
+                            format(i, e))
+            _chmod_temp_dir(slot.dir_temp_abs)
+        _slots.append(slot)
+
+conf.register_init_func(_init_slots)
 
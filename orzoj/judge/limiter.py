@@ -21,7 +21,7 @@
 #
 """parse limiter configuration and export functions to use limiter"""
 
-import subprocess, tempfile, struct, os, sys, time, uuid
+import subprocess, tempfile, struct, os, sys, time, uuid, threading
 
 from orzoj import conf, log
 
@@ -120,24 +120,31 @@ def eval_arg_list(arglist, var_dict):
             ret.append(tmp)
     return ret
 
+def _thread_local_result(name):
+    return property(lambda self: getattr(self._local, name, None))
+
 class _Limiter:
+    # results of the last run in the current thread, see run()
+    exe_status = _thread_local_result("exe_status")
+    exe_time = _thread_local_result("exe_time")
+    exe_mem = _thread_local_result("exe_mem")
+    exe_extra_info = _thread_local_result("exe_extra_info")
+    stdout = _thread_local_result("stdout")
+    stderr = _thread_local_result("stderr")
+
     def __init__(self, args):
         if len(args) < 4:
             raise conf.UserError("Option {0} takes at least three arguments" . format(args[0]))
 
         self._name = args[1]
+        self._local = threading.local()
 
         if args[2] == 'socket':
             if not conf.is_unix:
                 raise conf.UserError("{0}: socket method is only avaliable on Unix systems" . format(args[0]))
             self._type = _LIMITER_SOCKET
             try:
-                self._socket_name = "orzoj-limiter-socket.{0}" . format(str(uuid.uuid4()))
-
-                s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-                s.bind("\0{0}".format(self._socket_name))
-                s.listen(1)
-                self._socket = s
+                self._get_socket()
             except Exception as e:
                 raise conf.UserError("[limiter {0!r}] failed to establish socket: {1}" .
                         format(self._name, e))
@@ -156,23 +163,43 @@ class _Limiter:
     def __del_(self):
         if self._type == _LIMITER_SOCKET:
             try:
-                self._socket.close()
+                self._local.socket.close()
             except Exception as e:
                 log.warning("failed to close socket: {0}" . format(e))
 
-    def run(self, var_dict, stdin = None, stdout = None, stderr = None):
+    def _get_socket(self):
+        """return a tuple (socket, socket name) for the current thread;
+        each thread listens on its own socket so that limiters run by
+        different worker slots at the same time would not be confused"""
+        l = self._local
+        if getattr(l, "socket", None) is None:
+            name = "orzoj-limiter-socket.{0}" . format(str(uuid.uuid4()))
+            s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            s.bind("\0{0}".format(name))
+            s.listen(1)
+            (l.socket, l.socket_name) = (s, name)
+        return (l.socket, l.socket_name)
+
+    def run(self, var_dict, stdin = None, stdout = None, stderr = None, umask = None):
         """run the limiter under variables defined in @var_dict
         Note: @var_dict may be changed
+
+        if @umask is not None, it is the umask of the limiter process
+        (Unix only), while that of orzoj-judge is unchanged
         
         execution result can be accessed via self.exe_status, self.exe_time (in microseconds),
         self.exe_mem (in kb) and self.exe_extra_info
 
         if @stdout and/or @stderr is SAVE_OUTPUT, stdout and/or stderr will be stored
         in self.stdout and self.stderr
+
+        the results are kept per thread, so several threads could use
+        the same limiter at the same time
         """
 
-        self.stdout = None
-        self.stderr = None
+        res = self._local
+        res.stdout = None
+        res.stderr = None
 
         if self._type == _LIMITER_FILE:
             try:
@@ -183,7 +210,7 @@ class _Limiter:
                         format(self._name, e))
                 raise SysError("limiter communication error")
         else:
-            var_dict["SOCKNAME"] = self._socket_name
+            (sock, var_dict["SOCKNAME"]) = self._get_socket()
 
 
         try:
@@ -203,7 +230,11 @@ class _Limiter:
             if stderr_ is SAVE_OUTPUT:
                 stderr_ = subprocess.PIPE
 
-            p = subprocess.Popen(args, stdin = stdin, stdout = stdout_, stderr = stderr_)
+            preexec_fn = None
+            if umask is not None and conf.is_unix:
+                preexec_fn = lambda: os.umask(umask)
+            p = subprocess.Popen(args, stdin = stdin, stdout = stdout_, stderr = stderr_,
+                    preexec_fn = preexec_fn)
         except OSError as e:
             log.error("error while calling Popen [errno {0}] "
                     "[filename {1!r}]: {2}" . format(e.errno, e.filename, e.strerror))
@@ -214,16 +245,16 @@ class _Limiter:
 
         if self._type == _LIMITER_SOCKET:
             try:
-                s = self._socket
+                s = sock
                 s.settimeout(1)
                 (conn, addr) = s.accept()
                 s.settimeout(None)
-                (self.exe_status, self.exe_time, self.exe_mem, info_len) = \
+                (res.exe_status, res.exe_time, res.exe_mem, info_len) = \
                         struct.unpack("IIII", conn.recv(16))
                 if info_len:
-                    self.exe_extra_info = conn.recv(info_len)
+                    res.exe_extra_info = conn.recv(info_len)
                 else:
-                    self.exe_extra_info = ''
+                    res.exe_extra_info = ''
             except socket.timeout:
                 log.error("[limiter {0!r}] socket timed out" .
                         format(self._name))
@@ -234,7 +265,7 @@ class _Limiter:
                 raise SysError("limiter socket error")
 
         if stdout is SAVE_OUTPUT or stderr is SAVE_OUTPUT:
-            (self.stdout, self.stderr) = p.communicate()
+            (res.stdout, res.stderr) = p.communicate()
         else:
             p.wait()
 
@@ -243,12 +274,12 @@ class _Limiter:
         if self._type == _LIMITER_FILE:
             try:
                 with open(ftmp[1], 'rb') as f:
-                    (self.exe_status, self.exe_time, self.exe_mem, info_len) = \
+                    (res.exe_status, res.exe_time, res.exe_mem, info_len) = \
                             struct.unpack("IIII", f.read(16))
                     if info_len:
-                        self.exe_extra_info = f.read(info_len)
+                        res.exe_extra_info = f.read(info_len)
                     else:
-                        self.exe_extra_info = ''
+                        res.exe_extra_info = ''
                 os.close(ftmp[0])
                 os.remove(ftmp[1])
             except Exception as e:
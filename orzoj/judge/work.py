@@ -22,12 +22,15 @@
 
 """connect to orzoj-server and wait for tasks"""
 
-import platform, os, os.path, traceback
+import platform, os, os.path, traceback, threading
 
-from orzoj import msg, snc, conf, log, control, sync_dir
+from orzoj import msg, snc, conf, log, control, sync_dir, mux, filetrans
 from orzoj.judge import core, probconf
 
 _judge_id = None
+_manifest_file = None
+_blob_store = None
+_resume_dir = None
 
 _info_dict = {
     "platform" : platform.platform()
@@ -41,10 +44,24 @@ try:
 except:
     pass
 
+_prob_lock_dict = dict()
+_prob_lock_dict_lock = threading.Lock()
+
 class Error(Exception):
     pass
 
 
+def _prob_lock(pcode):
+    """return the sync_dir.Dir_lock protecting the data directory of problem
+    @pcode, which may be used by several worker slots at the same time"""
+    with _prob_lock_dict_lock:
+        try:
+            return _prob_lock_dict[pcode]
+        except KeyError:
+            lock = sync_dir.Dir_lock()
+            _prob_lock_dict[pcode] = lock
+            return lock
+
 def connect(sock):
     """connect to orzoj-server via socket @sock
     
@@ -68,20 +85,22 @@ def connect(sock):
     def _read_uint32():
         return conn.read_uint32()
 
-    def _check_msg(m):
-        if m != _read_msg():
-            log.error("message check error.")
-            raise Error
     try:
         conn = snc.snc(sock)
 
+        nslot = core.worker_slots
         _write_msg(msg.HELLO)
         global _judge_id
         _write_str(_judge_id)
-        _write_uint32(msg.PROTOCOL_VERSION)
+        if nslot > 1:
+            _write_uint32(msg.PROTOCOL_VERSION_MUX)
+        else:
+            _write_uint32(msg.PROTOCOL_VERSION)
         _write_uint32(len(core.lang_dict))
         for i in core.lang_dict:
             _write_str(i)
+        if nslot > 1:
+            _write_uint32(nslot)
 
         m = _read_msg()
         if m == msg.ERROR:
@@ -104,36 +123,138 @@ def connect(sock):
 
         log.info('connection established')
 
-        while not control.test_termination_flag():
+        if nslot == 1:
+            _serve(conn)
+            return
+
+        while True:
             m = _read_msg()
+            if m == msg.MUX_BEGIN:
+                break
+            if not _answer_msg(conn, m):
+                log.error("unexpected message from orzoj-server: {0}" .  format(m))
+                raise Error
 
-            if m == msg.TELL_ONLINE:
-                continue
+        nslot = _read_uint32()
+        if nslot > core.worker_slots:
+            log.error("orzoj-server requests too many worker slots: {0}" . format(nslot))
+            raise Error
+        log.info("judging with {0} worker slot(s)" . format(nslot))
 
-            if m == msg.ERROR:
-                log.warning("failed to work: orzoj-server says an error happens there")
-                raise Error
+        mx = mux.Mux(conn, nslot)
+        failed = list()
+        def _thread_slot(idx):
+            core.set_slot(idx)
+            try:
+                _serve(mx.channel(idx))
+            except Exception as e:
+                if not isinstance(e, (Error, snc.Error, core.Error)):
+                    log.error("[slot {0}] failed to judge: {1}" . format(idx, e))
+                    log.debug(traceback.format_exc())
+                failed.append(e)
+                # wake up the other slots
+                mx.close()
+
+        threads = [threading.Thread(target = _thread_slot, args = (i, ),
+            name = "work._thread_slot") for i in range(nslot)]
+        for i in threads:
+            i.start()
+        for i in threads:
+            i.join()
+        mx.close()
+        if failed:
+            raise failed[0]
 
-            if m == msg.QUERY_INFO:
-                global _info_dict
-                q = _read_str()
-                _write_msg(msg.ANS_QUERY)
-                try:
-                    _write_str(_info_dict[q])
-                except KeyError:
-                    _write_str("unknown")
-                continue
+    except snc.Error as e:
+        log.error("failed to communicate with orzoj-server because of network error")
+        control.set_termination_flag()
+        raise Error
 
-            if m != msg.PREPARE_DATA:
-                log.error("unexpected message from orzoj-server: {0}" .  format(m))
-                raise Error
+    except core.Error:
+        control.set_termination_flag()
+        raise Error
+
+    finally:
+        _save_manifest(True)
+
+def _answer_msg(conn, m):
+    """deal with message @m which does not belong to a task
+    return whether @m is such a message
+    
+    may raise Error"""
+    if m == msg.TELL_ONLINE:
+        return True
+
+    if m == msg.ERROR:
+        log.warning("failed to work: orzoj-server says an error happens there")
+        raise Error
+
+    if m == msg.QUERY_INFO:
+        global _info_dict
+        q = conn.read_str()
+        msg.write_msg(conn, msg.ANS_QUERY)
+        if q == msg.FEATURES_QUERY:
+            conn.write_str(" " . join(sync_dir.FEATURES))
+            return True
+        try:
+            conn.write_str(_info_dict[q])
+        except KeyError:
+            conn.write_str("unknown")
+        return True
+
+    return False
+
+def _serve(conn):
+    """judge the tasks sent through @conn until termination
+
+    may raise Error, snc.Error or core.Error"""
+
+    def _write_msg(m):
+        msg.write_msg(conn, m)
+
+    def _write_str(s):
+        conn.write_str(s)
 
-            pcode = _read_str()
-            log.info("received task for problem {0!r}" . format(pcode))
+    def _write_uint32(v):
+        conn.write_uint32(v)
+
+    def _read_msg(timeout = 0):
+        return msg.read_msg(conn, timeout)
+
+    def _read_str():
+        return conn.read_str()
+
+    def _check_msg(m):
+        if m != _read_msg():
+            log.error("message check error.")
+            raise Error
+
+    while not control.test_termination_flag():
+        m = _read_msg()
+
+        if _answer_msg(conn, m):
+            continue
+
+        if m != msg.PREPARE_DATA:
+            log.error("unexpected message from orzoj-server: {0}" .  format(m))
+            raise Error
+
+        pcode = _read_str()
+        log.info("received task for problem {0!r}" . format(pcode))
+
+        # the data are shared by the slots judging the problem, and
+        # modified only while no other slot is using them
+        lock = _prob_lock(pcode)
+        lock.acquire_shared(lambda: _write_msg(msg.TELL_ONLINE))
+        try:
             try:
-                speed = sync_dir.recv(pcode, conn)
+                speed = sync_dir.recv(pcode, conn, lock)
                 if speed:
                     log.info("file transfer speed: {0!r}" . format(speed))
+                log.debug(sync_dir.manifest_cache.stat_str())
+                if sync_dir.blob_store:
+                    log.debug(sync_dir.blob_store.stat_str())
+                _save_manifest()
 
             except sync_dir.Error:
                 log.error("failed to synchronize data for problem {0!r}" . format(pcode))
@@ -159,19 +280,63 @@ def connect(sock):
             output = _read_str()
 
             core.lang_dict[lang].judge(conn, pcode, pconf, src, input, output)
-
-    except snc.Error as e:
-        log.error("failed to communicate with orzoj-server because of network error")
-        control.set_termination_flag()
-        raise Error
-
-    except core.Error:
-        control.set_termination_flag()
-        raise Error
+        finally:
+            lock.release()
 
 def _set_datacache(arg):
     os.chdir(arg[1])
 
+def _set_manifest_file(arg):
+    global _manifest_file
+    _manifest_file = arg[1]
+
+def _save_manifest(force = False):
+    if _manifest_file:
+        sync_dir.manifest_cache.save(_manifest_file, force)
+
+def _set_blob_store(arg):
+    global _blob_store
+    _blob_store = arg[1]
+
+def _init_blob_store():
+    if not _blob_store:
+        return
+    try:
+        sync_dir.blob_store = sync_dir.Blob_store(_blob_store)
+        if not sync_dir.blob_store.linked:
+            log.warning("blob store {0!r} could not be hard linked into DataCache; "
+                    "data files are copied, and unused files are not removed" .
+                    format(_blob_store))
+        cnt = sync_dir.blob_store.gc()
+        if cnt:
+            log.info("removed {0} unused file(s) from blob store" . format(cnt))
+    except Exception as e:
+        raise conf.UserError("failed to open blob store {0!r}: {1}" . format(_blob_store, e))
+
+def _set_resume_dir(arg):
+    global _resume_dir
+    _resume_dir = arg[1]
+
+def _init_resume_dir():
+    if not _resume_dir:
+        return
+    try:
+        if not os.path.isdir(_resume_dir):
+            os.makedirs(_resume_dir)
+    except OSError as e:
+        raise conf.UserError("failed to create directory {0!r}: {1}" . format(_resume_dir, e))
+    filetrans.resume_dir = _resume_dir
+
+def _init_manifest():
+    sync_dir.manifest_cache = sync_dir.Manifest_cache()
+    if not _manifest_file or not os.path.exists(_manifest_file):
+        return
+    try:
+        sync_dir.manifest_cache.load(_manifest_file)
+        log.info("loaded manifest cache from {0!r}" . format(_manifest_file))
+    except Exception as e:
+        log.error("failed to read manifest cache file {0!r}: {1}" . format(_manifest_file, e))
+
 def _set_id(arg):
     global _judge_id
     _judge_id = arg[1]
@@ -185,6 +350,11 @@ def _ch_set_info(arg):
     _info_dict[arg[1]] = "\n".join(arg[2:])
 
 conf.simple_conf_handler("DataCache", _set_datacache)
+conf.simple_conf_handler("ManifestCacheFile", _set_manifest_file, default = "orzoj-judge.manifest")
+conf.simple_conf_handler("BlobStore", _set_blob_store, default = ".blobs")
+conf.simple_conf_handler("OftpResumeDir", _set_resume_dir, default = ".oftp")
 conf.simple_conf_handler("JudgeId", _set_id)
 conf.register_handler("SetInfo", _ch_set_info)
-
+conf.register_init_func(_init_manifest)
+conf.register_init_func(_init_blob_store)
+conf.register_init_func(_init_resume_dir)
@@ -0,0 +1,112 @@
+/*
+ * $File: _delta.c
+ * $Author: Jiakai <jia.kai66@gmail.com>
+ * $Date: Sun Oct 18 23:12:06 2026 +0800
+ */
+/*
+This file is part of orzoj
+
+Copyright (C) <2010>  Jiakai <jia.kai66@gmail.com>
+
+Orzoj is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Orzoj is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with orzoj.  If not, see <http://www.gnu.org/licenses/>.
+*/
+
+// speedups for the block delta transfer in orzoj/sync_dir.py
+//
+// find() is the same as sync_dir._py_find, which is used if this module is
+// not available; see there for the meaning of the arguments.
+
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+
+#define ADLER_MOD 65521
+#define BITMAP_SHIFT 12 // the filter has 1 << (32 - BITMAP_SHIFT) bits
+
+static PyObject *module_find(PyObject *self, PyObject *args)
+{
+	const unsigned char *data, *bitmap;
+	Py_ssize_t len, start, end, block, bitmap_len, pos, i;
+	PyObject *weaks;
+	unsigned long long a, b;
+	unsigned long nmod;
+
+	if (!PyArg_ParseTuple(args, "s#nnns#O", &data, &len, &start, &end, &block,
+				&bitmap, &bitmap_len, &weaks))
+		return NULL;
+	if (bitmap_len != (1 << (32 - BITMAP_SHIFT)) / 8)
+	{
+		PyErr_SetString(PyExc_ValueError, "bad bitmap size");
+		return NULL;
+	}
+	if (start < 0 || start >= end || block <= 0 || start + block > len)
+		return Py_BuildValue("(nn)", (Py_ssize_t)-1, (Py_ssize_t)0);
+
+	// adler32 of data[start:start + block]
+	a = 1;
+	b = block;
+	for (i = 0; i < block; i ++)
+	{
+		a += data[start + i];
+		b += (unsigned long long)(block - i) * data[start + i];
+	}
+	a %= ADLER_MOD;
+	b %= ADLER_MOD;
+	nmod = block % ADLER_MOD;
+
+	for (pos = start; ; pos ++)
+	{
+		unsigned long weak = (unsigned long)((b << 16) | a);
+		unsigned long h = (unsigned long)((weak * 2654435761UL) & 0xffffffffUL) >> BITMAP_SHIFT;
+		if (bitmap[h >> 3] & (1 << (h & 7)))
+		{
+			PyObject *key = PyInt_FromSize_t(weak);
+			int found;
+			if (!key)
+				return NULL;
+			found = PyDict_Contains(weaks, key);
+			Py_DECREF(key);
+			if (found < 0)
+				return NULL;
+			if (found)
+				return Py_BuildValue("(nn)", pos, (Py_ssize_t)weak);
+		}
+		if (pos + 1 >= end || pos + block >= len)
+			break;
+		// roll the window by one byte
+		{
+			unsigned long x0 = data[pos], xn = data[pos + block];
+			a = (a + ADLER_MOD - x0 + xn) % ADLER_MOD;
+			b = (b + a + ADLER_MOD - 1 + (unsigned long long)(ADLER_MOD - nmod) * x0)
+				% ADLER_MOD;
+		}
+	}
+	return Py_BuildValue("(nn)", (Py_ssize_t)-1, (Py_ssize_t)0);
+}
+
+static PyMethodDef
+	methods_module[] =
+	{
+		{"find", (PyCFunction)module_find, METH_VARARGS, NULL},
+		{NULL, NULL, 0, NULL}
+	};
+
+#ifndef PyMODINIT_FUNC	/* declarations for DLL import/export */
+#define PyMODINIT_FUNC extern void
+#endif
+
+PyMODINIT_FUNC
+init_delta(void)
+{
+	Py_InitModule3("_delta", methods_module, NULL);
+}
@@ -0,0 +1,464 @@
+/*
+ * $File: _phpserialize.c
+ * $Author: Jiakai <jia.kai66@gmail.com>
+ * $Date: Sun Oct 18 21:02:37 2026 +0800
+ */
+/*
+This file is part of orzoj
+
+Copyright (C) <2010>  Jiakai <jia.kai66@gmail.com>
+
+Orzoj is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Orzoj is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with orzoj.  If not, see <http://www.gnu.org/licenses/>.
+*/
+
+// speedups for orzoj/phpserialize.py
+//
+// Only the default case (no hooks, utf-8 strict, no string decoding) with
+// plain built-in types is handled here. dumps() raises
+// _phpserialize.unsupported for anything else, and loads() raises some
+// exception on any input it cannot parse; in both cases phpserialize.py
+// does the work again in pure Python, so the results (including errors)
+// are always the same as those of the pure Python version.
+
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <stdio.h>
+#include <string.h>
+
+static PyObject *unsupported_obj;
+
+// ------------------------------------------------------------------
+// dumps
+
+typedef struct
+{
+	char *buf;
+	Py_ssize_t len, cap;
+} Buffer;
+
+static int buf_reserve(Buffer *b, Py_ssize_t n)
+{
+	char *p;
+	Py_ssize_t cap;
+	if (b->len + n <= b->cap)
+		return 1;
+	cap = b->cap * 2;
+	if (cap < b->len + n)
+		cap = b->len + n;
+	p = PyMem_Realloc(b->buf, cap);
+	if (!p)
+	{
+		PyErr_NoMemory();
+		return 0;
+	}
+	b->buf = p;
+	b->cap = cap;
+	return 1;
+}
+
+static int buf_append(Buffer *b, const char *s, Py_ssize_t n)
+{
+	if (!buf_reserve(b, n))
+		return 0;
+	memcpy(b->buf + b->len, s, n);
+	b->len += n;
+	return 1;
+}
+
+// append @prefix, the str() of @obj and @suffix
+static int buf_append_str(Buffer *b, const char *prefix, PyObject *obj, const char *suffix)
+{
+	PyObject *s = PyObject_Str(obj);
+	int ret;
+	if (!s)
+		return 0;
+	ret = buf_append(b, prefix, strlen(prefix)) &&
+		buf_append(b, PyString_AS_STRING(s), PyString_GET_SIZE(s)) &&
+		buf_append(b, suffix, strlen(suffix));
+	Py_DECREF(s);
+	return ret;
+}
+
+// s:<len>:"<data>";
+static int dump_bytes(Buffer *b, const char *s, Py_ssize_t n)
+{
+	char tmp[32];
+	int l = sprintf(tmp, "s:%ld:\"", (long)n);
+	if (!buf_reserve(b, l + n + 2))
+		return 0;
+	memcpy(b->buf + b->len, tmp, l);
+	memcpy(b->buf + b->len + l, s, n);
+	b->buf[b->len + l + n] = '"';
+	b->buf[b->len + l + n + 1] = ';';
+	b->len += l + n + 2;
+	return 1;
+}
+
+static int dump_int(Buffer *b, char type, long v)
+{
+	char tmp[32];
+	int l = sprintf(tmp, "%c:%ld;", type, v);
+	return buf_append(b, tmp, l);
+}
+
+static int dump_unicode(Buffer *b, PyObject *obj)
+{
+	PyObject *s = PyUnicode_AsUTF8String(obj);
+	int ret;
+	if (!s)
+		return 0;
+	ret = dump_bytes(b, PyString_AS_STRING(s), PyString_GET_SIZE(s));
+	Py_DECREF(s);
+	return ret;
+}
+
+static int unsupported(PyObject *obj)
+{
+	PyErr_SetObject(unsupported_obj, (PyObject*)Py_TYPE(obj));
+	return 0;
+}
+
+// like _serialize(obj, True)
+static int dump_key(Buffer *b, PyObject *obj)
+{
+	if (PyInt_Check(obj)) // including bool
+		return dump_int(b, 'i', PyInt_AS_LONG(obj));
+	if (PyString_CheckExact(obj))
+		return dump_bytes(b, PyString_AS_STRING(obj), PyString_GET_SIZE(obj));
+	if (PyUnicode_CheckExact(obj))
+		return dump_unicode(b, obj);
+	if (obj == Py_None)
+		return buf_append(b, "s:0:\"\";", 7);
+	if (PyLong_CheckExact(obj))
+		return buf_append_str(b, "i:", obj, ";");
+	if (PyFloat_CheckExact(obj))
+	{
+		// '%i' % obj truncates the float
+		PyObject *v = PyNumber_Int(obj);
+		int ret;
+		if (!v)
+			return 0;
+		if (PyInt_Check(v))
+			ret = dump_int(b, 'i', PyInt_AS_LONG(v));
+		else
+			ret = buf_append_str(b, "i:", v, ";");
+		Py_DECREF(v);
+		return ret;
+	}
+	return unsupported(obj);
+}
+
+static int dump_value(Buffer *b, PyObject *obj);
+
+static int dump_array(Buffer *b, PyObject *obj)
+{
+	char tmp[32];
+	Py_ssize_t i, n;
+	int ret = 0;
+
+	if (Py_EnterRecursiveCall(" in phpserialize.dumps"))
+		return 0;
+
+	if (PyDict_CheckExact(obj))
+	{
+		PyObject *key, *value;
+		i = 0;
+		n = PyDict_Size(obj);
+		if (!buf_append(b, tmp, sprintf(tmp, "a:%ld:{", (long)n)))
+			goto out;
+		while (PyDict_Next(obj, &i, &key, &value))
+			if (!dump_key(b, key) || !dump_value(b, value))
+				goto out;
+	}
+	else
+	{
+		PyObject **items = PySequence_Fast_ITEMS(obj);
+		n = PySequence_Fast_GET_SIZE(obj);
+		if (!buf_append(b, tmp, sprintf(tmp, "a:%ld:{", (long)n)))
+			goto out;
+		for (i = 0; i < n; i ++)
+			if (!dump_int(b, 'i', (long)i) || !dump_value(b, items[i]))
+				goto out;
+	}
+	ret = buf_append(b, "}", 1);
+out:
+	Py_LeaveRecursiveCall();
+	return ret;
+}
+
+// like _serialize(obj, False)
+static int dump_value(Buffer *b, PyObject *obj)
+{
+	if (PyString_CheckExact(obj))
+		return dump_bytes(b, PyString_AS_STRING(obj), PyString_GET_SIZE(obj));
+	if (PyInt_CheckExact(obj))
+		return dump_int(b, 'i', PyInt_AS_LONG(obj));
+	if (obj == Py_None)
+		return buf_append(b, "N;", 2);
+	if (PyBool_Check(obj))
+		return buf_append(b, obj == Py_True ? "b:1;" : "b:0;", 4);
+	if (PyUnicode_CheckExact(obj))
+		return dump_unicode(b, obj);
+	if (PyDict_CheckExact(obj) || PyList_CheckExact(obj) || PyTuple_CheckExact(obj))
+		return dump_array(b, obj);
+	if (PyLong_CheckExact(obj))
+		return buf_append_str(b, "i:", obj, ";");
+	if (PyFloat_CheckExact(obj))
+		return buf_append_str(b, "d:", obj, ";");
+	return unsupported(obj);
+}
+
+static PyObject *module_dumps(PyObject *self, PyObject *obj)
+{
+	Buffer b = {NULL, 0, 0};
+	PyObject *ret = NULL;
+	if (!buf_reserve(&b, 256))
+		return NULL;
+	if (dump_value(&b, obj))
+		ret = PyString_FromStringAndSize(b.buf, b.len);
+	PyMem_Free(b.buf);
+	return ret;
+}
+
+// ------------------------------------------------------------------
+// loads
+
+typedef struct
+{
+	const char *s;
+	Py_ssize_t len, pos;
+} Parser;
+
+static PyObject *parse_error(void)
+{
+	PyErr_SetString(PyExc_ValueError, "invalid php serialization");
+	return NULL;
+}
+
+static int expect(Parser *p, char c)
+{
+	if (p->pos < p->len && p->s[p->pos] == c)
+	{
+		p->pos ++;
+		return 1;
+	}
+	parse_error();
+	return 0;
+}
+
+// find @delim after current position, return the end or -1
+static Py_ssize_t find(Parser *p, char delim)
+{
+	const char *e = memchr(p->s + p->pos, delim, p->len - p->pos);
+	if (!e)
+	{
+		parse_error();
+		return -1;
+	}
+	return e - p->s;
+}
+
+// int(p->s[p->pos:end])
+static PyObject *parse_int(Parser *p, Py_ssize_t end)
+{
+	const char *s = p->s + p->pos, *e = p->s + end;
+	PyObject *str, *ret;
+	int neg = 0;
+
+	if (s < e && *s == '-')
+	{
+		neg = 1;
+		s ++;
+	}
+	if (s < e && e - s <= 18)
+	{
+		long long v = 0;
+		for (; s < e && *s >= '0' && *s <= '9'; s ++)
+			v = v * 10 + (*s - '0');
+		if (s == e)
+		{
+			if (neg)
+				v = -v;
+			if (v >= LONG_MIN && v <= LONG_MAX)
+				return PyInt_FromLong((long)v);
+			return PyLong_FromLongLong(v);
+		}
+	}
+
+	// let int() deal with spaces, signs, long numbers and errors
+	str = PyString_FromStringAndSize(p->s + p->pos, end - p->pos);
+	if (!str)
+		return NULL;
+	ret = PyNumber_Int(str);
+	Py_DECREF(str);
+	return ret;
+}
+
+static PyObject *parse_value(Parser *p);
+
+static PyObject *parse_array(Parser *p)
+{
+	Py_ssize_t end, n, i;
+	PyObject *tmp, *ret, *key, *value;
+
+	if ((end = find(p, ':')) < 0)
+		return NULL;
+	if (!(tmp = parse_int(p, end)))
+		return NULL;
+	n = PyInt_AsSsize_t(tmp);
+	Py_DECREF(tmp);
+	if (n == -1 && PyErr_Occurred())
+		return NULL;
+	p->pos = end + 1;
+	if (!expect(p, '{'))
+		return NULL;
+
+	if (Py_EnterRecursiveCall(" in phpserialize.loads"))
+		return NULL;
+	ret = PyDict_New();
+	if (!ret)
+		goto out;
+	for (i = 0; i < n; i ++)
+	{
+		if (!(key = parse_value(p)))
+			goto fail;
+		if (!(value = parse_value(p)))
+		{
+			Py_DECREF(key);
+			goto fail;
+		}
+		if (PyDict_SetItem(ret, key, value))
+		{
+			Py_DECREF(key);
+			Py_DECREF(value);
+			goto fail;
+		}
+		Py_DECREF(key);
+		Py_DECREF(value);
+	}
+	if (!expect(p, '}'))
+		goto fail;
+	goto out;
+fail:
+	Py_CLEAR(ret);
+out:
+	Py_LeaveRecursiveCall();
+	return ret;
+}
+
+static PyObject *parse_value(Parser *p)
+{
+	Py_ssize_t end, len;
+	PyObject *tmp, *ret;
+	char type;
+
+	if (p->pos >= p->len)
+		return parse_error();
+	type = p->s[p->pos ++];
+	if (type >= 'A' && type <= 'Z')
+		type += 'a' - 'A';
+	switch (type)
+	{
+		case 'n':
+			if (!expect(p, ';'))
+				return NULL;
+			Py_RETURN_NONE;
+		case 'i':
+		case 'd':
+		case 'b':
+			if (!expect(p, ':') || (end = find(p, ';')) < 0)
+				return NULL;
+			if (type == 'd')
+			{
+				tmp = PyString_FromStringAndSize(p->s + p->pos, end - p->pos);
+				if (!tmp)
+					return NULL;
+				ret = PyFloat_FromString(tmp, NULL);
+				Py_DECREF(tmp);
+			}
+			else
+			{
+				ret = parse_int(p, end);
+				if (ret && type == 'b')
+				{
+					tmp = ret;
+					ret = PyBool_FromLong(PyObject_IsTrue(tmp));
+					Py_DECREF(tmp);
+				}
+			}
+			p->pos = end + 1;
+			return ret;
+		case 's':
+			if (!expect(p, ':') || (end = find(p, ':')) < 0)
+				return NULL;
+			if (!(tmp = parse_int(p, end)))
+				return NULL;
+			len = PyInt_AsSsize_t(tmp);
+			Py_DECREF(tmp);
+			if (len == -1 && PyErr_Occurred())
+				return NULL;
+			p->pos = end + 1;
+			if (!expect(p, '"'))
+				return NULL;
+			if (len < 0 || len > p->len - p->pos - 2 ||
+					p->s[p->pos + len] != '"' || p->s[p->pos + len + 1] != ';')
+				return parse_error();
+			ret = PyString_FromStringAndSize(p->s + p->pos, len);
+			p->pos += len + 2;
+			return ret;
+		case 'a':
+			if (!expect(p, ':'))
+				return NULL;
+			return parse_array(p);
+	}
+	return parse_error();
+}
+
+static PyObject *module_loads(PyObject *self, PyObject *args)
+{
+	Parser p;
+	if (!PyArg_ParseTuple(args, "s#", &p.s, &p.len))
+		return NULL;
+	p.pos = 0;
+	return parse_value(&p);
+}
+
+// ------------------------------------------------------------------
+
+static PyMethodDef
+	methods_module[] =
+	{
+		{"dumps", (PyCFunction)module_dumps, METH_O, NULL},
+		{"loads", (PyCFunction)module_loads, METH_VARARGS, NULL},
+		{NULL, NULL, 0, NULL}
+	};
+
+#ifndef PyMODINIT_FUNC	/* declarations for DLL import/export */
+#define PyMODINIT_FUNC extern void
+#endif
+
+PyMODINIT_FUNC
+init_phpserialize(void)
+{
+	PyObject *m = Py_InitModule3("_phpserialize", methods_module, NULL);
+	if (!m)
+		return;
+
+	unsupported_obj = PyErr_NewException("_phpserialize.unsupported", NULL, NULL);
+	if (!unsupported_obj)
+		return;
+	Py_INCREF(unsupported_obj);
+	PyModule_AddObject(m, "unsupported", unsupported_obj);
+}
+
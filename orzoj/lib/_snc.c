@@ -184,6 +184,15 @@ static PyObject* snc_read(Snc_obj_snc *self, PyObject *args);
 // object method
 static PyObject* snc_write(Snc_obj_snc *self, PyObject *args);
 
+// return the number of bytes already received and buffered by SSL
+// object method
+static PyObject* snc_pending(Snc_obj_snc *self, void *);
+
+// return the file descriptor of the underlying socket, which can be used
+// in select() to wait for data
+// object method
+static PyObject* snc_fileno(Snc_obj_snc *self, void *);
+
 // object method
 static PyObject* snc_shutdown(Snc_obj_snc *self, void *);
 
@@ -224,6 +233,8 @@ static PyMethodDef
 	{
 		{"read", (PyCFunction)snc_read, METH_VARARGS, NULL},
 		{"write", (PyCFunction)snc_write, METH_VARARGS, NULL},
+		{"pending", (PyCFunction)snc_pending, METH_NOARGS, NULL},
+		{"fileno", (PyCFunction)snc_fileno, METH_NOARGS, NULL},
 		{"shutdown", (PyCFunction)snc_shutdown, METH_NOARGS, NULL},
 		{NULL, NULL, 0, NULL}
 	};
@@ -772,6 +783,26 @@ PyObject* snc_write(Snc_obj_snc *self, PyObject *args)
 	return Py_None;
 }
 
+PyObject* snc_pending(Snc_obj_snc *self, void *___)
+{
+	if (self->ssl == NULL)
+	{
+		PyErr_SetString(snc_error_obj, "attempt to use a closed socket");
+		return NULL;
+	}
+	return PyInt_FromLong(SSL_pending(self->ssl));
+}
+
+PyObject* snc_fileno(Snc_obj_snc *self, void *___)
+{
+	if (self->socket == NULL)
+	{
+		PyErr_SetString(snc_error_obj, "attempt to use a closed socket");
+		return NULL;
+	}
+	return PyInt_FromLong((long)self->socket->sockfd);
+}
+
 void snc_shutdown_do(Snc_obj_snc *self)
 {
 	int ret;
@@ -37,5 +37,13 @@ module = Extension("orzoj._snc", sources = ["_snc.c"],
         extra_compile_args = cflags,
         extra_link_args = libs)
 
-setup(name = "orzoj", ext_modules = [module])
+# optional, see orzoj/phpserialize.py
+module_phpserialize = Extension("orzoj._phpserialize", sources = ["_phpserialize.c"],
+        extra_compile_args = ["-Wall"])
+
+# optional, see orzoj/sync_dir.py
+module_delta = Extension("orzoj._delta", sources = ["_delta.c"],
+        extra_compile_args = ["-Wall"])
+
+setup(name = "orzoj", ext_modules = [module, module_phpserialize, module_delta])
 
@@ -33,6 +33,10 @@ warning = _logger.warning
 error   = _logger.error
 critical= _logger.critical
 
+def debug_enabled():
+    """return whether debug messages are logged, so that the arguments of
+    expensive ones need not be computed"""
+    return _logger.isEnabledFor(logging.DEBUG)
 
 _filename = ''
 _level = ''
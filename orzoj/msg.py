@@ -28,6 +28,17 @@ ERROR = 0xffffffff
 
 PROTOCOL_VERSION = 0xff000001
 
+# a judge using this version has several worker slots, each of which
+# judges one task at a time; after the queries, the connection is
+# multiplexed into one channel per slot (see mux.py)
+PROTOCOL_VERSION_MUX = 0xff000002
+
+# the query (see QUERY_INFO) sent by orzoj-server before those of the
+# website, answered with the optional features supported by the judge,
+# separated by spaces (old judges answer "unknown"); orzoj-server uses a
+# feature only if the judge supports it
+FEATURES_QUERY = "orzoj-features"
+
 # s2c: server to client(i.e. orzoj-judge)
 # c2s: client to server
 
@@ -38,6 +49,8 @@ TELL_ONLINE, # s2c, c2s
 
 # packet format: (HELLO, id:string, PROTOCOL_VERSION:uint32_t,
 # cnt:uint32_t, for(0<=i<cnt) supported language[i]:string)
+# or (HELLO, id:string, PROTOCOL_VERSION_MUX:uint32_t,
+# cnt:uint32_t, for(0<=i<cnt) supported language[i]:string, nslot:uint32_t)
 HELLO, # c2s
 
 # packet format: (DUPLICATED_ID)
@@ -101,8 +114,28 @@ SYNCDIR_FILELIST, #c2s
 SYNCDIR_FTRANS, # s2c
 # tell the client that filetrans is ready
 # packet format: (SYNCDIR_FTRANS)
-SYNCDIR_DONE # c2s
-) = range(29)
+# or (SYNCDIR_STREAM, ...) instead if the judge supports it (see sync_dir.py)
+SYNCDIR_DONE, # c2s
+
+# sent after the queries if the judge uses PROTOCOL_VERSION_MUX;
+# all the following data are sent through the channels of mux.Mux,
+# on each of which tasks are judged as with PROTOCOL_VERSION
+# packet format: (MUX_BEGIN, nslot:uint32_t), where nslot is the number of
+# channels, which may be less than requested by the judge
+MUX_BEGIN, # s2c
+
+# sent instead of SYNCDIR_FTRANS to a judge with feature "syncdir-stream";
+# the requested files follow as a stream (see sync_dir.py)
+SYNCDIR_STREAM, # s2c
+
+# sent after SYNCDIR_FILELIST to a judge with feature "syncdir-delta" to offer
+# block delta transfer of some requested files (see sync_dir.py)
+# packet format: (SYNCDIR_DELTA, nfile:uint32, (filenum[i]:uint32, block_size[i]:uint32))
+SYNCDIR_DELTA, # s2c
+# packet format: (SYNCDIR_SIGNATURES, signature[i]:string), where signature[i]
+# is empty if the judge has no copy of the i-th offered file
+SYNCDIR_SIGNATURES # c2s
+) = range(33)
 
 def write_msg(conn, m, timeout = 0):
     conn.write_uint32(m, timeout)
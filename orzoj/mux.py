@@ -0,0 +1,199 @@
+# $File: mux.py
+# $Author: Jiakai <jia.kai66@gmail.com>
+# $Date: Sun Oct 18 16:05:22 2026 +0800
+#
+# This file is part of orzoj
+#
+# Copyright (C) <2010>  Jiakai <jia.kai66@gmail.com>
+#
+# Orzoj is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Orzoj is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with orzoj.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""multiplex several logical channels over one snc connection
+
+frame format: (channel id:uint32_t, length:uint32_t, data)
+
+Each channel has the same interface as snc.snc, so the protocols
+(messages, sync_dir, filetrans, ...) work on a channel unchanged.
+The underlying SSL connection is only used with a lock held,
+since SSL objects can not be used by several threads at the same time.
+The lock is never held while waiting for the network: frames are written
+in chunks when the socket is writable, and read as the data arrive, so
+that reading goes on while a large frame is being written, even if the
+peer is writing a large frame too."""
+
+import threading, struct, select, time
+from collections import deque
+
+from orzoj import snc, log, control
+
+_HEADER_SIZE = 8
+_POLL_INTERVAL = 0.5
+_WRITE_CHUNK = 8192 # bytes written with the lock held at a time
+
+class Mux:
+    def __init__(self, conn, nchannel):
+        """@conn: an snc.snc instance, which should not be used by others after this"""
+        self._conn = conn
+        self._fd = conn.fileno()
+        self._lock = threading.Lock() # for using self._conn
+        self._write_lock = threading.Lock() # for writing a whole frame
+        self._channels = [Channel(self, i) for i in range(nchannel)]
+        self._closed = False
+        self._thread = threading.Thread(target = self._thread_read, name = "mux.Mux._thread_read")
+        self._thread.start()
+
+    def channel(self, cid):
+        return self._channels[cid]
+
+    def close(self):
+        """stop reading and wake up all the readers, which will get snc.Error
+        the underlying connection is not closed"""
+        self._closed = True
+        for c in self._channels:
+            c._on_closed()
+        if threading.current_thread() is not self._thread:
+            self._thread.join()
+
+    def _write(self, cid, data, timeout):
+        if self._closed:
+            raise snc.Error
+        frame = struct.pack("!II", cid, len(data)) + data
+        if timeout < 0:
+            deadline = None
+        else:
+            deadline = time.time() + timeout + snc._timeout
+        with self._write_lock:
+            for off in range(0, len(frame), _WRITE_CHUNK):
+                while not select.select([], [self._fd], [], _POLL_INTERVAL)[1]:
+                    if self._closed:
+                        raise snc.Error
+                    if deadline is not None and time.time() > deadline:
+                        log.error("failed to write to channel {0}: timed out" . format(cid))
+                        raise snc.Error
+                with self._lock:
+                    self._conn.write(frame[off:off + _WRITE_CHUNK], timeout)
+
+    def _read_some(self, size):
+        """read at most @size bytes, waiting for the data without the lock
+        held; return None if the Mux is closed or the termination flag is set"""
+        conn = self._conn
+        while not self._closed and not control.test_termination_flag():
+            with self._lock:
+                n = conn.pending()
+                if n:
+                    return conn.read(min(n, size))
+            if select.select([self._fd], [], [], _POLL_INTERVAL)[0]:
+                # a whole SSL record is read, and the rest of it is pending
+                with self._lock:
+                    return conn.read(1)
+        return None
+
+    def _read(self, size):
+        ret = list()
+        while size:
+            data = self._read_some(size)
+            if data is None:
+                return None
+            ret.append(data)
+            size -= len(data)
+        return "" . join(ret)
+
+    def _thread_read(self):
+        try:
+            while True:
+                header = self._read(_HEADER_SIZE)
+                if header is None:
+                    break
+                (cid, length) = struct.unpack("!II", header)
+                data = self._read(length)
+                if data is None:
+                    break
+                try:
+                    c = self._channels[cid]
+                except IndexError:
+                    log.warning("data for unknown channel {0} received" . format(cid))
+                    break
+                c._feed(data)
+        except snc.Error:
+            log.warning("network error while reading multiplexed connection")
+        except Exception as e:
+            log.error("failed to read multiplexed connection: {0}" . format(e))
+        self.close()
+
+
+class Channel(snc.conn_base):
+    def __init__(self, mux, cid):
+        self._mux = mux
+        self._cid = cid
+        self._cond = threading.Condition()
+        self._buf = deque()
+        self._buf_off = 0 # offset of unread data in self._buf[0]
+        self._buf_len = 0 # number of unread bytes in self._buf
+        self._closed = False
+
+    def read(self, size, timeout = 0):
+        """read exactly @size bytes
+        @timeout has the same meaning as in snc.snc.read"""
+        if timeout < 0:
+            deadline = None
+        else:
+            deadline = time.time() + timeout + snc._timeout
+        with self._cond:
+            while self._buf_len < size:
+                if self._closed:
+                    raise snc.Error
+                if deadline is None:
+                    self._cond.wait(_POLL_INTERVAL)
+                else:
+                    remain = deadline - time.time()
+                    if remain <= 0:
+                        log.error("failed to read from channel {0}: timed out [len={1}]" .
+                                format(self._cid, size))
+                        raise snc.Error
+                    self._cond.wait(remain)
+
+            self._buf_len -= size
+            ret = list()
+            while size:
+                chunk = self._buf[0]
+                end = self._buf_off + size
+                if end < len(chunk):
+                    ret.append(chunk[self._buf_off:end])
+                    self._buf_off = end
+                    break
+                ret.append(chunk[self._buf_off:])
+                size -= len(chunk) - self._buf_off
+                self._buf.popleft()
+                self._buf_off = 0
+            return "" . join(ret)
+
+    def write(self, data, timeout = 0):
+        """write all of @data"""
+        self._mux._write(self._cid, data, timeout)
+
+    def close(self):
+        pass
+
+    def _feed(self, data):
+        with self._cond:
+            self._buf.append(data)
+            self._buf_len += len(data)
+            self._cond.notify()
+
+    def _on_closed(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
@@ -222,6 +222,14 @@ r"""
     >>> d['username']
     'admin'
 
+    Speedups
+    ========
+
+    `dumps` and `loads` use the C extension `orzoj._phpserialize` if it is
+    available (built by orzoj/lib/setup.py) for the default arguments and
+    plain built-in types, and a pure Python implementation otherwise.  The
+    results are always the same.
+
     Changelog
     =========
 
@@ -240,6 +248,11 @@ r"""
 """
 from StringIO import StringIO
 
+try:
+    from orzoj import _phpserialize as _speedups
+except ImportError:
+    _speedups = None
+
 __author__ = 'Armin Ronacher <armin.ronacher@active-4.com>'
 __version__ = '1.1'
 __all__ = ('phpobject', 'convert_member_dict', 'dict_to_list', 'dict_to_tuple',
@@ -300,53 +313,91 @@ def convert_member_dict(d):
     return dict((_translate_member_name(k), v) for k, v in d.iteritems())
 
 
+def _serialize_key(obj, charset, errors):
+    if isinstance(obj, (int, long, float, bool)):
+        return 'i:%i;' % obj
+    if isinstance(obj, basestring):
+        if isinstance(obj, unicode):
+            obj = obj.encode(charset, errors)
+        return 's:%i:"%s";' % (len(obj), obj)
+    if obj is None:
+        return 's:0:"";'
+    raise TypeError('can\'t serialize %r as key' % type(obj))
+
+
+def _dumps(data, charset, errors, object_hook):
+    out = []
+    append = out.append
+
+    def _serialize(obj):
+        # the common built-in types first, then the general case
+        t = type(obj)
+        if t is str:
+            append('s:%i:"%s";' % (len(obj), obj))
+        elif t is int:
+            append('i:%s;' % obj)
+        elif t is dict:
+            append('a:%i:{' % len(obj))
+            for key, value in obj.iteritems():
+                if type(key) is str:
+                    append('s:%i:"%s";' % (len(key), key))
+                else:
+                    append(_serialize_key(key, charset, errors))
+                _serialize(value)
+            append('}')
+        elif t is list or t is tuple:
+            append('a:%i:{' % len(obj))
+            for key, value in enumerate(obj):
+                append('i:%i;' % key)
+                _serialize(value)
+            append('}')
+        elif obj is None:
+            append('N;')
+        elif isinstance(obj, bool):
+            append('b:%i;' % obj)
+        elif isinstance(obj, (int, long)):
+            append('i:%s;' % obj)
+        elif isinstance(obj, float):
+            append('d:%s;' % obj)
+        elif isinstance(obj, basestring):
+            if isinstance(obj, unicode):
+                obj = obj.encode(charset, errors)
+            append('s:%i:"%s";' % (len(obj), obj))
+        elif isinstance(obj, (list, tuple, dict)):
+            if isinstance(obj, dict):
+                iterable = obj.iteritems()
+            else:
+                iterable = enumerate(obj)
+            append('a:%i:{' % len(obj))
+            for key, value in iterable:
+                append(_serialize_key(key, charset, errors))
+                _serialize(value)
+            append('}')
+        elif isinstance(obj, phpobject):
+            append('O%s%s' % (
+                _serialize_key(obj.__name__, charset, errors)[1:-1],
+                _dumps(obj.__php_vars__, charset, errors, object_hook)[1:]
+            ))
+        elif object_hook is not None:
+            _serialize(object_hook(obj))
+        else:
+            raise TypeError('can\'t serialize %r' % type(obj))
+
+    _serialize(data)
+    return ''.join(out)
+
+
 def dumps(data, charset='utf-8', errors='strict', object_hook=None):
     """Return the PHP-serialized representation of the object as a string,
     instead of writing it to a file like `dump` does.
     """
-    def _serialize(obj, keypos):
-        if keypos:
-            if isinstance(obj, (int, long, float, bool)):
-                return 'i:%i;' % obj
-            if isinstance(obj, basestring):
-                if isinstance(obj, unicode):
-                    obj = obj.encode(charset, errors)
-                return 's:%i:"%s";' % (len(obj), obj)
-            if obj is None:
-                return 's:0:"";'
-            raise TypeError('can\'t serialize %r as key' % type(obj))
-        else:
-            if obj is None:
-                return 'N;'
-            if isinstance(obj, bool):
-                return 'b:%i;' % obj
-            if isinstance(obj, (int, long)):
-                return 'i:%s;' % obj
-            if isinstance(obj, float):
-                return 'd:%s;' % obj
-            if isinstance(obj, basestring):
-                if isinstance(obj, unicode):
-                    obj = obj.encode(charset, errors)
-                return 's:%i:"%s";' % (len(obj), obj)
-            if isinstance(obj, (list, tuple, dict)):
-                out = []
-                if isinstance(obj, dict):
-                    iterable = obj.iteritems()
-                else:
-                    iterable = enumerate(obj)
-                for key, value in iterable:
-                    out.append(_serialize(key, True))
-                    out.append(_serialize(value, False))
-                return 'a:%i:{%s}' % (len(obj), ''.join(out))
-            if isinstance(obj, phpobject):
-                return 'O%s%s' % (
-                    _serialize(obj.__name__, True)[1:-1],
-                    _serialize(obj.__php_vars__, False)[1:]
-                )
-            if object_hook is not None:
-                return _serialize(object_hook(obj), False)
-            raise TypeError('can\'t serialize %r' % type(obj))
-    return _serialize(data, False)
+    if _speedups is not None and object_hook is None and \
+            charset == 'utf-8' and errors == 'strict':
+        try:
+            return _speedups.dumps(data)
+        except Exception:
+            pass
+    return _dumps(data, charset, errors, object_hook)
 
 
 def load(fp, charset='utf-8', errors='strict', decode_strings=False,
@@ -448,13 +499,93 @@ def load(fp, charset='utf-8', errors='strict', decode_strings=False,
     return _unserialize()
 
 
+def _loads(data, charset, errors, decode_strings, object_hook, array_hook):
+    # the same as load(), but scanning the string by index
+    if array_hook is None:
+        array_hook = dict
+
+    def _expect(e, pos):
+        if not data.startswith(e, pos):
+            raise ValueError('failed expectation, expected %r got %r' %
+                             (e, data[pos:pos + len(e)]))
+        return pos + len(e)
+
+    def _find(delim, pos):
+        end = data.find(delim, pos)
+        if end < 0:
+            raise ValueError('unexpected end of stream')
+        return end
+
+    def _load_array(pos):
+        end = _find(':', pos)
+        items = int(data[pos:end])
+        pos = _expect('{', end + 1)
+        result = []
+        for idx in xrange(items):
+            key, pos = _unserialize(pos)
+            value, pos = _unserialize(pos)
+            result.append((key, value))
+        return result, _expect('}', pos)
+
+    def _unserialize(pos):
+        type_ = data[pos:pos + 1].lower()
+        pos += 1
+        if type_ == 's':
+            end = _find(':', _expect(':', pos))
+            length = int(data[pos + 1:end])
+            pos = _expect('"', end + 1)
+            end = pos + length
+            if length < 0:
+                raise ValueError('negative string length')
+            _expect('";', end)
+            value = data[pos:end]
+            if decode_strings:
+                value = value.decode(charset, errors)
+            return value, end + 2
+        if type_ == 'i' or type_ == 'd' or type_ == 'b':
+            end = _find(';', _expect(':', pos))
+            value = data[pos + 1:end]
+            if type_ == 'i':
+                return int(value), end + 1
+            if type_ == 'd':
+                return float(value), end + 1
+            return int(value) != 0, end + 1
+        if type_ == 'a':
+            result, pos = _load_array(_expect(':', pos))
+            return array_hook(result), pos
+        if type_ == 'n':
+            return None, _expect(';', pos)
+        if type_ == 'o':
+            if object_hook is None:
+                raise ValueError('object in serialization dump but '
+                                 'object_hook not given.')
+            end = _find(':', _expect(':', pos))
+            name_length = int(data[pos + 1:end])
+            pos = _expect('"', end + 1)
+            name = data[pos:pos + name_length]
+            result, pos = _load_array(_expect('":', pos + name_length))
+            return object_hook(name, dict(result)), pos
+        raise ValueError('unexpected opcode')
+
+    return _unserialize(0)[0]
+
+
 def loads(data, charset='utf-8', errors='strict', decode_strings=False,
           object_hook=None, array_hook=None):
     """Read a PHP-serialized object hierarchy from a string.  Characters in the
     string past the object's representation are ignored.
     """
-    return load(StringIO(data), charset, errors, decode_strings,
-                object_hook, array_hook)
+    if type(data) is not str:
+        return load(StringIO(data), charset, errors, decode_strings,
+                    object_hook, array_hook)
+    if _speedups is not None and not decode_strings and \
+            object_hook is None and array_hook is None:
+        try:
+            return _speedups.loads(data)
+        except Exception:
+            pass
+    return _loads(data, charset, errors, decode_strings, object_hook,
+                  array_hook)
 
 
 def dump(data, fp, charset='utf-8', errors='strict', object_hook=None):
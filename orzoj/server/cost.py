@@ -0,0 +1,160 @@
+# $File: cost.py
+# $Author: Jiakai <jia.kai66@gmail.com>
+# $Date: Sun Oct 18 19:26:41 2026 +0800
+#
+# This file is part of orzoj
+#
+# Copyright (C) <2010>  Jiakai <jia.kai66@gmail.com>
+#
+# Orzoj is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Orzoj is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with orzoj.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""estimation of the time needed to judge a task, learned from finished tasks
+
+The cost of a task is the time a judge spends on compiling the source and
+running all the cases, which is tracked as an exponentially weighted moving
+average for each (problem, language) pair. For a pair not seen before,
+the average running time of the problem (in any language) plus the average
+compiling time of the language is used, and if the problem has never been
+judged, the average cost of all tasks.
+
+cost file format (one estimate per line, fields separated by tabs):
+    run <problem code> <language> <seconds>
+    prob <problem code> <seconds>
+    compile <language> <seconds>
+    all <seconds>
+"""
+
+import os, os.path, threading, time
+
+from orzoj import conf, log
+
+_ALPHA = 0.3 # factor of the moving averages
+_DEFAULT_COST = 1.0 # in seconds, used before any task finishes
+_SAVE_INTERVAL = 30 # minimal time in seconds between two writes of the cost file
+
+_filename = None
+
+_lock = threading.Lock()
+_run = dict()       # dict of <(problem code, language)> => <seconds>
+_prob = dict()      # dict of <problem code> => <seconds>
+_compile = dict()   # dict of <language> => <seconds>
+_all = None         # average cost of all tasks
+_dirty = False
+_last_save = 0
+
+def _update(d, key, val):
+    try:
+        d[key] += _ALPHA * (val - d[key])
+    except KeyError:
+        d[key] = float(val)
+
+def estimate(prob, lang):
+    """return the expected cost in seconds of a task for problem @prob
+    in language @lang"""
+    with _lock:
+        try:
+            return _run[(prob, lang)]
+        except KeyError:
+            pass
+        try:
+            return _prob[prob] + _compile.get(lang, 0)
+        except KeyError:
+            pass
+        if _all is None:
+            return _DEFAULT_COST
+        return _all
+
+def task_done(task, stages):
+    """@task has been judged, and @stages is a dict of
+    <stage name> => <time in seconds> as in sched.Task_queue.task_done"""
+    global _dirty, _all
+    with _lock:
+        if "compile" in stages:
+            _update(_compile, task.lang, stages["compile"])
+            _dirty = True
+        if "run" in stages:
+            val = stages.get("compile", 0) + stages["run"]
+            _update(_run, (task.prob, task.lang), val)
+            _update(_prob, task.prob, stages["run"])
+            if _all is None:
+                _all = float(val)
+            else:
+                _all += _ALPHA * (val - _all)
+            _dirty = True
+
+def save(force = False):
+    """write the estimates to the cost file if they have changed and
+    at least _SAVE_INTERVAL seconds have passed since last write, or if
+    @force is True"""
+    global _dirty, _last_save
+    if not _filename:
+        return
+    now = time.time()
+    with _lock:
+        if not _dirty or (not force and now - _last_save < _SAVE_INTERVAL):
+            return
+        lines = ["run\t{0}\t{1}\t{2!r}\n" . format(p, l, v) for ((p, l), v) in _run.iteritems()]
+        lines.extend(["prob\t{0}\t{1!r}\n" . format(p, v) for (p, v) in _prob.iteritems()])
+        lines.extend(["compile\t{0}\t{1!r}\n" . format(l, v) for (l, v) in _compile.iteritems()])
+        if _all is not None:
+            lines.append("all\t{0!r}\n" . format(_all))
+        _dirty = False
+        _last_save = now
+
+    tmp = _filename + ".tmp"
+    try:
+        with open(tmp, "w") as f:
+            f.write("" . join(lines))
+        os.rename(tmp, _filename)
+    except Exception as e:
+        log.error("failed to write cost file {0!r}: {1}" . format(_filename, e))
+
+def _load(fpath):
+    global _all
+    with open(fpath, "r") as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            try:
+                val = float(fields[-1])
+                if fields[0] == "run" and len(fields) == 4:
+                    _run[(fields[1], fields[2])] = val
+                elif fields[0] == "prob" and len(fields) == 3:
+                    _prob[fields[1]] = val
+                elif fields[0] == "compile" and len(fields) == 3:
+                    _compile[fields[1]] = val
+                elif fields[0] == "all" and len(fields) == 2:
+                    _all = val
+                else:
+                    raise ValueError
+            except ValueError:
+                log.warning("invalid line in cost file {0!r}: {1!r}" . format(fpath, line))
+
+def _init():
+    if not _filename or not os.path.exists(_filename):
+        return
+    try:
+        _load(_filename)
+        log.info("loaded cost estimates of {0} problem(s) from {1!r}" .
+                format(len(_prob), _filename))
+    except Exception as e:
+        log.error("failed to read cost file {0!r}: {1}" . format(_filename, e))
+
+def _set_filename(arg):
+    global _filename
+    _filename = arg[1]
+
+conf.simple_conf_handler("CostFile", _set_filename, default = "orzoj-server.cost")
+conf.register_init_func(_init)
+
@@ -0,0 +1,651 @@
+# $File: evloop.py
+# $Author: Jiakai <jia.kai66@gmail.com>
+# $Date: Sun Oct 18 17:20:41 2026 +0800
+#
+# This file is part of orzoj
+#
+# Copyright (C) <2010>  Jiakai <jia.kai66@gmail.com>
+#
+# Orzoj is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Orzoj is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with orzoj.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""event-loop server mode (ServerMode event)
+
+A single thread polls the listening socket and all the judge connections,
+which are non-blocking TLS sockets. Each judge session is a coroutine
+(a generator, see _session_routine and _slot_routine) driven by the loop:
+an idle judge costs no thread, and the loop itself sends TELL_ONLINE to it
+and takes a task from the queue for it.
+
+Blocking parts of a session (handshake, which registers the judge on the
+website, and judging a task) are run by bounded worker pools, through
+mux.Channel objects fed by the loop, so work.judge_session is shared with
+the thread mode and the wire protocol is unchanged."""
+
+import socket, ssl, select, os, fcntl, errno, struct, threading, time, sys, Queue
+from collections import deque
+
+from orzoj import log, conf, control, msg, snc, mux
+from orzoj.server import work
+
+class Error(Exception):
+    pass
+
+_enabled = False
+_nworker = None
+_nweb_worker = None
+
+_MAX_OUTBUF = 1 << 20 # writers wait if more bytes are waiting to be sent
+_SEND_SIZE = 16384
+_RECV_SIZE = 65536
+_MAX_RECV_PER_EVENT = 64 # number of reads for a connection before serving others
+
+# requests yielded by session coroutines
+_RUN_WEB = 0 # (_RUN_WEB, func, args): run func(*args) in the website pool
+_RUN_TASK = 1 # (_RUN_TASK, func, args): run func(*args) in the task pool
+_GET_TASK = 2 # (_GET_TASK, slot): wait for a task for the judge
+
+class _Pool:
+    """a number of threads running blocking functions for the loop"""
+    def __init__(self, loop, name, nthread):
+        self._loop = loop
+        self._name = name
+        self._queue = Queue.Queue()
+        self.nthread = 0
+        self.nfree = 0 # only used by the loop thread; negative after shrinking
+        self._threads = list()
+        self.resize(nthread)
+
+    def resize(self, nthread):
+        """change the number of threads to @nthread; surplus threads exit
+        after finishing the functions already submitted; should be called
+        in the loop thread"""
+        delta = nthread - self.nthread
+        if delta > 0:
+            self._threads = [i for i in self._threads if i.is_alive()]
+            for i in range(delta):
+                th = threading.Thread(target = self._run, name = self._name)
+                self._threads.append(th)
+                th.start()
+        else:
+            for i in range(-delta):
+                self._queue.put(None)
+        self.nthread = nthread
+        self.nfree += delta
+
+    def submit(self, func, args, done):
+        """run func(*args) in a worker thread, and then call
+        done(ret, exc_info) in the loop thread, where exc_info is None
+        on success; should be called in the loop thread"""
+        self.nfree -= 1
+        self._queue.put((func, args, done))
+
+    def stop(self):
+        for i in self._threads:
+            self._queue.put(None)
+        for i in self._threads:
+            i.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            (func, args, done) = item
+            try:
+                ret = func(*args)
+                exc_info = None
+            except Exception:
+                ret = None
+                exc_info = sys.exc_info()
+            self._loop.call_soon(self._done, done, ret, exc_info)
+
+    def _done(self, done, ret, exc_info):
+        self.nfree += 1
+        done(ret, exc_info)
+
+
+class _Routine:
+    def __init__(self, conn, gen):
+        self.conn = conn
+        self.gen = gen
+
+
+class _Conn:
+    """a judge connection owned by the loop; it plays the role of mux.Mux
+    for its channels, which have no framing before multiplexing starts"""
+
+    def __init__(self, loop, sock, addr):
+        self.loop = loop
+        self.sock = sock
+        self.fd = sock.fileno()
+        self.addr = addr
+        self.tls_done = False
+        self.tls_want_write = False
+        self.time_connected = time.time()
+        self.closed = False
+        self.failed = False
+        self.cleaned = False
+        self.nbusy = 0 # number of routines running in worker pools
+        self.ntask_slot = 0 # number of worker slots counted by the loop
+
+        self._lock = threading.Lock()
+        self._writable = threading.Condition(self._lock)
+        self._out = deque()
+        self._out_len = 0 # number of bytes in self._out and self._sending
+        self._sending = None # the chunk being written to the TLS socket
+        self._in = "" # incomplete frame
+        self._nslot = 0 # number of channels; 0 if not multiplexed
+
+        self.channels = [mux.Channel(self, 0)]
+        self.session = work.judge_session()
+        self.session.conn = self.channels[0]
+
+    def start_mux(self, nslot):
+        """send MUX_BEGIN and start multiplexing; called by the handshake"""
+        with self._lock:
+            if self.closed:
+                raise snc.Error
+            self._append(struct.pack("!II", msg.MUX_BEGIN, nslot))
+            self.channels.extend([mux.Channel(self, i) for i in range(1, nslot)])
+            self._nslot = nslot
+        self.loop.wakeup()
+        return self.channels
+
+    def has_output(self):
+        return self._out_len > 0
+
+    def _write(self, cid, data, timeout):
+        """called by mux.Channel.write"""
+        in_loop = self.loop.in_loop()
+        with self._lock:
+            if self.closed:
+                raise snc.Error
+            if self._nslot:
+                data = struct.pack("!II", cid, len(data)) + data
+            self._append(data)
+            if not in_loop:
+                if timeout < 0:
+                    deadline = None
+                else:
+                    deadline = time.time() + timeout + snc._timeout
+                while self._out_len > _MAX_OUTBUF and not self.closed:
+                    if deadline is None:
+                        self._writable.wait(mux._POLL_INTERVAL)
+                        continue
+                    remain = deadline - time.time()
+                    if remain <= 0:
+                        log.error("failed to write to {0}: timed out" . format(self.addr))
+                        raise snc.Error
+                    self._writable.wait(remain)
+                if self.closed:
+                    raise snc.Error
+        if not in_loop:
+            self.loop.wakeup()
+
+    def _append(self, data):
+        self._out.append(data)
+        self._out_len += len(data)
+
+    def feed(self, data):
+        """deliver data read from the socket to the channels
+        may raise snc.Error on protocol error"""
+        with self._lock:
+            nslot = self._nslot
+        if not nslot:
+            self.channels[0]._feed(data)
+            return
+        buf = self._in + data
+        pos = 0
+        while len(buf) - pos >= 8:
+            (cid, length) = struct.unpack_from("!II", buf, pos)
+            if len(buf) - pos - 8 < length:
+                break
+            if cid >= nslot:
+                log.warning("data for unknown channel {0} received from {1}" .
+                        format(cid, self.addr))
+                raise snc.Error
+            self.channels[cid]._feed(buf[pos + 8:pos + 8 + length])
+            pos += 8 + length
+        self._in = buf[pos:]
+
+    def next_chunk(self):
+        """return the data to be written next, or None if nothing to write"""
+        with self._lock:
+            if self._sending is None and self._out:
+                if len(self._out[0]) >= _SEND_SIZE:
+                    chunk = self._out.popleft()
+                    if len(chunk) > _SEND_SIZE:
+                        self._out.appendleft(chunk[_SEND_SIZE:])
+                        chunk = chunk[:_SEND_SIZE]
+                else:
+                    l = list()
+                    size = 0
+                    while self._out and size < _SEND_SIZE:
+                        l.append(self._out.popleft())
+                        size += len(l[-1])
+                    chunk = "" . join(l)
+                    if len(chunk) > _SEND_SIZE:
+                        self._out.appendleft(chunk[_SEND_SIZE:])
+                        chunk = chunk[:_SEND_SIZE]
+                self._sending = chunk
+            return self._sending
+
+    def sent(self, n):
+        with self._lock:
+            if n < len(self._sending):
+                self._sending = self._sending[n:]
+            else:
+                self._sending = None
+            self._out_len -= n
+            self._writable.notify_all()
+
+    def close(self):
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+            self._writable.notify_all()
+        for i in self.channels:
+            i._on_closed()
+        try:
+            self.sock.close()
+        except Exception:
+            pass
+
+
+def _session_routine(conn):
+    slots = yield (_RUN_WEB, conn.session.handshake, (conn.start_mux, ))
+    conn.loop._set_task_slots(conn, len(slots))
+    for slot in slots:
+        conn.loop.spawn(conn, _slot_routine(conn, slot))
+
+def _slot_routine(conn, slot):
+    while True:
+        task = yield (_GET_TASK, slot)
+        yield (_RUN_TASK, conn.session.solve_task, (slot, task))
+
+
+class Loop:
+    def __init__(self, port):
+        """listen on @port; may raise Error"""
+        try:
+            ctx = ssl.SSLContext(ssl.PROTOCOL_TLSv1)
+            ctx.verify_mode = ssl.CERT_REQUIRED
+            ctx.load_verify_locations(snc._ca_file)
+            ctx.load_cert_chain(snc._cert_file, snc._key_file)
+            self._ctx = ctx
+
+            if snc._use_ipv6:
+                s = socket.socket(socket.AF_INET6, socket.SOCK_STREAM)
+            else:
+                s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            s.bind(("", port))
+            s.listen(128)
+            s.setblocking(False)
+            self._lsock = s
+        except Exception as e:
+            log.error("failed to start event loop: {0!r}" . format(e))
+            raise Error
+
+        (self._wake_r, self._wake_w) = os.pipe()
+        for fd in (self._wake_r, self._wake_w):
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+        self._thread = None
+        self._calls = deque()
+        self._calls_lock = threading.Lock()
+        self._conns = dict() # dict of <fd> => <_Conn>
+        self._ready = set() # connections with data buffered in SSL
+        self._idle = list() # list of (routine, slot) waiting for tasks
+        self._dirty = False
+        # whether tasks or free slots may have changed since the last _dispatch
+        self._nslot = 0 # number of worker slots of all the judges
+        self._task_pool = None
+        self._web_pool = None
+
+    def in_loop(self):
+        return threading.current_thread() is self._thread
+
+    def wakeup(self):
+        try:
+            os.write(self._wake_w, "x")
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def _on_put(self):
+        """called by the task queue after a task is put; thread-safe"""
+        self._dirty = True
+        self.wakeup()
+
+    def call_soon(self, func, *args):
+        """call func(*args) in the loop thread; thread-safe"""
+        with self._calls_lock:
+            self._calls.append((func, args))
+        self.wakeup()
+
+    def spawn(self, conn, gen):
+        self._step(_Routine(conn, gen))
+
+    def run(self):
+        """serve judges until the termination flag is set"""
+        self._thread = threading.current_thread()
+        self._task_pool = _Pool(self, "evloop._task_worker", _nworker)
+        self._web_pool = _Pool(self, "evloop._web_worker", _nweb_worker)
+        work.set_put_callback(self._on_put)
+
+        next_tick = time.time()
+        terminating = False
+        while True:
+            if not terminating and control.test_termination_flag():
+                terminating = True
+                self._lsock.close()
+                self._idle = list()
+            if terminating and self._task_pool.nfree == self._task_pool.nthread and \
+                    self._web_pool.nfree == self._web_pool.nthread:
+                break
+
+            now = time.time()
+            if now >= next_tick:
+                self._tick(now)
+                next_tick = now + msg.TELL_ONLINE_INTERVAL
+            if not terminating and self._dirty:
+                self._dirty = False
+                self._dispatch()
+
+            p = select.poll()
+            p.register(self._wake_r, select.POLLIN)
+            if not terminating:
+                p.register(self._lsock, select.POLLIN)
+            for (fd, conn) in self._conns.iteritems():
+                ev = select.POLLIN
+                if conn.tls_want_write or (conn.tls_done and conn.has_output()):
+                    ev |= select.POLLOUT
+                p.register(fd, ev)
+
+            if self._ready:
+                timeout = 0
+            else:
+                timeout = max(0, next_tick - time.time()) * 1000
+            try:
+                events = p.poll(timeout)
+            except select.error as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+
+            for (fd, ev) in events:
+                if fd == self._wake_r:
+                    try:
+                        while os.read(self._wake_r, 4096):
+                            pass
+                    except OSError:
+                        pass
+                elif not terminating and fd == self._lsock.fileno():
+                    self._accept()
+                else:
+                    conn = self._conns.get(fd)
+                    if conn is None:
+                        continue
+                    if ev & (select.POLLIN | select.POLLERR | select.POLLHUP):
+                        self._on_readable(conn)
+                    if ev & select.POLLOUT and not conn.closed:
+                        self._on_writable(conn)
+
+            for conn in list(self._ready):
+                self._ready.discard(conn)
+                if not conn.closed:
+                    self._on_readable(conn)
+
+            while True:
+                with self._calls_lock:
+                    if not self._calls:
+                        break
+                    (func, args) = self._calls.popleft()
+                func(*args)
+
+        work.set_put_callback(None)
+        for conn in self._conns.values():
+            conn.close()
+        self._conns = dict()
+        self._task_pool.stop()
+        self._web_pool.stop()
+
+    def _accept(self):
+        while True:
+            try:
+                (sock, addr) = self._lsock.accept()
+            except socket.error as e:
+                if e.errno != errno.EAGAIN and e.errno != errno.EINTR:
+                    log.warning("failed to accept connection: {0}" . format(e))
+                return
+            addr = "{0}:{1}" . format(addr[0], addr[1])
+            log.info("connected by {0!r}" . format(addr))
+            try:
+                sock.setblocking(False)
+                sock = self._ctx.wrap_socket(sock, server_side = True,
+                        do_handshake_on_connect = False)
+            except Exception as e:
+                log.warning("failed to establish SSL connection with {0}: {1}" .
+                        format(addr, e))
+                sock.close()
+                continue
+            conn = _Conn(self, sock, addr)
+            self._conns[conn.fd] = conn
+
+    def _close(self, conn):
+        conn.close()
+        self._conns.pop(conn.fd, None)
+        self._ready.discard(conn)
+        self._check_clean(conn)
+
+    def _fail(self, conn, e):
+        """@conn fails because of exception @e; should be called while
+        handling @e so that the traceback could be logged"""
+        if not conn.failed and not conn.closed:
+            conn.failed = True
+            conn.session.on_error(e)
+        self._close(conn)
+
+    def _check_clean(self, conn):
+        if conn.closed and not conn.nbusy and not conn.cleaned and conn.tls_done:
+            conn.cleaned = True
+            self._set_task_slots(conn, 0)
+            if not control.test_termination_flag():
+                self._web_pool.submit(conn.session.clean, (), self._clean_done)
+
+    def _set_task_slots(self, conn, nslot):
+        """set the number of worker slots of @conn to @nslot; the task pool
+        grows up to the number of slots of all the judges (see _dispatch)"""
+        self._nslot += nslot - conn.ntask_slot
+        conn.ntask_slot = nslot
+        pool = self._task_pool
+        if pool.nthread > max(_nworker, self._nslot):
+            pool.resize(max(_nworker, self._nslot))
+
+    def _clean_done(self, ret, exc_info):
+        if exc_info:
+            log.error("failed to clean up judge session: {0}" . format(exc_info[1]))
+
+    def _on_readable(self, conn):
+        if not conn.tls_done:
+            self._do_handshake(conn)
+            return
+        try:
+            for i in range(_MAX_RECV_PER_EVENT):
+                try:
+                    data = conn.sock.recv(_RECV_SIZE)
+                except (ssl.SSLWantReadError, ssl.SSLWantWriteError):
+                    return
+                if not data:
+                    raise snc.Error
+                conn.feed(data)
+            if conn.sock.pending():
+                self._ready.add(conn)
+        except (snc.Error, ssl.SSLError, socket.error) as e:
+            if not isinstance(e, snc.Error):
+                log.error("failed to read from {0}: {1!r}" . format(conn.addr, e))
+            self._fail(conn, snc.Error())
+
+    def _on_writable(self, conn):
+        if not conn.tls_done:
+            self._do_handshake(conn)
+            return
+        try:
+            while True:
+                chunk = conn.next_chunk()
+                if chunk is None:
+                    return
+                n = conn.sock.send(chunk)
+                if not n:
+                    return
+                conn.sent(n)
+        except (ssl.SSLError, socket.error) as e:
+            log.error("failed to write to {0}: {1!r}" . format(conn.addr, e))
+            self._fail(conn, snc.Error())
+
+    def _do_handshake(self, conn):
+        conn.tls_want_write = False
+        try:
+            conn.sock.do_handshake()
+        except ssl.SSLWantReadError:
+            return
+        except ssl.SSLWantWriteError:
+            conn.tls_want_write = True
+            return
+        except Exception as e:
+            log.error("failed to establish SSL connection with {0}:\n{1!r}" .
+                    format(conn.addr, e))
+            self._close(conn)
+            return
+        conn.tls_done = True
+        self.spawn(conn, _session_routine(conn))
+
+    def _step(self, r, value = None, exc_info = None):
+        conn = r.conn
+        try:
+            if exc_info:
+                req = r.gen.throw(exc_info[0], exc_info[1], exc_info[2])
+            else:
+                req = r.gen.send(value)
+        except StopIteration:
+            return
+        except Exception as e:
+            self._fail(conn, e)
+            return
+
+        if conn.closed:
+            r.gen.close()
+            self._check_clean(conn)
+            return
+
+        if req[0] == _GET_TASK:
+            self._idle.append((r, req[1]))
+            self._dirty = True
+            return
+
+        if req[0] == _RUN_TASK:
+            pool = self._task_pool
+        else:
+            pool = self._web_pool
+        conn.nbusy += 1
+        pool.submit(req[1], req[2], lambda ret, exc_info: self._on_done(r, ret, exc_info))
+
+    def _on_done(self, r, ret, exc_info):
+        conn = r.conn
+        conn.nbusy -= 1
+        # a task worker may have become free
+        self._dirty = True
+        if conn.closed:
+            self._check_clean(conn)
+            return
+        self._step(r, ret, exc_info)
+
+    def _dispatch(self):
+        """take tasks for idle slots, adding task workers when all of them
+        are busy, so that every slot of the judges could run a task"""
+        idle = self._idle
+        pool = self._task_pool
+        if not idle:
+            return
+        self._idle = list()
+        for (pos, (r, slot)) in enumerate(idle):
+            if r.conn.closed:
+                continue
+            if pool.nfree <= 0 and pool.nthread >= self._nslot:
+                self._idle.extend(idle[pos:])
+                return
+            task = r.conn.session.get_task()
+            if task is None:
+                self._idle.append((r, slot))
+            else:
+                if pool.nfree <= 0:
+                    pool.resize(pool.nthread + 1)
+                self._step(r, task)
+        # let other judges try first next time
+        if len(self._idle) > 1:
+            self._idle.append(self._idle.pop(0))
+
+    def _tick(self, now):
+        """send TELL_ONLINE to idle slots, drop stalled TLS handshakes and
+        stop the task workers added but no longer needed"""
+        # tasks held back by the queue (see sched.Task_queue) may be
+        # released as time goes by
+        self._dirty = True
+        pool = self._task_pool
+        if pool.nfree > 0 and pool.nthread > _nworker:
+            pool.resize(max(_nworker, pool.nthread - pool.nfree))
+        for (r, slot) in self._idle:
+            if not r.conn.closed:
+                try:
+                    msg.write_msg(slot.conn, msg.TELL_ONLINE)
+                except snc.Error:
+                    pass
+        for conn in self._conns.values():
+            if not conn.tls_done and now - conn.time_connected > snc._timeout:
+                log.warning("SSL handshake with {0} timed out" . format(conn.addr))
+                self._close(conn)
+
+
+def is_enabled():
+    return _enabled
+
+def _set_server_mode(arg):
+    global _enabled
+    if arg[1] == "thread":
+        _enabled = False
+    elif arg[1] == "event":
+        if not conf.is_unix:
+            raise conf.UserError("{0} event is only avaliable on Unix systems" . format(arg[0]))
+        _enabled = True
+    else:
+        raise conf.UserError("unknown server mode: {0!r}" . format(arg[1]))
+
+def _set_nworker(arg):
+    global _nworker
+    _nworker = int(arg[1])
+    if _nworker < 1:
+        raise conf.UserError("Option {0} can not be less than 1" . format(arg[0]))
+
+def _set_nweb_worker(arg):
+    global _nweb_worker
+    _nweb_worker = int(arg[1])
+    if _nweb_worker < 1:
+        raise conf.UserError("Option {0} can not be less than 1" . format(arg[0]))
+
+conf.simple_conf_handler("ServerMode", _set_server_mode, default = "thread")
+conf.simple_conf_handler("EventTaskWorkers", _set_nworker, default = "16")
+conf.simple_conf_handler("EventWebWorkers", _set_nweb_worker, default = "4")
@@ -0,0 +1,258 @@
+# $File: journal.py
+# $Author: Jiakai <jia.kai66@gmail.com>
+# $Date: Sun Oct 18 14:37:05 2026 +0800
+#
+# This file is part of orzoj
+#
+# Copyright (C) <2010>  Jiakai <jia.kai66@gmail.com>
+#
+# Orzoj is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Orzoj is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with orzoj.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""append-only journal of the tasks on orzoj-server, so that unfinished
+tasks could be resumed after a restart
+
+journal file format:
+    a sequence of records, each of which is
+        <type:char> <length of payload:int>\\n<payload>\\n
+    type:
+        Q -- a task has been queued, payload: phpserialize.dumps(<task attributes>),
+             with an extra attribute "rejudge" set to the number of the
+             batch (see web.fetch_tasks) for a task in a rejudge batch
+        D -- a task has been dispatched, payload: <task id> <judge id>
+        F -- a task has been finished, payload: <task id>
+    an incomplete record at the end of the file (written when crashed) is ignored
+
+records are written by a background thread, which fsync()s once for all the
+records appended during JournalCommitInterval seconds (group commit)
+"""
+
+import os, os.path, threading, sys
+
+from orzoj import conf, log, control, structures, phpserialize
+
+_filename = None
+_commit_interval = None
+
+_journal = None
+_recovered_tasks = None
+
+class _Journal(threading.Thread):
+    def __init__(self, fpath, pending):
+        """@pending: dict of <task id:int> => <payload of Q record:str>
+        for unfinished tasks"""
+        threading.Thread.__init__(self, name = "journal._Journal")
+        self._fpath = fpath
+        self._pending = pending
+        self._nrecord = 0
+        self._cond = threading.Condition()
+        self._buf = list()
+        self._seq = 0       # sequence number of the last record appended
+        self._synced = 0    # sequence number of the last record written to disk
+        self._stopped = False
+        self._compact()
+
+    def append(self, rtype, tid, payload, wait):
+        """append a record, and if @wait is True, do not return until it
+        has been written to disk"""
+        rec = "{0} {1}\n{2}\n" . format(rtype, len(payload), payload)
+        with self._cond:
+            if rtype == 'Q':
+                self._pending[tid] = payload
+            elif rtype == 'F':
+                self._pending.pop(tid, None)
+            self._buf.append(rec)
+            self._seq += 1
+            seq = self._seq
+            self._cond.notify_all()
+            if wait:
+                while self._synced < seq and not self._stopped:
+                    self._cond.wait()
+
+    def run(self):
+        while True:
+            with self._cond:
+                while not self._buf and not self._stopped and \
+                        not control.test_termination_flag():
+                    self._cond.wait(1)
+                if not self._buf and (self._stopped or control.test_termination_flag()):
+                    self._stopped = True
+                    self._cond.notify_all()
+                    return
+                if _commit_interval > 0 and not self._stopped:
+                    # wait for more records to commit together
+                    self._cond.wait(_commit_interval)
+                buf = self._buf
+                self._buf = list()
+                seq = self._seq
+                need_compact = self._nrecord + len(buf) > len(self._pending) * 2 + 1024
+                if need_compact:
+                    pending = dict(self._pending)
+
+            try:
+                if need_compact:
+                    self._compact(pending)
+                else:
+                    self._fobj.write("" . join(buf))
+                    self._fobj.flush()
+                    os.fsync(self._fobj.fileno())
+                    self._nrecord += len(buf)
+            except Exception as e:
+                log.error("failed to write task journal: {0}" . format(e))
+
+            with self._cond:
+                self._synced = seq
+                self._cond.notify_all()
+
+    def _compact(self, pending = None):
+        """rewrite the journal file with Q records of unfinished tasks only"""
+        if pending is None:
+            pending = self._pending
+        tmp = self._fpath + ".tmp"
+        with open(tmp, "wb") as f:
+            for payload in pending.itervalues():
+                f.write("Q {0}\n{1}\n" . format(len(payload), payload))
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp, self._fpath)
+        try:
+            fd = os.open(os.path.dirname(os.path.abspath(self._fpath)), os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        except OSError:
+            pass
+        if getattr(self, "_fobj", None):
+            self._fobj.close()
+        self._fobj = open(self._fpath, "ab")
+        self._nrecord = len(pending)
+
+def _replay(fpath):
+    """return a tuple (pending, ndispatched), where pending is a dict
+    of <task id> => <payload of Q record> for unfinished tasks, and
+    ndispatched is the number of those which had been dispatched to judges"""
+    pending = dict()
+    dispatched = set()
+    with open(fpath, "rb") as f:
+        data = f.read()
+    pos = 0
+    while pos < len(data):
+        end = data.find("\n", pos)
+        if end == -1:
+            break
+        try:
+            (rtype, plen) = data[pos:end].split(" ")
+            plen = int(plen)
+        except ValueError:
+            log.warning("corrupted task journal record at offset {0}, ignoring the rest" .
+                    format(pos))
+            break
+        payload = data[end + 1:end + 1 + plen]
+        if len(payload) != plen or data[end + 1 + plen:end + 2 + plen] != "\n":
+            log.warning("incomplete task journal record at offset {0}" . format(pos))
+            break
+        pos = end + 2 + plen
+        if rtype == 'Q':
+            tid = int(phpserialize.loads(payload)["id"])
+            pending[tid] = payload
+        elif rtype == 'D':
+            dispatched.add(int(payload.split(" ", 1)[0]))
+        elif rtype == 'F':
+            pending.pop(int(payload), None)
+
+    return (pending, len(dispatched.intersection(pending)))
+
+def start():
+    """start writing the journal; should be called after the program has
+    become a daemon"""
+    if _journal:
+        _journal.start()
+
+def recovered_tasks():
+    """return the list of unfinished tasks read from the journal at startup,
+    or None if the journal is disabled or did not exist, meaning all the tasks
+    should be fetched from the website again"""
+    return _recovered_tasks
+
+def tasks_queued(tasks):
+    """record that @tasks have been fetched from the website and queued
+    return after the records have been written to disk"""
+    if _journal:
+        for i in range(len(tasks)):
+            task = tasks[i]
+            d = dict()
+            for j in structures.task().__dict__:
+                d[j] = task.__dict__[j]
+            if task.rejudge_batch is not None:
+                d["rejudge"] = task.rejudge_batch
+            _journal.append('Q', task.id, phpserialize.dumps(d), i == len(tasks) - 1)
+
+def task_dispatched(task, judge):
+    if _journal:
+        _journal.append('D', task.id, "{0} {1}" . format(task.id, judge.id), False)
+
+def task_finished(task):
+    if _journal:
+        _journal.append('F', task.id, str(task.id), False)
+
+def _init():
+    global _journal, _recovered_tasks
+    if not _filename:
+        return
+    pending = dict()
+    try:
+        if os.path.exists(_filename):
+            (pending, ndispatched) = _replay(_filename)
+            _recovered_tasks = list()
+            for payload in pending.itervalues():
+                d = phpserialize.loads(payload)
+                task = structures.task()
+                for i in task.__dict__:
+                    task.__dict__[i] = d[i]
+                task.id = int(task.id)
+                task.rejudge_batch = None
+                if "rejudge" in d:
+                    task.rejudge_batch = int(d["rejudge"])
+                _recovered_tasks.append(task)
+            _recovered_tasks.sort(key = lambda t: t.id)
+            # the batches fetched after restart are numbered from 1 again,
+            # so the recovered batches are renumbered to come before them
+            batches = [t.rejudge_batch for t in _recovered_tasks if t.rejudge_batch is not None]
+            if batches:
+                last = max(batches)
+                for t in _recovered_tasks:
+                    if t.rejudge_batch is not None:
+                        t.rejudge_batch -= last
+            log.info("recovered {0} unfinished task(s) ({1} dispatched) from task journal" .
+                    format(len(_recovered_tasks), ndispatched))
+        _journal = _Journal(_filename, pending)
+    except Exception as e:
+        log.error("failed to open task journal {0!r}: {1}" . format(_filename, e))
+        sys.exit("orzoj-server: failed to open task journal")
+
+def _set_filename(arg):
+    global _filename
+    _filename = arg[1]
+
+def _set_commit_interval(arg):
+    global _commit_interval
+    _commit_interval = float(arg[1])
+    if _commit_interval < 0:
+        raise conf.UserError("Option {0} can not be negative" . format(arg[0]))
+
+conf.simple_conf_handler("JournalFile", _set_filename, default = "orzoj-server.journal")
+conf.simple_conf_handler("JournalCommitInterval", _set_commit_interval, default = "0.02")
+conf.register_init_func(_init)
+
@@ -24,7 +24,7 @@
 
 import sys, optparse, time, threading, os
 from orzoj import log, conf, control, daemon, snc
-from orzoj.server import work
+from orzoj.server import work, evloop
 
 SERVER_VERSION = 0x00000101
 # major(16 bit),minor(8 bit),revision(8 bit)
@@ -60,6 +60,30 @@ def run_server():
 
     daemon.pid_start()
 
+    if evloop.is_enabled():
+        try:
+            loop = evloop.Loop(_port)
+        except evloop.Error:
+            daemon.pid_end()
+            return
+        log.info("orzoj-server started in event mode, listening on {0}" .
+                format(_port))
+        threading.Thread(target = work.thread_work, name = "work.thread_work").start()
+        loop.run()
+    else:
+        _run_threads()
+
+    while threading.active_count() > 1:
+        log.debug("waiting for threads, current active count: {0}" .
+                format(threading.active_count()))
+        for i in threading.enumerate():
+            log.debug("active thread: {0!r}" . format(i.name))
+        time.sleep(1)
+
+    daemon.pid_end()
+
+def _run_threads():
+    """accept connections and serve each judge in its own thread"""
     try:
         s = snc.socket(None, _port)
     except snc.Error:
@@ -83,14 +107,6 @@ def run_server():
         work.thread_new_judge_connection(conn).start()
 
     s.close()
-    while threading.active_count() > 1:
-        log.debug("waiting for threads, current active count: {0}" .
-                format(threading.active_count()))
-        for i in threading.enumerate():
-            log.debug("active thread: {0!r}" . format(i.name))
-        time.sleep(1)
-
-    daemon.pid_end()
 
 
 def _set_port(arg):
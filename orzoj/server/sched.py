@@ -0,0 +1,418 @@
+# $File: sched.py
+# $Author: Jiakai <jia.kai66@gmail.com>
+# $Date: Sun Oct 18 10:12:40 2026 +0800
+#
+# This file is part of orzoj
+#
+# Copyright (C) <2010>  Jiakai <jia.kai66@gmail.com>
+#
+# Orzoj is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Orzoj is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with orzoj.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""task queue and scheduling of tasks among judges"""
+
+import threading, heapq, time
+from collections import deque
+
+from orzoj import control, msg, log
+
+# An entry in the queue is a list [key, seq, task, alive],
+# where key decides the order of tasks (see Task_queue.key_func), seq is a
+# tie-breaker, and alive is set to False once the task has been taken.
+# Entries are shared by the global heap and all the views containing
+# the task's language, and dead entries are removed lazily.
+_E_KEY, _E_SEQ, _E_TASK, _E_ALIVE = range(4)
+
+_LATENCY_WINDOW = 1024 # number of recent dispatches to compute latency statistics
+_AFFINITY_SCAN = 16 # number of tasks to examine for data affinity in each get()
+
+STAGES = ("sync", "compile", "run")
+
+class _View:
+    def __init__(self, lang_id_set, cond):
+        self.lang_id_set = lang_id_set
+        self.heap = list()
+        self.nalive = 0 # number of alive entries in self.heap
+        self.nref = 0 # number of judges using this view
+        self.cond = cond # notified when a usable task is put
+
+class _Judge:
+    """scheduling information about a connected judge"""
+    def __init__(self, name, view, nslot):
+        self.name = name
+        self.view = view
+        self.nslot = nslot # number of tasks the judge could run at the same time
+        self.warm = set() # problems whose data have been synchronized to the judge
+        self.cache_hit = 0 # number of tasks that required no data transfer
+        self.cache_miss = 0
+        self.busy_since = dict()
+        # dict of <task id:int> => <time when the running task was taken>
+        self.ewma = dict()
+        # dict of <stage name:str> => <exponentially weighted moving average of
+        # time in seconds>, where stage name is one of STAGES or "total"
+
+class Task_queue:
+    """a priority queue of tasks, indexed by the set of languages
+    supported by each judge
+
+    Every distinct language set has a view, which is a heap containing the
+    tasks in those languages, so a judge finds its first usable task at the
+    top of its view instead of scanning a queue per language. Each task is
+    pushed to, and eventually popped from, every view containing its
+    language, so a task costs O(v log n) time in total, where v is the number
+    of such views (at most the number of distinct language sets of the
+    connected judges). The views allow ordering tasks by arbitrary keys
+    (see key_func); they are not faster than per-language FIFO queues
+    (see test/bench-task-queue.py).
+
+    If affinity_delay is positive, a task whose problem data are held by
+    some other judge is reserved for that judge for at most affinity_delay
+    seconds before a judge without the data could take it, provided that
+    judge is idle or expected (see balance_alpha) to finish a task by then.
+
+    If balance_alpha is positive, the time a judge spends on each stage of
+    a task is tracked as an exponentially weighted moving average with
+    factor balance_alpha, and a judge would leave the tasks to faster judges
+    which are expected to finish them earlier."""
+
+    def __init__(self, max_size = None):
+        self.max_size = max_size # None means no limit
+        self.affinity_delay = 0
+        self.balance_alpha = 0
+        self.put_callback = None
+        # if not None, called without arguments after each put() returns
+        self.key_func = None
+        # if not None, key_func(task) returns the key to order the tasks
+        # (smaller first) when a task is put for the first time; otherwise
+        # tasks are ordered by id
+        #
+        # tasks whose attribute rejudge_batch is not None are put in a lane
+        # after all the other tasks, ordered by (rejudge_batch, problem, key),
+        # so that rejudging a problem goes on in a row without delaying new
+        # submissions
+
+        self._lock = threading.Lock()
+        self._not_full = threading.Condition(self._lock)
+        self._heap = list()
+        self._size = 0
+        self._seq = 0
+
+        self._views = dict()
+        # dict of <language id set:frozenset> => <view:_View>
+        self._lang_views = dict()
+        # dict of <language id:int> => <views containing the language:list>
+
+        self._latency = deque(maxlen = _LATENCY_WINDOW)
+        # time in seconds spent in the queue by recently dispatched tasks,
+        # recorded only if debug messages are logged
+
+        self._warm = dict()
+        # dict of <problem code:str> => <judges holding the data:set of _Judge>
+
+        self._judges = set()
+
+    def register(self, name, lang_id_set, nslot = 1):
+        """register a judge named @name supporting languages in @lang_id_set,
+        which could run at most @nslot tasks at the same time
+        return a handle, which should be passed to get();
+        call unregister() after use"""
+        lang_id_set = frozenset(lang_id_set)
+        with self._lock:
+            try:
+                view = self._views[lang_id_set]
+            except KeyError:
+                view = _View(lang_id_set, threading.Condition(self._lock))
+                view.heap = [e for e in self._heap
+                        if e[_E_ALIVE] and e[_E_TASK].lang_id in lang_id_set]
+                heapq.heapify(view.heap)
+                view.nalive = len(view.heap)
+                self._views[lang_id_set] = view
+                for lid in lang_id_set:
+                    self._lang_views.setdefault(lid, list()).append(view)
+            view.nref += 1
+            judge = _Judge(name, view, nslot)
+            self._judges.add(judge)
+            return judge
+
+    def unregister(self, judge):
+        with self._lock:
+            self._judges.remove(judge)
+            for prob in judge.warm:
+                s = self._warm[prob]
+                s.remove(judge)
+                if not s:
+                    del self._warm[prob]
+            judge.warm.clear()
+
+            view = judge.view
+            view.nref -= 1
+            if view.nref:
+                return
+            del self._views[view.lang_id_set]
+            for lid in view.lang_id_set:
+                l = self._lang_views[lid]
+                l.remove(view)
+                if not l:
+                    del self._lang_views[lid]
+
+    def set_data_synced(self, judge, prob, transferred):
+        """tell the queue that data of @prob have been synchronized to @judge,
+        and @transferred indicates whether any file was actually transferred"""
+        with self._lock:
+            if transferred:
+                judge.cache_miss += 1
+            else:
+                judge.cache_hit += 1
+            if prob not in judge.warm:
+                judge.warm.add(prob)
+                self._warm.setdefault(prob, set()).add(judge)
+
+    def put(self, task, block = True):
+        """put @task into the queue; if @block is True, wait until the
+        queue is not full or the termination flag is set"""
+        with self._lock:
+            if block:
+                while self._is_full() and not control.test_termination_flag():
+                    self._not_full.wait(msg.TELL_ONLINE_INTERVAL)
+            self._seq += 1
+            task.time_queued = time.time()
+            key = getattr(task, "sched_key", None)
+            if key is None:
+                # a requeued task keeps its position
+                if self.key_func:
+                    key = self.key_func(task)
+                else:
+                    key = task.id
+                batch = getattr(task, "rejudge_batch", None)
+                if batch is None:
+                    key = (0, key)
+                else:
+                    key = (1, batch, task.prob, key)
+                task.sched_key = key
+            e = [key, self._seq, task, True]
+            heapq.heappush(self._heap, e)
+            self._size += 1
+            for view in self._lang_views.get(task.lang_id, ()):
+                heapq.heappush(view.heap, e)
+                view.nalive += 1
+                if self.affinity_delay > 0 or self.balance_alpha > 0:
+                    # the waiter woken by notify() may leave the task
+                    # for another judge
+                    view.cond.notify_all()
+                else:
+                    view.cond.notify()
+        if self.put_callback:
+            self.put_callback()
+
+    def get(self, judge, timeout = 0):
+        """get the task with minimal key usable by @judge
+        wait at most @timeout seconds for a task to come
+        return None if no usable task"""
+        with self._lock:
+            if timeout > 0:
+                deadline = time.time() + timeout
+            while True:
+                h = judge.view.heap
+                while h and not h[0][_E_ALIVE]:
+                    heapq.heappop(h)
+                wait = None
+                if h and not (self.balance_alpha > 0 and
+                        self._should_hold(judge, h[0][_E_TASK])):
+                    if self.affinity_delay <= 0:
+                        return self._take_by(judge, heapq.heappop(h))
+                    (e, wait) = self._get_affinity(judge)
+                    if e is not None:
+                        return self._take_by(judge, e)
+                if timeout <= 0:
+                    return None
+                remain = deadline - time.time()
+                if remain <= 0:
+                    return None
+                if wait is not None and wait < remain:
+                    remain = wait
+                judge.view.cond.wait(remain)
+
+    def task_done(self, judge, task, stages):
+        """@judge has finished @task, and @stages is a dict of
+        <stage name> => <time in seconds> for the stages it went through"""
+        with self._lock:
+            judge.busy_since.pop(task.id, None)
+            if self.balance_alpha <= 0:
+                return
+            for i in STAGES:
+                if i in stages:
+                    self._update_ewma(judge, i, stages[i])
+            if "run" in stages:
+                self._update_ewma(judge, "total", sum(stages.itervalues()))
+
+    def stat_str(self, judge):
+        """return a human-readable string describing the statistics of @judge"""
+        with self._lock:
+            ret = "data cache hit: {0}, miss: {1}" . format(judge.cache_hit, judge.cache_miss)
+            t = judge.ewma.get("total")
+            if t is None:
+                return ret
+            ret += "; average time: " + ", " . join(["{0} {1:.3f}s" . format(i, judge.ewma[i])
+                for i in STAGES + ("total", ) if i in judge.ewma])
+            tp = [j.nslot / j.ewma["total"] for j in self._judges if "total" in j.ewma]
+            ret += "; throughput {0:.3f} tasks/s, weight {1:.3f}" . format(judge.nslot / t,
+                    len(tp) * judge.nslot / t / sum(tp))
+            return ret
+
+    def _update_ewma(self, judge, stage, val):
+        try:
+            judge.ewma[stage] += self.balance_alpha * (val - judge.ewma[stage])
+        except KeyError:
+            judge.ewma[stage] = float(val)
+
+    def _should_hold(self, judge, task):
+        """whether @judge should leave @task, the first task in its view,
+        to faster judges, which is true if there are no more tasks in the
+        view than the slots of other judges able to run @task and expected
+        to finish a task earlier than @judge
+        self._lock must be held"""
+        t = judge.ewma.get("total")
+        if t is None:
+            return False
+        now = time.time()
+        view = judge.view
+        nfaster = 0
+        for j in self._judges:
+            tj = j.ewma.get("total")
+            if j is judge or tj is None or tj >= t:
+                continue
+            if task.lang_id not in j.view.lang_id_set:
+                continue
+            free = self._time_to_free(j, now)
+            if free is None:
+                continue
+            nfree = max(1, j.nslot - len(j.busy_since))
+            if free + tj < t:
+                nfaster += nfree
+                if nfaster >= view.nalive:
+                    return True
+        return False
+
+    def _get_affinity(self, judge):
+        """choose a task for @judge from the first _AFFINITY_SCAN tasks
+        in its view, preferring tasks whose data are already on @judge and
+        leaving tasks reserved for other judges
+        return a tuple (entry, wait), where entry is the removed entry or
+        None if no task could be taken, in which case wait is the time in
+        seconds before some reserved task is released
+        self._lock must be held"""
+        h = judge.view.heap
+        now = time.time()
+        cand = list()
+        chosen = None
+        first_free = None
+        wait = None
+        while h and len(cand) < _AFFINITY_SCAN:
+            e = heapq.heappop(h)
+            if not e[_E_ALIVE]:
+                continue
+            cand.append(e)
+            task = e[_E_TASK]
+            if task.prob in judge.warm:
+                chosen = e
+                break
+            if first_free is None:
+                release = task.time_queued + self.affinity_delay
+                if release <= now or not self._has_warm_judge(task, judge, release - now):
+                    first_free = e
+                elif wait is None or release - now < wait:
+                    wait = release - now
+        if chosen is None:
+            chosen = first_free
+        for e in cand:
+            if e is not chosen:
+                heapq.heappush(h, e)
+        return (chosen, wait)
+
+    def _has_warm_judge(self, task, judge, remain):
+        """whether some judge other than @judge could take @task, holds its
+        data, and is expected to have a free slot within @remain seconds
+        self._lock must be held"""
+        now = time.time()
+        for j in self._warm.get(task.prob, ()):
+            if j is not judge and task.lang_id in j.view.lang_id_set:
+                free = self._time_to_free(j, now)
+                if free is not None and free < remain:
+                    return True
+        return False
+
+    def _time_to_free(self, judge, now):
+        """return the expected time in seconds before @judge has a free slot,
+        or None if it is busy and the time could not be estimated
+        self._lock must be held"""
+        if len(judge.busy_since) < judge.nslot:
+            return 0
+        t = judge.ewma.get("total")
+        if t is None:
+            return None
+        elapsed = now - min(judge.busy_since.itervalues())
+        if elapsed > t * 2:
+            # the estimation for the judge does not work now
+            return None
+        return max(0, t - elapsed)
+
+    def nfree(self):
+        """return the number of tasks that could be put without blocking,
+        or None if the size of the queue is not limited"""
+        with self._lock:
+            if self.max_size is None:
+                return None
+            return max(0, self.max_size - self._size)
+
+    def __len__(self):
+        with self._lock:
+            return self._size
+
+    def latency_stat(self):
+        """return a tuple (median, max) of the time in seconds that recently
+        dispatched tasks waited in the queue, or None if nothing dispatched"""
+        with self._lock:
+            l = list(self._latency)
+        if not l:
+            return None
+        l.sort()
+        return (l[len(l) / 2], l[-1])
+
+    def _take_by(self, judge, e):
+        task = self._take(e)
+        judge.busy_since[task.id] = time.time()
+        return task
+
+    def _take(self, e):
+        """mark entry @e as taken and return its task
+        self._lock must be held"""
+        e[_E_ALIVE] = False
+        task = e[_E_TASK]
+        self._size -= 1
+        if log.debug_enabled():
+            self._latency.append(time.time() - task.time_queued)
+        for view in self._lang_views.get(task.lang_id, ()):
+            view.nalive -= 1
+            if len(view.heap) > view.nalive * 2 + 16:
+                view.heap = [i for i in view.heap if i[_E_ALIVE]]
+                heapq.heapify(view.heap)
+        if len(self._heap) > self._size * 2 + 16:
+            self._heap = [i for i in self._heap if i[_E_ALIVE]]
+            heapq.heapify(self._heap)
+        self._not_full.notify()
+        return task
+
+    def _is_full(self):
+        return self.max_size is not None and self._size >= self.max_size
+
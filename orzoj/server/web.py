@@ -41,22 +41,40 @@ version 1:
 
     website can send 'relogin' for requesting a new login
 
+    compression:
+        if WebCompressMin is positive, "compress=gzip" is added to the query of
+        login1, and a website supporting it answers "<dynamic_passwd> gzip"
+        (so the dynamic password must not contain white spaces); then in the
+        request and the response, "data" could be replaced by "datagz", which
+        is "data" compressed in gzip format; the checksum is still computed
+        over the uncompressed data
+        orzoj-server compresses data of at least WebCompressMin bytes
+
 """
 
 _VERSION = 1
 _DYNAMIC_PASSWD_MAXLEN = 128
 
-import urllib2, urllib, sys, hashlib, threading, time
+import urllib2, urllib, urlparse, httplib, socket, sys, hashlib, threading, time, zlib, random, errno
 
 from orzoj import conf, log, structures, control, phpserialize
+from orzoj.server import journal
 
 _static_passwd = None
 _passwd = None
 _retry_cnt = None
 _retry_wait = None
+_retry_max_wait = None
 _timeout = None
 _web_addr = None
 _sched_interval = None
+_pool_size = None
+_pool = None
+_batch_interval = None
+_batch_size = None
+_batcher = None
+_compress_min = None
+_web_gzip = False
 _thread_req_id = dict()
 _lock_thread_req_id = threading.Lock()
 _lock_relogin = threading.Lock()
@@ -67,15 +85,222 @@ class _internal_error(Exception):
     def __repr__(self):
         return self.msg
 
+class _website_error(_internal_error):
+    """the website is working but failed to handle the request"""
+    pass
+
 class Error(Exception):
     pass
 
+class Unavailable(Error):
+    """the request is not sent because the website is considered down"""
+    pass
+
+class _Breaker:
+    """circuit breaker for the requests to the website
+
+    After @threshold consecutive failures the circuit is open: requests
+    fail at once with Unavailable instead of waiting for a website that is
+    down. When the backoff period (WebRetryWait at first, doubled after
+    each failed probe up to WebRetryMaxWait, with random jitter) ends, one
+    request is let through as a probe, and the circuit is closed again if
+    it succeeds. A threshold of 0 disables the breaker."""
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._nfail = 0
+        self._open_until = None # None if the circuit is closed
+        self._backoff = None
+        self._probing = False
+        self.threshold = None
+
+    def allow(self):
+        """return whether a request could be sent now; if the circuit is open,
+        the caller becomes the probe and must call success() or failure()"""
+        with self._cond:
+            if self._open_until is None:
+                return True
+            if self._probing or time.time() < self._open_until:
+                return False
+            self._probing = True
+            return True
+
+    def available(self):
+        """return whether allow() could return True"""
+        with self._cond:
+            return self._open_until is None or (not self._probing and
+                    time.time() >= self._open_until)
+
+    def is_open(self):
+        with self._cond:
+            return self._open_until is not None
+
+    def wait(self, timeout):
+        """wait at most @timeout seconds until available() becomes True"""
+        deadline = time.time() + timeout
+        with self._cond:
+            while self._open_until is not None:
+                now = time.time()
+                if not self._probing and now >= self._open_until:
+                    break
+                if now >= deadline:
+                    break
+                if self._probing:
+                    self._cond.wait(deadline - now)
+                else:
+                    self._cond.wait(min(deadline, self._open_until) - now)
+
+    def success(self):
+        with self._cond:
+            if self._open_until is not None:
+                log.info("website is available again")
+            self._nfail = 0
+            self._open_until = None
+            self._backoff = None
+            self._probing = False
+            self._cond.notify_all()
+
+    def failure(self):
+        with self._cond:
+            if self._open_until is not None and not self._probing:
+                # a request sent before the circuit was opened
+                return
+            self._nfail += 1
+            self._probing = False
+            if not self.threshold or self._nfail < self.threshold:
+                self._cond.notify_all()
+                return
+            if self._open_until is None:
+                self._backoff = _retry_wait
+                log.warning("website seems unavailable after {0} failures, "
+                        "pausing requests" . format(self._nfail))
+            else:
+                self._backoff = min(self._backoff * 2, _retry_max_wait)
+            self._open_until = time.time() + _jitter(self._backoff)
+            self._cond.notify_all()
+
+_breaker = _Breaker()
+
+def _jitter(t):
+    """return a random time around @t, so that the threads waiting for the
+    website do not retry at the same time"""
+    return t * random.uniform(0.5, 1.5)
+
+def available():
+    """return whether a request to the website could be sent now, i.e. the
+    website is not considered down or it is time to check it again"""
+    return _breaker.available()
+
+def wait_available(timeout):
+    """wait at most @timeout seconds until available() becomes True"""
+    _breaker.wait(timeout)
+
+def is_down():
+    """return whether the website is considered down"""
+    return _breaker.is_open()
+
+class _Conn_pool:
+    """persistent (keep-alive) HTTP connections to the website, shared by
+    all threads; at most @size requests are sent at the same time"""
+    def __init__(self, url, size):
+        u = urlparse.urlsplit(url)
+        if u.scheme == "https":
+            self._conn_class = httplib.HTTPSConnection
+        elif u.scheme == "http":
+            self._conn_class = httplib.HTTPConnection
+        else:
+            raise conf.UserError("unsupported scheme of WebAddress: {0!r}" . format(u.scheme))
+        self._host = u.netloc
+        self._path = u.path or "/"
+        self._sem = threading.Semaphore(size)
+        self._lock = threading.Lock()
+        self._idle = list()
+
+    def open(self, query, data = None, maxlen = None, timeout = None):
+        """send a request to the website address with query string @query
+        (if not None), using POST to send @data if it is not None, and return
+        at most @maxlen bytes (or all if @maxlen is None) of the response
+        @timeout is in seconds, and WebTimeout is used if it is None"""
+        if timeout is None:
+            timeout = _timeout
+        path = self._path
+        if query is not None:
+            path += "?" + query
+        with self._sem:
+            while True:
+                with self._lock:
+                    if self._idle:
+                        conn = self._idle.pop()
+                        reused = True
+                    else:
+                        conn = None
+                if conn is None:
+                    conn = self._conn_class(self._host, timeout = timeout)
+                    reused = False
+                else:
+                    conn.timeout = timeout
+                    if conn.sock:
+                        conn.sock.settimeout(timeout)
+                try:
+                    if data is None:
+                        conn.request("GET", path)
+                    else:
+                        conn.request("POST", path, data,
+                                {"Content-Type" : "application/x-www-form-urlencoded"})
+                    resp = conn.getresponse()
+                    ret = resp.read()
+                except (httplib.HTTPException, socket.error) as e:
+                    conn.close()
+                    if reused and _is_stale_conn_error(e):
+                        # the website closed the idle connection, so the
+                        # request has not been handled and could be sent again
+                        continue
+                    raise
+                if resp.will_close:
+                    conn.close()
+                else:
+                    with self._lock:
+                        self._idle.append(conn)
+                if resp.status != 200:
+                    raise httplib.HTTPException("HTTP error {0}: {1}" .
+                            format(resp.status, resp.reason))
+                if maxlen is not None:
+                    ret = ret[:maxlen]
+                return ret
+
+def _is_stale_conn_error(e):
+    """whether exception @e, raised while sending a request on a reused
+    connection, means the website had closed the connection before the
+    request reached it; other errors (such as timeouts) may happen after the
+    website handled the request, which must not be sent again silently"""
+    if isinstance(e, socket.timeout):
+        return False
+    if isinstance(e, httplib.BadStatusLine):
+        return True
+    return isinstance(e, socket.error) and e.errno in (errno.ECONNRESET, errno.EPIPE)
+
+def _urlopen(query, data = None, maxlen = None, timeout = None):
+    """send a request to the website as _Conn_pool.open does"""
+    if _pool:
+        return _pool.open(query, data, maxlen, timeout)
+    if timeout is None:
+        timeout = _timeout
+    url = _web_addr
+    if query is not None:
+        url += "?" + query
+    f = urllib2.urlopen(url, data, timeout)
+    try:
+        if maxlen is None:
+            return f.read()
+        return f.read(maxlen)
+    finally:
+        f.close()
+
 def thread_sched_work():
     global _web_addr, _timeout, _sched_interval
     while not control.test_termination_flag():
         err = None
         try:
-            ret = urllib2.urlopen(_web_addr + "?sched_work", None, _timeout).read()
+            ret = _urlopen("sched_work")
             if ret != "0":
                 err = ret
         except Exception as e:
@@ -93,7 +318,7 @@ def report_error(task, msg):
     Note:
         'data' is the data sent to website
         'return' is the data received from website"""
-    _read({"action":"report_error", "task":task.id, "msg":msg})
+    _report({"action":"report_error", "task":task.id, "msg":msg})
 
 def get_query_list():
     """return a list containing the queries for judge info
@@ -134,32 +359,77 @@ def remove_judge(judge):
     _read({"action":"remove_judge", "judge":judge.id_num})
 
 _fetch_task_prev = None
-def fetch_task():
-    """try to fetch a new task. return None if no new task available.
+_rejudge_batch_size = None
+_rejudge_batch_cnt = 0
+def fetch_tasks(limit, wait = 0):
+    """try to fetch at most @limit new tasks. return a list of tasks,
+    which is empty if no new task available.
+    if @wait is positive, the website may wait at most @wait seconds
+    for new tasks before replying (long polling)
+    tasks in a rejudge batch have attribute rejudge_batch set to
+    the number of the batch (starting from 1), and for other tasks
+    rejudge_batch is None
     this function does not raise exceptions
 
-    data: action=fetch_task, prev=array("type"=><type of previous task>, <type specified arguments>)|None
+    data: action=fetch_task, prev=array("type"=><type of previous task>, <type specified arguments>)|None,
+        max_tasks=<maximal number of tasks in a "tasks" reply>,
+        max_rejudge=<maximal number of tasks in a "rejudge" reply>,
+        wait=<seconds> (only present if @wait is positive; a website supporting
+            long polling should not reply "none" until a task is available or
+            <wait> seconds have passed)
     return: array("type"=>type, <type specified arguments>)
         type:
             "none" -- no new task
                       args: none
             "src"  -- new source file to be judged
-                      args: id, prob, lang, src, input, output (see structures.py)"""
-    global _fetch_task_prev
+                      args: id, prob, lang, src, input, output (see structures.py)
+                      prev: array("type"=>"src", "id"=>id)
+            "tasks" -- several new source files to be judged
+                      args: tasks=array of at most max_tasks arrays, each
+                          containing the arguments of a "src" reply
+                      prev: array("type"=>"tasks", "id"=>array of the task ids)
+            "rejudge" -- a batch of old submissions to be judged again, which
+                      are judged only when no other task is waiting
+                      args: tasks=array of at most max_rejudge arrays, each
+                          containing the arguments of a "src" reply
+                      prev: array("type"=>"rejudge", "id"=>array of the task ids)
+        the tasks acknowledged by prev have been received by orzoj-server
+        (websites not supporting "tasks" and "rejudge" could always use "src")"""
+    global _fetch_task_prev, _rejudge_batch_cnt
+    def _make_task(d):
+        v = structures.task()
+        for i in v.__dict__:
+            v.__dict__[i] = d[i]
+        v.id = int(v.id)
+        v.rejudge_batch = None
+        return v
+
     try:
-        ret = _read({"action":"fetch_task", "prev": _fetch_task_prev})
+        data = {"action":"fetch_task", "prev": _fetch_task_prev,
+            "max_tasks": limit, "max_rejudge": min(limit, _rejudge_batch_size)}
+        timeout = None
+        if wait > 0:
+            data["wait"] = wait
+            timeout = _timeout + wait
+        ret = _read(data, None, timeout)
         _fetch_task_prev = ret
         t = ret["type"]
         if t == "none":
-            return
+            return []
         if t == "src":
             _fetch_task_prev = {'type':'src', 'id':ret['id']}
-            v = structures.task()
-            for i in v.__dict__:
-                v.__dict__[i] = ret[i]
-            v.id = int(v.id)
-            return v
+            return [_make_task(ret)]
+        if t == "tasks" or t == "rejudge":
+            tasks = [_make_task(i) for i in phpserialize.dict_to_list(ret["tasks"])]
+            _fetch_task_prev = {'type':t, 'id':[i.id for i in tasks]}
+            if t == "rejudge":
+                _rejudge_batch_cnt += 1
+                for i in tasks:
+                    i.rejudge_batch = _rejudge_batch_cnt
+            return tasks
         raise _internal_error("unknown task type: {0!r}" . format(t))
+    except Unavailable:
+        raise
     except Exception as e:
         log.error("failed to fetch task: {0}" . format(e))
         raise Error
@@ -170,14 +440,14 @@ def report_no_data(task):
     
     data: action=report_no_data, task=...(id:int)
     return: NULL"""
-    _read({"action":"report_no_data", "task":task.id})
+    _report({"action":"report_no_data", "task":task.id})
 
 def report_judge_waiting(task):
     """judge is waiting because it's serving another orzoj-server
 
     data: action=report_judge_waiting, task=...(id:int)
     return: NULL"""
-    _read({"action":"report_judge_waiting", "task":task.id})
+    _report({"action":"report_judge_waiting", "task":task.id})
 
 def report_sync_data(task, judge):
     """@task will be judged on @judge and now it's synchronizing data
@@ -185,28 +455,28 @@ def report_sync_data(task, judge):
     data: action=report_sync_data, task=...(id:int), judge=...(id:int)
     return: NULL
     """
-    _read({"action":"report_sync_data", "task":task.id, "judge":judge.id_num})
+    _report({"action":"report_sync_data", "task":task.id, "judge":judge.id_num})
 
 def report_compiling(task):
     """now compiling @task
 
     data: action=report_compiling, task=...(id:int)
     return: NULL"""
-    _read({"action":"report_compiling", "task":task.id})
+    _report({"action":"report_compiling", "task":task.id})
 
 def report_compile_success(task, ncase):
     """successfully compiled
 
     data: action=report_compile_success, task=...(id:int), ncase=...
     return: NULL"""
-    _read({"action": "report_compile_success", "task": task.id, "ncase": ncase})
+    _report({"action": "report_compile_success", "task": task.id, "ncase": ncase})
 
 def report_compile_failure(task, info):
     """failed to compile
 
     data: action=report_compile_failure, task=...(id:int), info=...
     return: NULL"""
-    _read({"action":"report_compile_failure", "task":task.id, "info":info})
+    _report({"action":"report_compile_failure", "task":task.id, "info":info})
 
 def report_judge_progress(task, now):
     """
@@ -214,7 +484,7 @@ def report_judge_progress(task, now):
 
     data: action=report_judge_progress, task=...(id:int), now=...
     return: NULL"""
-    _read({"action":"report_judge_progress", "task":task.id, "now": now})
+    _report({"action":"report_judge_progress", "task":task.id, "now": now})
 
 def report_prob_result(task, result):
     """
@@ -228,21 +498,123 @@ def report_prob_result(task, result):
     d = structures.case_result().__dict__
     for i in d:
         data[i] = [case.__dict__[i] for case in result]
-    _read(data)
+    _report(data)
+
+def _report(data):
+    """send the report @data of a task, in a report_batch request if
+    ReportBatchInterval is positive
+
+    data: action=report_batch, reports=array(<data of a report>, ...)
+        the reports should be handled in the given order, and the reports
+        about the same task are always sent in the order they are made
+    return: NULL"""
+    if _batcher:
+        _batcher.send(data)
+    else:
+        _read(data)
+
+class _Report_batcher:
+    """collect reports from all threads and send them in report_batch requests
+
+    The first thread adding a report to an empty batch becomes the leader,
+    which waits at most @interval seconds for the batch to get @size
+    reports and then sends it, while the other threads wait for their
+    reports to be sent. Batches are sent in parallel if the previous ones
+    have not finished, and since every thread waits for its report,
+    the reports of a task are never reordered.
+
+    If a batch fails while the website is up, each report in it is sent
+    again alone by its thread, so that a report the website rejects does
+    not fail the others."""
+    def __init__(self, interval, size):
+        self._interval = interval
+        self._size = size
+        self._cond = threading.Condition()
+        self._pending = list() # list of (data, result), see send()
+        self._has_leader = False
+
+    def send(self, data):
+        """add report @data to a batch and wait until it has been sent
+        may raise Error"""
+        result = [False, False] # [done, failed]
+        item = (data, result)
+        with self._cond:
+            self._pending.append(item)
+            if len(self._pending) == self._size:
+                self._cond.notify_all()
+            while not result[0]:
+                if not self._has_leader and self._pending and self._pending[0] is item:
+                    batch = self._lead()
+                    break
+                self._cond.wait()
+            else:
+                if result[1]:
+                    self._send_alone(data)
+                return
+
+        failed = False
+        try:
+            _read({"action":"report_batch", "reports":[i[0] for i in batch]})
+        except Error:
+            failed = True
+
+        with self._cond:
+            for i in batch:
+                i[1][0] = True
+                i[1][1] = failed
+            self._cond.notify_all()
+        if failed:
+            if len(batch) == 1:
+                raise Error
+            self._send_alone(data)
+
+    def _send_alone(self, data):
+        """send report @data, whose batch has failed, in its own request"""
+        if is_down():
+            raise Error
+        _read(data)
+
+    def _lead(self):
+        """wait for the batch to be filled and return it
+        self._cond must be held"""
+        self._has_leader = True
+        deadline = time.time() + self._interval
+        while len(self._pending) < self._size:
+            remain = deadline - time.time()
+            if remain <= 0:
+                break
+            self._cond.wait(remain)
+        batch = self._pending[:self._size]
+        del self._pending[:self._size]
+        self._has_leader = False
+        if self._pending:
+            # let the first of the remaining reports lead the next batch
+            self._cond.notify_all()
+        return batch
 
 
 def _sha1sum(s):
     return hashlib.sha1(s).hexdigest()
 
-def _read(data, maxlen = None):
+def _gzip(s):
+    c = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return c.compress(s) + c.flush()
+
+def _gunzip(s):
+    return zlib.decompress(s, 16 + zlib.MAX_WBITS)
+
+def _read(data, maxlen = None, timeout = None):
     """if @maxlen is not None, data should be of dict type and is sent via GET method and without checksum
     and the data read is returned;
     otherwise @data will dumped by phpserialize and sent via POST method and the data read is returned
+    if @timeout is not None, it is used instead of WebTimeout
 
     Note: @maxlen is not None iff now trying to login
     """
     global _retry_cnt, _web_addr, _thread_req_id, _lock_thread_req_id, _passwd
 
+    data_gz = [None]
+
     def make_data():
         """return a tuple (checksum_base, data_sent)"""
         thread_id = threading.current_thread().ident
@@ -253,88 +625,136 @@ def _read(data, maxlen = None):
                 req_id = 0
             _thread_req_id[thread_id] = req_id + 1
         checksum_base = str(thread_id) + '$' + str(req_id) + '$' + _passwd
-        data_sent = urllib.urlencode({"data" :
-                phpserialize.dumps({"thread_id" : thread_id, "data" : data,
-                    "checksum" : _sha1sum(checksum_base + data)})})
+        req = {"thread_id" : thread_id, "checksum" : _sha1sum(checksum_base + data)}
+        if _web_gzip and len(data) >= _compress_min:
+            if data_gz[0] is None:
+                data_gz[0] = _gzip(data)
+            req["datagz"] = data_gz[0]
+        else:
+            req["data"] = data
+        data_sent = urllib.urlencode({"data" : phpserialize.dumps(req)})
 
         return (checksum_base, data_sent)
 
     if maxlen:
-        url = _web_addr + "?" + urllib.urlencode(data)
+        query = urllib.urlencode(data)
     else:
         data = phpserialize.dumps(data)
-        (checksum_base, data_sent) = make_data()
+        # a request id is taken only when the request is really sent
+        data_sent = None
 
     cnt = _retry_cnt
+    wait = _retry_wait
 
     while cnt:
         if control.test_termination_flag():
             raise Error
+        if not _breaker.allow():
+            if _retry_cnt > 0:
+                raise Unavailable
+            # retry forever
+            _breaker.wait(1)
+            continue
         cnt -= 1
         try:
             ret = None
 
             if maxlen:
-                return urllib2.urlopen(url, None, _timeout).read(maxlen)
+                ret = _urlopen(query, None, maxlen, timeout)
+                _breaker.success()
+                return ret
 
-            ret = urllib2.urlopen(_web_addr, data_sent, _timeout).read()
+            if data_sent is None:
+                (checksum_base, data_sent) = make_data()
+            ret = _urlopen(None, data_sent, None, timeout)
 
             if ret == 'relogin':
+                _breaker.success()
                 if _lock_relogin.acquire(False):
-                    log.warning("website requests relogin")
-                    _login()
-                    with _lock_thread_req_id:
-                        _thread_req_id.clear()
-                    _lock_relogin.release()
+                    try:
+                        log.warning("website requests relogin")
+                        _login(False)
+                        with _lock_thread_req_id:
+                            _thread_req_id.clear()
+                    finally:
+                        _lock_relogin.release()
                 else:
                     _lock_relogin.acquire()
                     # wait until relogin finishes
                     _lock_relogin.release()
-                (checksum_base, data_sent) = make_data()
+                data_sent = None
                 cnt = _retry_cnt
+                wait = _retry_wait
                 continue
 
             ret = phpserialize.loads(ret)
 
             ret_status = ret["status"]
-            ret_data = ret["data"]
+            if "datagz" in ret:
+                ret_data = _gunzip(ret["datagz"])
+            else:
+                ret_data = ret["data"]
 
             if ret["checksum"] != _sha1sum(checksum_base + str(ret_status) + ret_data):
                 raise _internal_error("website checksum error")
 
+            # the website is working even if it reports an error
+            _breaker.success()
+
             if int(ret_status):
-                raise _internal_error("website says an error happens there: {0}" . format(ret_data))
+                raise _website_error("website says an error happens there: {0}" . format(ret_data))
 
             return phpserialize.loads(ret_data)
 
+        except Error:
+            raise # relogin failed
         except Exception as e:
+            if not isinstance(e, _website_error):
+                _breaker.failure()
             log.error("website communication error [left retries: {0}]: {1}" .
                     format(cnt, e))
             sys.stderr.write("orzoj-server: website communication error. See the log for details.\n")
             log.debug("raw data from server: {0!r}" . format(ret))
-            time.sleep(_retry_wait);
+            if cnt and not _breaker.is_open():
+                # back off exponentially; if the website is down, the
+                # breaker makes the next try wait or fail at once
+                time.sleep(_jitter(wait))
+                wait = min(wait * 2, _retry_max_wait)
             continue
 
     raise Error
 
 _first_login = True
-def _login():
+def _login(fatal = True):
     """
-    1. read at most _DYNAMIC_PASSWD_MAXLEN bytes from orz.php?action=login1&version=_VERSION,
-       _dynamic_passwd is the data read
+    1. read at most _DYNAMIC_PASSWD_MAXLEN bytes from orz.php?action=login1&version=_VERSION
+       (with &compress=gzip if WebCompressMin is positive),
+       _dynamic_passwd is the data read (its first word if compression is requested)
        _dynamic_passwd = "0" means version check error
     2. from orz.php?action=login2&checksum=_sha1sum(_sha1sum(_dynamic_passwd + _static_passwd)),
        and verify that it should be _sha1sum(_sha1sum(_dynamic_passwd) + _static_passwd)
     3. if it's the first time to login (i.e. relogin), send "refetch" to fetch all tasks with
-        status "waiting on orzoj-server"
+        status "waiting on orzoj-server", unless the unfinished tasks have been recovered
+        from the task journal
+    if @fatal is False, Error is raised on failure instead of exiting
        """
 
-    global _static_passwd, _passwd, _first_login
+    global _static_passwd, _passwd, _first_login, _web_gzip
 
     try:
 
         try:
-            _dynamic_passwd = _read({"action" : "login1", "version" : _VERSION},  _DYNAMIC_PASSWD_MAXLEN)
+            data = {"action" : "login1", "version" : _VERSION}
+            if _compress_min:
+                data["compress"] = "gzip"
+            _dynamic_passwd = _read(data, _DYNAMIC_PASSWD_MAXLEN)
+
+            _web_gzip = False
+            if _compress_min:
+                words = _dynamic_passwd.split()
+                if words:
+                    _dynamic_passwd = words[0]
+                    _web_gzip = "gzip" in words[1:]
 
             if _dynamic_passwd == '0':
                 raise _internal_error("website version check error")
@@ -343,7 +763,7 @@ def _login():
             _passwd = _sha1sum(_dynamic_passwd + _static_passwd)
 
             data = {"action" : "login2", "checksum" : _sha1sum(_passwd)}
-            if _first_login:
+            if _first_login and journal.recovered_tasks() is None:
                 data["refetch"] = 1
 
             pwd_peer = _read(data, len(vpwd));
@@ -361,6 +781,8 @@ def _login():
 
     except _internal_error as e:
         log.error(e.msg)
+        if not fatal:
+            raise Error
         sys.exit("orzoj-server: {0}" . format(e.msg))
 
 def _set_static_password(arg):
@@ -387,6 +809,57 @@ def _set_web_retry_wait(arg):
     if _retry_wait < 1:
         _retry_wait = 1
 
+def _set_web_retry_max_wait(arg):
+    global _retry_max_wait
+    _retry_max_wait = float(arg[1])
+    if _retry_max_wait < 1:
+        _retry_max_wait = 1
+
+def _set_breaker_threshold(arg):
+    _breaker.threshold = int(arg[1])
+    if _breaker.threshold < 0:
+        raise conf.UserError("Option {0} can not be negative" . format(arg[0]))
+
+def _set_pool_size(arg):
+    global _pool_size
+    _pool_size = int(arg[1])
+    if _pool_size < 0:
+        raise conf.UserError("Option {0} can not be negative" . format(arg[0]))
+
+def _init_pool():
+    global _pool
+    if _pool_size:
+        _pool = _Conn_pool(_web_addr, _pool_size)
+
+def _set_batch_interval(arg):
+    global _batch_interval
+    _batch_interval = float(arg[1]) / 1000
+    if _batch_interval < 0:
+        raise conf.UserError("Option {0} can not be negative" . format(arg[0]))
+
+def _set_batch_size(arg):
+    global _batch_size
+    _batch_size = int(arg[1])
+    if _batch_size < 1:
+        raise conf.UserError("Option {0} can not be less than 1" . format(arg[0]))
+
+def _set_compress_min(arg):
+    global _compress_min
+    _compress_min = int(arg[1])
+    if _compress_min < 0:
+        raise conf.UserError("Option {0} can not be negative" . format(arg[0]))
+
+def _init_batcher():
+    global _batcher
+    if _batch_interval > 0:
+        _batcher = _Report_batcher(_batch_interval, _batch_size)
+
+def _set_rejudge_batch_size(arg):
+    global _rejudge_batch_size
+    _rejudge_batch_size = int(arg[1])
+    if _rejudge_batch_size < 1:
+        raise conf.UserError("Option {0} can not be less than 1" . format(arg[0]))
+
 def _set_web_sched_interval(arg):
     global _sched_interval
     _sched_interval = float(arg[1])
@@ -398,7 +871,16 @@ conf.simple_conf_handler("WebTimeout", _set_web_timeout, "5")
 conf.simple_conf_handler("WebAddress", _set_web_addr)
 conf.simple_conf_handler("WebRetryCount", _set_web_retry_cnt, "5")
 conf.simple_conf_handler("WebRetryWait", _set_web_retry_wait, "2")
+conf.simple_conf_handler("WebRetryMaxWait", _set_web_retry_max_wait, "60")
+conf.simple_conf_handler("WebBreakerThreshold", _set_breaker_threshold, "3")
 conf.simple_conf_handler("WebSchedInterval", _set_web_sched_interval, "1")
-
+conf.simple_conf_handler("RejudgeBatchSize", _set_rejudge_batch_size, "64")
+conf.simple_conf_handler("WebPoolSize", _set_pool_size, "8")
+conf.simple_conf_handler("ReportBatchInterval", _set_batch_interval, "0")
+conf.simple_conf_handler("ReportBatchSize", _set_batch_size, "32")
+conf.simple_conf_handler("WebCompressMin", _set_compress_min, "0")
+
+conf.register_init_func(_init_pool)
+conf.register_init_func(_init_batcher)
 conf.register_init_func(_login)
 
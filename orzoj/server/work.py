@@ -22,13 +22,11 @@
 
 """threads for waiting for tasks and managing judges"""
 
-import threading, time, os, os.path, traceback
+import threading, time, os, os.path, traceback, sys, socket
 from collections import deque
 
-from orzoj import log, snc, msg, structures, control, conf, sync_dir
-from orzoj.server import web
-
-_max_queue_size = None
+from orzoj import log, snc, msg, structures, control, conf, sync_dir, mux
+from orzoj.server import web, sched, journal, cost
 
 _lang_id_dict = dict()
 _lang_id_dict_lock = threading.Lock()
@@ -38,6 +36,13 @@ _judge_id_set_lock = threading.Lock()
 
 _refresh_interval = None
 _id_max_len = None
+_max_worker_slots = None
+_sjf_cost_weight = None
+_fetch_batch_size = None
+_long_poll = None
+_notify_port = None
+_manifest_file = None
+_wakeup = threading.Event() # set to fetch tasks at once
 
 class _internal_error(Exception):
     pass
@@ -47,125 +52,211 @@ def _get_lang_id(lang):
     with _lang_id_dict_lock:
         return _lang_id_dict.setdefault(lang, len(_lang_id_dict))
 
-class _Task_queue:
-    def __init__(self):
-        self._queue = dict()
-        # dict of <language id:int> => <task queue:deque>
-        self._lock = threading.Lock()
-        self._size = 0
-
-    def put(self, task):
-        while self._is_full() and not control.test_termination_flag():
-            time.sleep(msg.TELL_ONLINE_INTERVAL)
-        with self._lock:
-            if task.lang_id not in self._queue:
-                self._queue[task.lang_id] = deque()
-            self._queue[task.lang_id].append(task)
-            self._size += 1
-
-    def get(self, lang_id_set):
-        """ return None if no usable"""
-        ret = None
-        with self._lock:
-            min_tid = None
-            for lid in lang_id_set:
-                try:
-                    q = self._queue[lid]
-                    task = q[0]
-                    if min_tid is None or task.id < min_tid:
-                        min_tid = task.id
-                        min_tid_q = q
-                except Exception: # KeyError or IndexError
-                    pass
-            if min_tid is not None:
-                ret = min_tid_q.popleft()
-                self._size -= 1
-        return ret
-
-    def _is_full(self):
-        global _max_queue_size
-        with self._lock:
-            return self._size >= _max_queue_size
-
-_task_queue = _Task_queue()
-
-class _thread_web_communicate(threading.Thread):
-
-    class _callable:
-        def __init__(self, func, args, par):
-            self._func = func
-            self._args = args
-            self._par = par
-
-        def call(self):
-            if self._func is not None:
-                try:
-                    self._func(*self._args)
-                except web.Error:
-                    self._par._on_error.set()
-                except Exception as e:
-                    log.error("error while communicating with orzoj-website: {0}" . format(e))
-                    self._par._on_error.set()
-                self._func = None
+_task_queue = sched.Task_queue()
 
+def set_put_callback(func):
+    """call @func without arguments whenever a task is put into the queue"""
+    _task_queue.put_callback = func
 
-    def __init__(self):
-        threading.Thread.__init__(self)
-        self._is_stopped = False
-        self._on_error = threading.Event()
-        self._cd = threading.Condition()
+class _task_reporter:
+    """the reports about a task made while a judge is working on it,
+    sent to the website by _reporter_pool"""
 
-        self._queue = deque()
-        self._lazy = None
-
-    def lazy_report(self, func, args):
-        self._cd.acquire()
-        self._lazy = _thread_web_communicate._callable(func, args, self)
-        self._cd.notify()
-        self._cd.release()
+    def __init__(self, pool, task):
+        self._pool = pool
+        self.task_id = task.id
+        self.queue = deque()    # (func, args) to be called in order
+        self.lazy = None        # (func, args) called only if queue is empty
+        self.busy = False       # in the ready queue of the pool or being sent
+        self.stopped = False
+        self.on_stop = None
+        self.error = False
 
     def report(self, func, args):
-        self._cd.acquire()
-        self._queue.append(_thread_web_communicate._callable(func, args, self))
-        self._cd.notify()
-        self._cd.release()
+        """call @func(*@args) in a reporter thread"""
+        self._pool._add(self, (func, args), False)
+
+    def lazy_report(self, func, args):
+        """like report(), but replace the previous lazy report if it has not
+        been sent, and send it only when no other report is waiting"""
+        self._pool._add(self, (func, args), True)
 
     def clean_lazy(self):
-        self._cd.acquire()
-        self._lazy = None
-        self._cd.notify()
-        self._cd.release()
+        with self._pool._cd:
+            self.lazy = None
 
     def check_error(self):
-        return self._on_error.is_set()
+        return self.error
 
-    def stop(self):
-        self._cd.acquire()
-        self._is_stopped = True
-        self._cd.notify()
-        self._cd.release()
+    def stop(self, callback = None):
+        """no more reports will be made; call @callback() in a reporter
+        thread after all the reports have been sent"""
+        self._pool._stop(self, callback)
 
-    def run(self):
-        while True:
-            self._cd.acquire()
-            if self._is_stopped and len(self._queue) == 0:
-                return
 
-            if len(self._queue):
-                cur_task = self._queue.popleft()
-            elif (self._lazy):
-                cur_task = self._lazy
-                self._lazy = None
-            else:
-                cur_task = None
+class _reporter_pool:
+    """a fixed number of threads sending the reports of all tasks to the
+    website, so that the judges need not wait for the website
+
+    The reports about a task are sent one at a time in the order they are
+    made, even if the task is dispatched again before the reports of the
+    previous dispatch have all been sent. Tasks with reports waiting take
+    turns to send one.
+
+    While the website is down (see web.is_down), the reports that could not
+    be sent are kept and sent again when it is available, so that judging
+    goes on. Once <outbox_size> reports are kept, no more tasks are given to
+    the judges (see judge_session.get_task) until some are sent. Making a
+    report never waits, which would stall a judge in the middle of a task,
+    so the outbox exceeds <outbox_size> only by the reports of the tasks
+    already running."""
 
-            if cur_task is None:
-                self._cd.wait()
-                self._cd.release()
+    def __init__(self):
+        self._cd = threading.Condition()
+        self._chains = dict()   # dict of <task id> => <list of _task_reporter, oldest first>
+        self._ready = deque()   # _task_reporter with something to do
+        self._deferred = list() # _task_reporter waiting for the website
+        self._npending = 0      # number of reports (not lazy) not sent yet
+        self.nthread = None
+        self.outbox_size = None
+
+    def start(self):
+        for i in range(self.nthread):
+            threading.Thread(target = self._run, name = "work._reporter_pool").start()
+
+    def open(self, task):
+        """return a new _task_reporter for @task"""
+        r = _task_reporter(self, task)
+        with self._cd:
+            self._chains.setdefault(task.id, list()).append(r)
+        return r
+
+    def _schedule(self, r):
+        # must be called with self._cd held
+        if r.busy or self._chains[r.task_id][0] is not r:
+            return
+        if r.queue or r.lazy is not None or r.stopped:
+            r.busy = True
+            self._ready.append(r)
+            self._cd.notify()
+
+    def _add(self, r, item, lazy):
+        with self._cd:
+            if lazy:
+                r.lazy = item
             else:
-                self._cd.release()
-                cur_task.call()
+                self._npending += 1
+                if self._npending == self.outbox_size:
+                    log.warning("report outbox is full, no more tasks are given to "
+                            "judges until the website catches up")
+                r.queue.append(item)
+            self._schedule(r)
+
+    def wait_not_full(self, timeout):
+        """wait at most @timeout seconds until fewer than <outbox_size>
+        reports are kept; return whether it is so"""
+        with self._cd:
+            if self._npending >= self.outbox_size and timeout > 0:
+                self._cd.wait(timeout)
+            return self._npending < self.outbox_size
+
+    def _resume_deferred(self):
+        # must be called with self._cd held
+        if self._deferred and web.available():
+            deferred = self._deferred
+            self._deferred = list()
+            for r in deferred:
+                r.busy = False
+                self._schedule(r)
+
+    def _stop(self, r, callback):
+        with self._cd:
+            if r.stopped:
+                return
+            r.stopped = True
+            r.on_stop = callback
+            r.lazy = None
+            self._schedule(r)
 
+    def _run(self):
+        while True:
+            with self._cd:
+                self._resume_deferred()
+                while not self._ready:
+                    if control.test_termination_flag():
+                        return
+                    self._cd.wait(1)
+                    self._resume_deferred()
+                r = self._ready.popleft()
+                lazy = False
+                if r.queue:
+                    item = r.queue.popleft()
+                elif r.lazy is not None:
+                    item = r.lazy
+                    r.lazy = None
+                    lazy = True
+                elif r.stopped:
+                    # stopped and all reports sent
+                    item = None
+                    chain = self._chains[r.task_id]
+                    del chain[0]
+                    if chain:
+                        self._schedule(chain[0])
+                    else:
+                        del self._chains[r.task_id]
+                else:
+                    # the lazy report was cleaned before being sent
+                    r.busy = False
+                    continue
+
+            if item is None:
+                if r.on_stop is not None:
+                    try:
+                        r.on_stop()
+                    except Exception as e:
+                        log.error("error after reporting task #{0}: {1}" . format(r.task_id, e))
+                continue
+
+            (func, args) = item
+            try:
+                func(*args)
+            except web.Error:
+                if web.is_down() and not control.test_termination_flag():
+                    # keep the report until the website is available
+                    with self._cd:
+                        if not lazy:
+                            r.queue.appendleft(item)
+                        elif r.lazy is None:
+                            r.lazy = item
+                        self._deferred.append(r) # still busy
+                    continue
+                r.error = True
+            except Exception as e:
+                log.error("error while communicating with orzoj-website: {0}" . format(e))
+                r.error = True
+
+            with self._cd:
+                if not lazy:
+                    self._npending -= 1
+                    self._cd.notify_all()
+                r.busy = False
+                self._schedule(r)
+
+_reporters = _reporter_pool()
+
+
+def _thread_notify(sock):
+    """wake up thread_work whenever a datagram arrives at @sock"""
+    while not control.test_termination_flag():
+        try:
+            sock.recvfrom(64)
+        except socket.timeout:
+            continue
+        except socket.error as e:
+            log.error("failed to receive notification: {0}" . format(e))
+            break
+        _wakeup.set()
+    sock.close()
 
 def thread_work():
     """wait for tasks and distribute them to judges"""
@@ -173,74 +264,118 @@ def thread_work():
 
     threading.Thread(target = web.thread_sched_work, name = "web.thread_web_sched_work").start()
 
+    if _notify_port:
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind(("127.0.0.1", _notify_port))
+            sock.settimeout(1)
+            threading.Thread(target = _thread_notify, args = (sock, ),
+                    name = "work._thread_notify").start()
+        except socket.error as e:
+            log.error("failed to listen for notifications on port {0}: {1}" .
+                    format(_notify_port, e))
+
+    _reporters.start()
+
+    journal.start()
+    tasks = journal.recovered_tasks()
+    if tasks:
+        for task in tasks:
+            task.lang_id = _get_lang_id(task.lang)
+            _task_queue.put(task)
+        log.info("requeued {0} task(s) recovered from task journal" . format(len(tasks)))
+
     while not control.test_termination_flag():
         while not control.test_termination_flag():
+            cost.save()
+            _save_manifest()
+            # fetch as many tasks as the queue could hold in one request
+            limit = _task_queue.nfree()
+            if limit is None or limit > _fetch_batch_size:
+                limit = _fetch_batch_size
+            if limit == 0:
+                break
+            time_start = time.time()
             try:
-                task = web.fetch_task()
+                tasks = web.fetch_tasks(limit, _long_poll)
             except web.Error as e:
-                log.error("ending program because of communication error with website")
-                control.set_termination_flag()
-                return
-            if task is None:
+                # the judges go on with the tasks in the queue, and new
+                # tasks are fetched again after a while
+                if not isinstance(e, web.Unavailable):
+                    log.warning("failed to fetch tasks from website, will try again later")
+                break
+            if not tasks:
+                if _long_poll > 0 and time.time() - time_start >= _refresh_interval:
+                    # the website has waited for new tasks, so no need to sleep
+                    continue
                 break
 
-            task.lang_id = _get_lang_id(task.lang)
-            _task_queue.put(task)
-
-            log.info("fetched task #{0} from website" . format(task.id))
-
-        time.sleep(_refresh_interval)
+            for task in tasks:
+                task.lang_id = _get_lang_id(task.lang)
+            # the tasks must be on disk before the next fetch_tasks(),
+            # which tells the website that they have been received
+            journal.tasks_queued(tasks)
+            for task in tasks:
+                _task_queue.put(task)
+
+            if len(tasks) == 1 and tasks[0].rejudge_batch is None:
+                log.info("fetched task #{0} from website" . format(tasks[0].id))
+            elif tasks[0].rejudge_batch is None:
+                log.info("fetched {0} tasks (#{1} to #{2}) from website" .
+                        format(len(tasks), min(i.id for i in tasks), max(i.id for i in tasks)))
+            else:
+                log.info("fetched rejudge batch {0} of {1} task(s) (#{2} to #{3}) from website" .
+                        format(tasks[0].rejudge_batch, len(tasks),
+                            min(i.id for i in tasks), max(i.id for i in tasks)))
 
+        _wakeup.wait(_refresh_interval)
+        _wakeup.clear()
 
-class thread_new_judge_connection(threading.Thread):
-    def __init__(self, sock):
-        """serve a new connection, which should be orzoj-judge.
-        No exceptions are raised, exit silently on error
-        sock will be closed"""
-        threading.Thread.__init__(self, name = "work.thread_new_judge_connection")
-        self._sock = sock
-        self._snc = None
-        self._cur_task = None
-        self._web_registered = False
-        self._judge = structures.judge()
-        self._lang_id_set = set()
+    cost.save(True)
+    _save_manifest(True)
 
-    def _clean(self):
-        global _task_queue, _judge_id_set, _judge_id_set_lock
 
-        if self._cur_task:
-            _task_queue.put(self._cur_task)
-            self._cur_task = None
+class _slot:
+    """a worker slot of a judge, which runs one task at a time"""
+    def __init__(self, idx, conn):
+        self.idx = idx
+        self.conn = conn # snc.snc or mux.Channel
+        self.cur_task = None
 
-        judge = self._judge
-        if judge.id:
-            with _judge_id_set_lock:
-                _judge_id_set.remove(judge.id)
 
-        if self._web_registered:
-            try:
-                web.remove_judge(judge)
-            except web.Error:
-                log.warning("[judge {0!r}] failed to unregister on website" . format(judge.id))
+class judge_session:
+    """protocol with a connected orzoj-judge, used by both
+    thread_new_judge_connection and the event loop in evloop.py"""
 
-        log.info("[judge {0!r}] disconnected" . format(judge.id))
+    def __init__(self):
+        self.conn = None # set before handshake()
+        self.judge = structures.judge()
+        self.sched_judge = None
+        self.slots = list()
+        self._lang_id_set = set()
+        self._web_registered = False
 
-    def run(self):
-        judge = self._judge
+    def handshake(self, start_mux):
+        """receive HELLO, answer queries and register the judge
+        if the judge uses PROTOCOL_VERSION_MUX, @start_mux(nslot) is called
+        to send MUX_BEGIN and return a list of nslot channels
+        return the list of slots"""
+        judge = self.judge
+        conn = self.conn
         def _write_msg(m):
-            msg.write_msg(self._snc, m)
+            msg.write_msg(conn, m)
 
         def _write_str(s):
-            self._snc.write_str(s)
+            conn.write_str(s)
 
         def _read_msg():
-            return msg.read_msg(self._snc)
+            return msg.read_msg(conn)
 
         def _read_str():
-            return self._snc.read_str()
+            return conn.read_str()
 
         def _read_uint32():
-            return self._snc.read_uint32()
+            return conn.read_uint32()
 
         def _check_msg(m):
             if m != _read_msg():
@@ -248,105 +383,168 @@ class thread_new_judge_connection(threading.Thread):
                         format(judge.id))
                 raise _internal_error
 
-        global _id_max_len, _judge_id_set, _judge_id_set_lock
+        global _id_max_len, _judge_id_set, _judge_id_set_lock, _max_worker_slots
 
-        try:
-            self._snc = snc.snc(self._sock, True)
-            _check_msg(msg.HELLO)
-            judge_id = _read_str()
+        _check_msg(msg.HELLO)
+        judge_id = _read_str()
 
-            if len(judge_id) > _id_max_len:
-                _write_msg(msg.ID_TOO_LONG)
+        if len(judge_id) > _id_max_len:
+            _write_msg(msg.ID_TOO_LONG)
+            raise _internal_error
+
+        with _judge_id_set_lock:
+            if judge_id in _judge_id_set:
+                _write_msg(msg.DUPLICATED_ID)
+                log.warning("another judge declares duplicated id {0!r}" .
+                        format(judge_id))
                 raise _internal_error
 
-            with _judge_id_set_lock:
-                if judge_id in _judge_id_set:
-                    _write_msg(msg.DUPLICATED_ID)
-                    log.warning("another judge declares duplicated id {0!r}" .
-                            format(judge_id))
-                    raise _internal_error
+            _judge_id_set.add(judge_id)
 
-                _judge_id_set.add(judge_id)
+        judge.id = judge_id
+        del judge_id
 
-            judge.id = judge_id
-            del judge_id
+        version = _read_uint32()
+        if version != msg.PROTOCOL_VERSION and version != msg.PROTOCOL_VERSION_MUX:
+            log.warning("[judge {0!r}] version check error" .
+                    format(judge.id))
+            _write_msg(msg.ERROR)
+            raise _internal_error
 
-            if _read_uint32() != msg.PROTOCOL_VERSION:
-                log.warning("[judge {0!r}] version check error" .
+        cnt = _read_uint32()
+        while cnt:
+            cnt -= 1
+            lang = _read_str()
+            judge.lang_supported.add(lang)
+            self._lang_id_set.add(_get_lang_id(lang))
+
+        nslot = 1
+        if version == msg.PROTOCOL_VERSION_MUX:
+            nslot = _read_uint32()
+            if nslot < 1:
+                log.warning("[judge {0!r}] invalid number of worker slots" .
                         format(judge.id))
                 _write_msg(msg.ERROR)
                 raise _internal_error
+            if nslot > _max_worker_slots:
+                log.info("[judge {0!r}] {1} worker slots requested, limited to {2}" .
+                        format(judge.id, nslot, _max_worker_slots))
+                nslot = _max_worker_slots
 
-            cnt = _read_uint32()
-            while cnt:
-                cnt -= 1
-                lang = _read_str()
-                judge.lang_supported.add(lang)
-                self._lang_id_set.add(_get_lang_id(lang))
+        self.sched_judge = _task_queue.register(judge.id, self._lang_id_set, nslot)
 
-            _write_msg(msg.CONNECT_OK)
+        _write_msg(msg.CONNECT_OK)
 
-            query_ans = dict()
-            for i in web.get_query_list():
-                _write_msg(msg.QUERY_INFO)
-                _write_str(i)
-                _check_msg(msg.ANS_QUERY)
-                query_ans[i] = _read_str()
+        _write_msg(msg.QUERY_INFO)
+        _write_str(msg.FEATURES_QUERY)
+        _check_msg(msg.ANS_QUERY)
+        judge.features = set(_read_str().split())
+        judge.sync_link = sync_dir.Link_stats()
 
-            web.register_new_judge(judge, query_ans)
-            self._web_registered = True
+        query_ans = dict()
+        for i in web.get_query_list():
+            _write_msg(msg.QUERY_INFO)
+            _write_str(i)
+            _check_msg(msg.ANS_QUERY)
+            query_ans[i] = _read_str()
 
-            log.info("[judge {0!r}] successfully connected" . format(judge.id))
+        web.register_new_judge(judge, query_ans)
+        self._web_registered = True
 
-            while not control.test_termination_flag():
-                self._solve_task()
+        log.info("[judge {0!r}] successfully connected with {1} worker slot(s)" .
+                format(judge.id, nslot))
 
-            self._snc.close()
-            self._sock.close()
-
-        except snc.Error:
+        if version == msg.PROTOCOL_VERSION_MUX:
+            channels = start_mux(nslot)
+            self.slots = [_slot(i, channels[i]) for i in range(nslot)]
+        else:
+            self.slots = [_slot(0, conn)]
+        return self.slots
+
+    def get_task(self, timeout = 0):
+        """get a task for the judge from the task queue, waiting at most
+        @timeout seconds; return None if no task available or the report
+        outbox is full"""
+        deadline = time.time() + timeout
+        if not _reporters.wait_not_full(timeout):
+            return None
+        return _task_queue.get(self.sched_judge, max(0, deadline - time.time()))
+
+    def on_error(self, e):
+        """log exception @e which caused the session to fail"""
+        judge = self.judge
+        if isinstance(e, snc.Error):
             log.warning("[judge {0!r}] failed because of network error" . format(judge.id))
-            self._clean()
-        except _internal_error:
-            self._clean()
-        except web.Error:
+        elif isinstance(e, _internal_error):
+            pass
+        elif isinstance(e, web.Error):
             log.warning("[judge {0!r}] failed because of error while communicating with website" . format(judge.id))
-            _write_msg(msg.ERROR)
-            self._clean()
-        except sync_dir.Error:
+            try:
+                msg.write_msg(self.conn, msg.ERROR)
+            except snc.Error:
+                pass
+        elif isinstance(e, sync_dir.Error):
             log.warning("[judge {0!r}] failed to synchronize data directory" .
                     format(judge.id))
-            self._clean()
-        except Exception as e:
+        else:
             log.warning("[judge {0!r}] error happens: {1}" .
                     format(judge.id, e))
             log.debug(traceback.format_exc())
-            self._clean()
 
-    def __del__(self):
-        if self._snc:
-            self._snc.close()
-        self._sock.close()
+    def clean(self):
+        """requeue the unfinished tasks and unregister the judge"""
+        global _task_queue, _judge_id_set, _judge_id_set_lock
+
+        for slot in self.slots:
+            if slot.cur_task:
+                _task_queue.put(slot.cur_task, False)
+                slot.cur_task = None
+
+        if self.sched_judge:
+            _task_queue.unregister(self.sched_judge)
+            self.sched_judge = None
+
+        judge = self.judge
+        if judge.id:
+            with _judge_id_set_lock:
+                _judge_id_set.remove(judge.id)
+
+        if self._web_registered:
+            try:
+                web.remove_judge(judge)
+            except web.Error:
+                log.warning("[judge {0!r}] failed to unregister on website" . format(judge.id))
+
+        log.info("[judge {0!r}] disconnected" . format(judge.id))
+
+    def solve_task(self, slot, task):
+        """judge @task, which has been taken from the task queue, in @slot"""
+        th_report = _reporters.open(task)
+        try:
+            self._solve_task(slot, task, th_report)
+        finally:
+            th_report.stop() # no effect if already stopped
 
-    def _solve_task(self):
-        judge = self._judge
+    def _solve_task(self, slot, task, th_report):
+        judge = self.judge
+        conn = slot.conn
         def _write_msg(m):
-            msg.write_msg(self._snc, m)
+            msg.write_msg(conn, m)
 
         def _write_str(s):
-            self._snc.write_str(s)
+            conn.write_str(s)
 
         def _write_uint32(v):
-            self._snc.write_uint32(v)
+            conn.write_uint32(v)
 
         def _read_msg():
-            return msg.read_msg(self._snc)
+            return msg.read_msg(conn)
 
         def _read_str():
-            return self._snc.read_str()
+            return conn.read_str()
 
         def _read_uint32():
-            return self._snc.read_uint32()
+            return conn.read_uint32()
 
         def _check_msg(m):
             if m != _read_msg():
@@ -354,64 +552,90 @@ class thread_new_judge_connection(threading.Thread):
                         format(judge.id))
                 raise _internal_error
             
-        def _stop_web_report(tell_online = True):
-            th_report.stop()
-            if tell_online:
-                while th_report.is_alive():
-                    th_report.join(msg.TELL_ONLINE_INTERVAL)
-                    _write_msg(msg.TELL_ONLINE)
-            else:
-                th_report.join()
-
-        global _task_queue
-        task = _task_queue.get(self._lang_id_set)
-        if task is None:
-            _write_msg(msg.TELL_ONLINE)
-            time.sleep(msg.TELL_ONLINE_INTERVAL)
-            return
-        
-        log.info("[judge {0!r}] received task #{1} for problem {2!r}" .
-                format(judge.id, task.id, task.prob))
-
-        self._cur_task = task
-
-        th_report = _thread_web_communicate()
-        th_report.start()
+        def _stage_end(name):
+            now = time.time()
+            stages[name] = now - stage_start[0]
+            stage_start[0] = now
+
+        def _task_finished(normal = False):
+            # the judge could go on with the next task while the reports
+            # are being sent
+            def _on_reported():
+                if th_report.check_error():
+                    if control.test_termination_flag():
+                        # keep the task in the journal, so that it is judged
+                        # and reported again after restart
+                        return
+                    # the reports failed after all the retries (while the
+                    # website is down they are kept instead), and keeping the
+                    # task would only judge it again on every restart
+                    log.error("[judge {0!r}] failed to report judge results for task #{1}, giving up" .
+                            format(judge.id, task.id))
+                elif normal:
+                    log.info("[judge {0!r}] finished task #{1} normally" .
+                            format(judge.id, task.id))
+                journal.task_finished(task)
+            th_report.stop(_on_reported)
+
+        def _task_done():
+            sj = self.sched_judge
+            _task_queue.task_done(sj, task, stages)
+            cost.task_done(task, stages)
+            log.info("[judge {0!r}] {1}" . format(judge.id, _task_queue.stat_str(sj)))
+
+        log.info("[judge {0!r}] [slot {1}] received task #{2} for problem {3!r} after {4:.3f} seconds in queue" .
+                format(judge.id, slot.idx, task.id, task.prob, time.time() - task.time_queued))
+        if log.debug_enabled():
+            log.debug("queue latency in recent dispatches: median {0[0]:.3f}s, max {0[1]:.3f}s" .
+                    format(_task_queue.latency_stat()))
+
+        slot.cur_task = task
+        journal.task_dispatched(task, judge)
+        stages = dict()
+        # dict of <stage name:str> => <time in seconds>
+        stage_start = [time.time()]
 
         if not os.path.isdir(task.prob):
-            self._cur_task = None
+            slot.cur_task = None
             log.error("No data for problem {0!r}, task #{1} discarded" .
                     format(task.prob, task.id))
             th_report.report(web.report_no_data, [task])
-            _stop_web_report()
+            _task_done()
+            _task_finished()
             return
 
         th_report.report(web.report_sync_data, [task, judge])
         _write_msg(msg.PREPARE_DATA)
         _write_str(task.prob)
         
-        speed = sync_dir.send(task.prob, self._snc)
+        speed = sync_dir.send(task.prob, conn, judge.features, judge.sync_link)
         if speed:
             log.info("[judge {0!r}] file transfer speed: {1!r} kb/s" . 
                     format(judge.id, speed))
+        sj = self.sched_judge
+        _task_queue.set_data_synced(sj, task.prob, speed is not None)
+        log.debug("[judge {0!r}] data cache hit: {1}, miss: {2}" .
+                format(judge.id, sj.cache_hit, sj.cache_miss))
+        log.debug(sync_dir.manifest_cache.stat_str())
 
         m = _read_msg()
 
         if m == msg.DATA_ERROR:
-            self._cur_task = None
+            slot.cur_task = None
             reason = _read_str()
             log.error("[judge {0!r}] [task #{1}] [prob: {2!r}] data error:\n{3}" . 
                     format(judge.id, task.id, task.prob, reason))
             th_report.report(web.report_error, [task, "data error"])
-            _stop_web_report()
+            _task_done()
+            _task_finished()
             return
         elif m != msg.DATA_OK:
             log.warning("[judge {0!r}] message check error" . format(judge.id))
             th_report.report(web.report_error, [task, "message check error"])
-            _stop_web_report(False)
             raise _internal_error
 
         ncase = _read_uint32()
+        _stage_end("sync")
 
         _write_msg(msg.START_JUDGE)
         _write_str(task.lang)
@@ -427,7 +651,6 @@ class thread_new_judge_connection(threading.Thread):
                 log.warning("[judge {0!r}] message check error" .
                         format(judge.id))
                 th_report.report(web.report_error, [task, "message check error"])
-                _stop_web_report(False)
                 raise _internal_error
 
         th_report.report(web.report_compiling, [task])
@@ -438,6 +661,7 @@ class thread_new_judge_connection(threading.Thread):
                 continue
 
             if m == msg.COMPILE_SUCCEED:
+                _stage_end("compile")
                 th_report.report(web.report_compile_success, [task, ncase])
                 break
             else:
@@ -445,11 +669,12 @@ class thread_new_judge_connection(threading.Thread):
                     th_report.report(web.report_error, [task, "message check error"])
                     log.warning("[judge {0!r}] message check error" .
                             format(judge.id))
-                    _stop_web_report(False)
                     raise _internal_error
-                self._cur_task = None
+                slot.cur_task = None
                 th_report.report(web.report_compile_failure, [task, _read_str()])
-                _stop_web_report()
+                _stage_end("compile")
+                _task_done()
+                _task_finished()
                 return
 
         prob_res = list()
@@ -464,27 +689,99 @@ class thread_new_judge_connection(threading.Thread):
                     log.warning("[judge {0!r}] message check error" .
                             format(judge.id))
                     th_report.report(web.report_error, [task, "message check error"])
-                    _stop_web_report(False)
                     raise _internal_error
             result = structures.case_result()
-            result.read(self._snc)
+            result.read(conn)
             prob_res.append(result)
 
         th_report.clean_lazy()
         th_report.report(web.report_prob_result, [task, prob_res])
 
         _check_msg(msg.REPORT_JUDGE_FINISH)
+        _stage_end("run")
 
-        self._cur_task = None
-        _stop_web_report()
+        slot.cur_task = None
+        _task_done()
+        _task_finished(True)
 
-        if th_report.check_error():
-            log.warning("[judge {0!r}] error while reporting judge results for task #{1}" .
-                    format(judge.id, task.id))
+
+class thread_new_judge_connection(threading.Thread):
+    def __init__(self, sock):
+        """serve a new connection, which should be orzoj-judge.
+        No exceptions are raised, exit silently on error
+        sock will be closed"""
+        threading.Thread.__init__(self, name = "work.thread_new_judge_connection")
+        self._sock = sock
+        self._snc = None
+        self._mux = None
+        self._slot_error = None # sys.exc_info() of the first failed slot
+        self._session = judge_session()
+
+    def run(self):
+        sess = self._session
+        try:
+            self._snc = snc.snc(self._sock, True)
+            sess.conn = self._snc
+            slots = sess.handshake(self._start_mux)
+
+            if self._mux:
+                threads = [threading.Thread(target = self._thread_slot, args = (i, ),
+                    name = "work.thread_new_judge_connection._thread_slot")
+                    for i in slots]
+                for i in threads:
+                    i.start()
+                for i in threads:
+                    i.join()
+                self._mux.close()
+                self._mux = None
+                if self._slot_error:
+                    e = self._slot_error
+                    self._slot_error = None
+                    raise e[0], e[1], e[2]
+            else:
+                while not control.test_termination_flag():
+                    self._serve(slots[0])
+
+            self._snc.close()
+            self._sock.close()
+
+        except Exception as e:
+            sess.on_error(e)
+            if self._mux:
+                self._mux.close()
+            sess.clean()
+
+    def __del__(self):
+        if self._snc:
+            self._snc.close()
+        self._sock.close()
+
+    def _start_mux(self, nslot):
+        msg.write_msg(self._snc, msg.MUX_BEGIN)
+        self._snc.write_uint32(nslot)
+        self._mux = mux.Mux(self._snc, nslot)
+        return [self._mux.channel(i) for i in range(nslot)]
+
+    def _serve(self, slot):
+        # wake up as soon as a usable task is put, and send TELL_ONLINE
+        # only if nothing arrives within the interval
+        task = self._session.get_task(msg.TELL_ONLINE_INTERVAL)
+        if task is None:
+            msg.write_msg(slot.conn, msg.TELL_ONLINE)
         else:
-            log.info("[judge {0!r}] finished task #{1} normally" .
-                    format(judge.id, task.id))
+            self._session.solve_task(slot, task)
 
+    def _thread_slot(self, slot):
+        """run tasks in @slot until termination or an error in any slot,
+        which is saved and re-raised by self.run()"""
+        try:
+            while not control.test_termination_flag() and self._slot_error is None:
+                self._serve(slot)
+        except Exception:
+            if self._slot_error is None:
+                self._slot_error = sys.exc_info()
+            # wake up the other slots so that the connection could be closed
+            self._mux.close()
 
 
 def _set_refresh_interval(arg):
@@ -499,15 +796,127 @@ def _set_id_max_len(arg):
     if _id_max_len < 1:
         raise conf.UserError("Option {0} can not be less than 1" . format(arg[0]))
 
+def _set_max_worker_slots(arg):
+    global _max_worker_slots
+    _max_worker_slots = int(arg[1])
+    if _max_worker_slots < 1:
+        raise conf.UserError("Option {0} can not be less than 1" . format(arg[0]))
+
+def _set_long_poll(arg):
+    global _long_poll
+    _long_poll = float(arg[1])
+    if _long_poll < 0:
+        raise conf.UserError("Option {0} can not be negative" . format(arg[0]))
+
+def _set_notify_port(arg):
+    global _notify_port
+    _notify_port = int(arg[1])
+    if _notify_port < 0 or _notify_port > 65535:
+        raise conf.UserError("invalid port for {0}: {1}" . format(arg[0], arg[1]))
+
+def _set_reporter_threads(arg):
+    _reporters.nthread = int(arg[1])
+    if _reporters.nthread < 1:
+        raise conf.UserError("Option {0} can not be less than 1" . format(arg[0]))
+
+def _set_report_outbox_size(arg):
+    _reporters.outbox_size = int(arg[1])
+    if _reporters.outbox_size < 1:
+        raise conf.UserError("Option {0} can not be less than 1" . format(arg[0]))
+
+def _set_fetch_batch_size(arg):
+    global _fetch_batch_size
+    _fetch_batch_size = int(arg[1])
+    if _fetch_batch_size < 1:
+        raise conf.UserError("Option {0} can not be less than 1" . format(arg[0]))
+
 def _set_data_dir(arg):
     os.chdir(arg[1])
 
+def _set_manifest_file(arg):
+    global _manifest_file
+    _manifest_file = arg[1]
+
+def _save_manifest(force = False):
+    if _manifest_file:
+        sync_dir.manifest_cache.save(_manifest_file, force)
+
+def _init_manifest():
+    sync_dir.manifest_cache = sync_dir.Manifest_cache()
+    if not _manifest_file or not os.path.exists(_manifest_file):
+        return
+    try:
+        sync_dir.manifest_cache.load(_manifest_file)
+        log.info("loaded manifest cache from {0!r}" . format(_manifest_file))
+    except Exception as e:
+        log.error("failed to read manifest cache file {0!r}: {1}" . format(_manifest_file, e))
+
+def _set_delta_min_size(arg):
+    sync_dir.delta_min_size = int(arg[1])
+    if sync_dir.delta_min_size < 0:
+        raise conf.UserError("Option {0} can not be negative" . format(arg[0]))
+
+def _set_resume_min_size(arg):
+    sync_dir.resume_min_size = int(arg[1])
+    if sync_dir.resume_min_size < 0:
+        raise conf.UserError("Option {0} can not be negative" . format(arg[0]))
+
+def _set_sync_codec(arg):
+    try:
+        sync_dir.codec = sync_dir.parse_codec(arg[1])
+    except ValueError as e:
+        raise conf.UserError("Option {0}: {1}" . format(arg[0], e))
+
 def _set_max_queue_size(arg):
-    global _max_queue_size
-    _max_queue_size = int(arg[1])
+    _task_queue.max_size = int(arg[1])
+
+def _set_load_balance_alpha(arg):
+    _task_queue.balance_alpha = float(arg[1])
+    if _task_queue.balance_alpha < 0 or _task_queue.balance_alpha > 1:
+        raise conf.UserError("Option {0} should be between 0 and 1" . format(arg[0]))
+
+def _sjf_key(task):
+    """shortest expected job first, with aging: a task could be overtaken only
+    by tasks queued less than SjfCostWeight times the difference of their
+    expected costs later"""
+    return task.time_queued + _sjf_cost_weight * cost.estimate(task.prob, task.lang)
+
+def _set_sched_policy(arg):
+    if arg[1] == "fifo":
+        _task_queue.key_func = None
+    elif arg[1] == "sjf":
+        _task_queue.key_func = _sjf_key
+    else:
+        raise conf.UserError("unknown scheduling policy: {0!r}" . format(arg[1]))
+
+def _set_sjf_cost_weight(arg):
+    global _sjf_cost_weight
+    _sjf_cost_weight = float(arg[1])
+    if _sjf_cost_weight < 0:
+        raise conf.UserError("Option {0} can not be negative" . format(arg[0]))
+
+def _set_affinity_delay(arg):
+    _task_queue.affinity_delay = float(arg[1])
+    if _task_queue.affinity_delay < 0:
+        raise conf.UserError("Option {0} can not be negative" . format(arg[0]))
 
 conf.simple_conf_handler("RefreshInterval", _set_refresh_interval, default = "2")
 conf.simple_conf_handler("JudgeIdMaxLen", _set_id_max_len, default = "20")
+conf.simple_conf_handler("MaxWorkerSlots", _set_max_worker_slots, default = "32")
+conf.simple_conf_handler("LongPollWait", _set_long_poll, default = "0")
+conf.simple_conf_handler("NotifyPort", _set_notify_port, default = "0")
+conf.simple_conf_handler("FetchBatchSize", _set_fetch_batch_size, default = "64")
+conf.simple_conf_handler("ReporterThreads", _set_reporter_threads, default = "16")
+conf.simple_conf_handler("ReportOutboxSize", _set_report_outbox_size, default = "10000")
 conf.simple_conf_handler("DataDir", _set_data_dir)
+conf.simple_conf_handler("ManifestCacheFile", _set_manifest_file, default = "orzoj-server.manifest")
+conf.simple_conf_handler("DeltaMinSize", _set_delta_min_size, default = "1048576")
+conf.simple_conf_handler("SyncCodec", _set_sync_codec, default = "auto")
+conf.simple_conf_handler("ResumeMinSize", _set_resume_min_size, default = "67108864")
 conf.simple_conf_handler("MaxQueueSize", _set_max_queue_size, default = "1024")
+conf.simple_conf_handler("SchedPolicy", _set_sched_policy, default = "fifo")
+conf.simple_conf_handler("SjfCostWeight", _set_sjf_cost_weight, default = "10")
+conf.simple_conf_handler("AffinityDelay", _set_affinity_delay, default = "0")
+conf.simple_conf_handler("LoadBalanceAlpha", _set_load_balance_alpha, default = "0")
 
+conf.register_init_func(_init_manifest)
@@ -85,7 +85,40 @@ class _socket_real:
             self._socket = None
 
 
-class snc:
+class conn_base:
+    """methods for reading and writing integers and strings,
+    based on read() and write() of subclasses"""
+
+    def read_int32(self, timeout = 0):
+        """read a signed 32-bit integer and return it"""
+        return struct.unpack("!i", self.read(4, timeout))[0]
+
+    def write_int32(self, val, timeout = 0):
+        """write a signed 32-bit integer"""
+        self.write(struct.pack("!i", val), timeout)
+
+    def read_uint32(self, timeout = 0):
+        """read an unsigned 32-bit integer and return it"""
+        return struct.unpack("!I", self.read(4, timeout))[0]
+
+    def write_uint32(self, val, timeout = 0):
+        """write an unsigned 32-bit integer"""
+        self.write(struct.pack("!I", val), timeout)
+
+    def read_str(self, timeout = 0):
+        """read a string and return it"""
+        len = self.read_uint32(timeout)
+        return self.read(len, timeout)
+
+    def write_str(self, data, timeout = 0):
+        """write a string"""
+        if type(data) is unicode:
+            data = str(data.encode('UTF-8'))
+        self.write_uint32(len(data), timeout)
+        self.write(data, timeout)
+
+
+class snc(conn_base):
     def __init__(self, sock, is_server = 0):
         self._snc = None
         try:
@@ -129,33 +162,21 @@ class snc:
             log.error("failed to write:\n{0!r}" . format(e))
             raise Error
 
-    def read_int32(self, timeout = 0):
-        """read a signed 32-bit integer and return it"""
-        return struct.unpack("!i", self.read(4, timeout))[0]
-
-    def write_int32(self, val, timeout = 0):
-        """write a signed 32-bit integer"""
-        self.write(struct.pack("!i", val), timeout)
-
-    def read_uint32(self, timeout = 0):
-        """read an unsigned 32-bit integer and return it"""
-        return struct.unpack("!I", self.read(4, timeout))[0]
-
-    def write_uint32(self, val, timeout = 0):
-        """write an unsigned 32-bit integer"""
-        self.write(struct.pack("!I", val), timeout)
-
-    def read_str(self, timeout = 0):
-        """read a string and return it"""
-        len = self.read_uint32(timeout)
-        return self.read(len, timeout)
+    def pending(self):
+        """return the number of bytes that can be read without waiting for the network"""
+        try:
+            return self._snc.pending()
+        except Exception as e:
+            log.error("failed to get pending bytes:\n{0!r}" . format(e))
+            raise Error
 
-    def write_str(self, data, timeout = 0):
-        """write a string"""
-        if type(data) is unicode:
-            data = str(data.encode('UTF-8'))
-        self.write_uint32(len(data), timeout)
-        self.write(data, timeout)
+    def fileno(self):
+        """return the file descriptor of the underlying socket"""
+        try:
+            return self._snc.fileno()
+        except Exception as e:
+            log.error("failed to get file descriptor:\n{0!r}" . format(e))
+            raise Error
 
     def close(self):
         if self._snc:
@@ -29,6 +29,8 @@ class judge:
         self.id = None  # should be assigned a string 
         self.lang_supported = set([])
         self.id_num = None # will be assigned in web.register_new_judge
+        self.features = set() # see msg.FEATURES_QUERY
+        self.sync_link = None # sync_dir.Link_stats, used by orzoj-server
 
 class task:
     def __init__(self):
@@ -25,67 +25,523 @@
 class Error(Exception):
     pass
 
-import os, os.path, hashlib, threading, tempfile, tarfile, traceback
+import os, os.path, stat, hashlib, threading, tempfile, tarfile, traceback, time, shutil, errno
+import math, mmap, struct, zlib
+from collections import deque
 from orzoj import filetrans, log, snc, msg
 
+try:
+    from orzoj import _delta as _delta_speedups
+except ImportError:
+    _delta_speedups = None
+
+try:
+    import bz2
+except ImportError:
+    bz2 = None
+
+# optional features supported by sync_dir, see msg.FEATURES_QUERY
+#
+# "syncdir-stream": orzoj-server could send SYNCDIR_STREAM instead of
+#   SYNCDIR_FTRANS, followed by the tar file (compressed as chosen by
+#   orzoj-server, see codec) of the requested files in chunks of (size:uint32, data), and then (0:uint32,
+#   SHA-1 digest of all the data); the size _STREAM_ABORT means orzoj-server
+#   failed to create the tar file. The tar file is created, sent and
+#   extracted at the same time, without temporary archives; the files are
+#   moved into the data directory after the digest is checked.
+#
+# "syncdir-delta": after SYNCDIR_FILELIST, orzoj-server could send
+#   SYNCDIR_DELTA to offer block delta transfer (like rsync) for the requested
+#   files of at least delta_min_size bytes; the judge answers with the
+#   signatures of its stale copies of them (see _signature), gets for each
+#   file with a signature the instructions to rebuild it (see _send_delta),
+#   and then sends SYNCDIR_FILELIST again with the files still needed, which
+#   are transferred as usual.
+#
+# "syncdir-bz2": the tar file could be compressed by bzip2; without it, only
+#   gzip or no compression is used (which tarfile of any judge extracts)
+FEATURES = ("syncdir-stream", "syncdir-delta") + filetrans.FEATURES
+if bz2 is not None:
+    FEATURES += ("syncdir-bz2", )
+
 # during directory synchronizing, msg.TELL_ONLINE may be sent
 # when busy computing something
 
+_RACY_TIME = 2 # files modified less than _RACY_TIME seconds before hashing are not cached
+_SAVE_INTERVAL = 30 # minimal time in seconds between two writes of the manifest cache file
+
+_STREAM_CHUNK = 64 * 1024 # size of the chunks in a stream
+_STREAM_CHUNK_MAX = 16 * 1024 * 1024 # larger chunks are considered broken
+_STREAM_QUEUE = 16 # maximal number of chunks waiting in a _Pipe
+_STREAM_ABORT = 0xffffffff
+
+_DELTA_BLOCK_MIN = 2 * 1024
+_DELTA_BLOCK_MAX = 128 * 1024
+_DELTA_SCAN = 1024 * 1024 # literal data are sent at least every _DELTA_SCAN bytes
+_DELTA_BITMAP_SHIFT = 12 # the filter of weak checksums has 1 << (32 - _DELTA_BITMAP_SHIFT) bits
+_DELTA_SIG = struct.Struct("!I16s") # (weak checksum, MD5) of a block
+(_DELTA_END, _DELTA_COPY, _DELTA_LITERAL) = range(3)
+
+_GZIP_LEVEL = 6 # level of gzip if not given, see parse_codec
+_BZ2_LEVEL = 9 # level of bz2 if not given
+# codecs tried by "auto", see _choose_codec
+_AUTO_CODECS = (("none", 0), ("gzip", 1), ("gzip", _GZIP_LEVEL), ("bz2", _BZ2_LEVEL))
+_SAMPLE_SIZE = 64 * 1024 # bytes sampled from each file to estimate compression
+_SAMPLE_FILES = 4 # maximal number of files sampled
+_LINK_SPEED_DEFAULT = 12.5e6 # bytes per second assumed before any measurement
+_LINK_MIN_BYTES = 256 * 1024 # smaller transfers are not used to measure link speed
+_LINK_ALPHA = 0.3 # weight of a new measurement of link speed
+
+def _sha1_file(path):
+    with open(path, 'rb') as f:
+        sha1_ctx = hashlib.sha1()
+        while True:
+            buf = f.read(65536)
+            if not buf:
+                return sha1_ctx.digest()
+            sha1_ctx.update(buf)
+
+class Manifest_cache:
+    """checksums of the files in the synchronized directories, so that a
+    file is hashed again only if its size, mtime or inode has changed
+
+    Files modified shortly before being hashed are not cached, since they
+    could be modified again without changing the mtime.
+
+    cache file format (one file per line, fields separated by tabs):
+        <directory> <file name> <size> <mtime> <inode> <sha1 in hex>
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._dirs = dict() # dict of <directory> => dict of <file name> => ((<size>, <mtime>, <inode>), <checksum>)
+        self._dirty = False
+        self._last_save = 0
+        self.hit = 0
+        self.miss = 0
+
+    def file_list(self, path):
+        """return a list of tuple(<filename>, <checksum>) of the regular
+        files in directory @path"""
+        with self._lock:
+            old = self._dirs.get(path, dict())
+        new = dict()
+        ret = list()
+        nhit = 0
+        for i in os.listdir(path):
+            pf = os.path.join(path, i)
+            now = time.time()
+            st = os.stat(pf)
+            if not stat.S_ISREG(st.st_mode):
+                continue
+            key = (st.st_size, st.st_mtime, st.st_ino)
+            try:
+                (key_old, checksum) = old[i]
+            except KeyError:
+                key_old = None
+            if key_old == key:
+                nhit += 1
+            else:
+                checksum = _sha1_file(pf)
+            if now - st.st_mtime >= _RACY_TIME:
+                new[i] = (key, checksum)
+            ret.append((i, checksum))
+        with self._lock:
+            self.hit += nhit
+            self.miss += len(ret) - nhit
+            if new != old:
+                self._dirs[path] = new
+                self._dirty = True
+        return ret
+
+    def set_files(self, path, flist):
+        """record the checksums of the files in directory @path, replacing
+        those recorded before, where @flist is a list of
+        tuple(<filename>, <checksum>) computed from the files themselves;
+        other files in @path will be hashed by the next file_list()"""
+        new = dict()
+        now = time.time()
+        for (i, checksum) in flist:
+            try:
+                st = os.stat(os.path.join(path, i))
+            except OSError:
+                continue
+            if now - st.st_mtime >= _RACY_TIME:
+                new[i] = ((st.st_size, st.st_mtime, st.st_ino), checksum)
+        with self._lock:
+            self._dirs[path] = new
+            self._dirty = True
+
+    def stat_str(self):
+        with self._lock:
+            return "manifest cache hit: {0}, miss: {1}" . format(self.hit, self.miss)
+
+    def load(self, fpath):
+        with open(fpath, "r") as f:
+            for line in f:
+                fields = line.rstrip("\n").split("\t")
+                try:
+                    if len(fields) != 6:
+                        raise ValueError
+                    key = (int(fields[2]), float(fields[3]), int(fields[4]))
+                    checksum = fields[5].decode("hex")
+                except (ValueError, TypeError):
+                    log.warning("invalid line in manifest cache file {0!r}: {1!r}" .
+                            format(fpath, line))
+                    continue
+                self._dirs.setdefault(fields[0], dict())[fields[1]] = (key, checksum)
+
+    def save(self, fpath, force = False):
+        """write the cache to @fpath if it has changed and at least
+        _SAVE_INTERVAL seconds have passed since last write, or if @force
+        is True"""
+        now = time.time()
+        with self._lock:
+            if not self._dirty or (not force and now - self._last_save < _SAVE_INTERVAL):
+                return
+            lines = ["{0}\t{1}\t{2}\t{3!r}\t{4}\t{5}\n" . format(d, name, key[0], key[1], key[2],
+                checksum.encode("hex")) for (d, files) in self._dirs.iteritems()
+                for (name, (key, checksum)) in files.iteritems()]
+            self._dirty = False
+            self._last_save = now
+
+        tmp = fpath + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                f.write("" . join(lines))
+            os.rename(tmp, fpath)
+        except Exception as e:
+            log.error("failed to write manifest cache file {0!r}: {1}" . format(fpath, e))
+
+class Blob_store:
+    """files stored by their checksums, so that a file used by several
+    problems is received and stored only once
+
+    The files in the data directories are hard links to the files in the
+    store (or copies if hard links are not supported), and files in the
+    store not linked by any data directory are removed by gc().
+
+    @data_dir is where the data directories are; self.linked tells whether
+    files in the store could be hard linked there."""
+    def __init__(self, root, data_dir = os.curdir):
+        self._root = root
+        self._lock = threading.Lock()
+        self.hit = 0
+        if not os.path.isdir(root):
+            os.makedirs(root)
+        self.linked = self._check_link(data_dir)
+
+    def _check_link(self, data_dir):
+        (fd, src) = tempfile.mkstemp(".tmp", "link-check.", self._root)
+        os.close(fd)
+        dest = os.path.join(data_dir, os.path.basename(src))
+        try:
+            os.link(src, dest)
+            os.remove(dest)
+            return True
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                raise
+            return False
+        finally:
+            os.remove(src)
+
+    def _path(self, checksum):
+        h = checksum.encode("hex")
+        return os.path.join(self._root, h[:2], h)
+
+    def has(self, checksum):
+        return os.path.isfile(self._path(checksum))
+
+    def get(self, checksum, dest):
+        """make @dest the file with @checksum; return whether it is in the store"""
+        src = self._path(checksum)
+        try:
+            _link(src, dest)
+        except (OSError, IOError) as e:
+            if e.errno == errno.ENOENT:
+                return False
+            raise
+        with self._lock:
+            self.hit += 1
+        return True
+
+    def add(self, checksum, src):
+        """put file @src, whose checksum is @checksum, into the store"""
+        dest = self._path(checksum)
+        if os.path.isfile(dest):
+            return
+        d = os.path.dirname(dest)
+        if not os.path.isdir(d):
+            try:
+                os.mkdir(d)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+        tmp = "{0}.{1}.tmp" . format(dest, threading.current_thread().ident)
+        _link(src, tmp)
+        os.rename(tmp, dest)
+
+    def gc(self):
+        """remove the files not used by any data directory and return the
+        number of them; nothing is removed if the data directories are
+        copies, since the number of links tells nothing then"""
+        if not self.linked:
+            return 0
+        cnt = 0
+        for d in os.listdir(self._root):
+            d = os.path.join(self._root, d)
+            if not os.path.isdir(d):
+                continue
+            for i in os.listdir(d):
+                pf = os.path.join(d, i)
+                if os.stat(pf).st_nlink == 1:
+                    os.remove(pf)
+                    cnt += 1
+        return cnt
+
+    def stat_str(self):
+        with self._lock:
+            return "blob store hit: {0}" . format(self.hit)
+
+def _link(src, dest):
+    """make @dest a hard link to @src, or a copy of it if hard links are
+    not supported"""
+    try:
+        os.link(src, dest)
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            raise
+        shutil.copy2(src, dest)
+
+class Dir_lock:
+    """reader/writer lock of a directory used by several threads at the
+    same time: it is read with the shared lock, and modified with the
+    exclusive lock, which is taken by upgrading a shared lock
+
+    The waiting methods call @idle() every msg.TELL_ONLINE_INTERVAL seconds
+    while waiting, and exceptions raised by @idle() are passed to the
+    caller. Threads waiting for the exclusive lock go before those waiting
+    for the shared lock. The lock knows which threads hold it, so a thread
+    could always call release() when done, whatever it holds."""
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._shared = set() # threads holding the shared lock
+        self._upgrading = False # some thread is waiting to upgrade
+        self._exclusive = None # thread holding the exclusive lock
+
+    def _wait(self, idle):
+        # must be called with self._cond held
+        self._cond.wait(msg.TELL_ONLINE_INTERVAL)
+        self._cond.release()
+        try:
+            idle()
+        finally:
+            self._cond.acquire()
+
+    def acquire_shared(self, idle):
+        with self._cond:
+            while self._exclusive is not None or self._upgrading:
+                self._wait(idle)
+            self._shared.add(threading.current_thread())
+
+    def held(self):
+        """return whether the calling thread holds the lock"""
+        me = threading.current_thread()
+        with self._cond:
+            return me in self._shared or self._exclusive is me
+
+    def release(self):
+        """release the lock held by the calling thread, if any"""
+        me = threading.current_thread()
+        with self._cond:
+            if self._exclusive is me:
+                self._exclusive = None
+            else:
+                self._shared.discard(me)
+            self._cond.notify_all()
+
+    def upgrade(self, idle):
+        """turn the shared lock held by the caller into the exclusive lock;
+        return False if the shared lock had to be released meanwhile, since
+        another thread was upgrading, so that the directory may have been
+        modified, or True otherwise
+
+        If @idle() raises an exception, the caller holds either the shared
+        lock or nothing (see held())."""
+        me = threading.current_thread()
+        with self._cond:
+            kept = not self._upgrading
+            if not kept:
+                self._shared.discard(me)
+                self._cond.notify_all()
+                while self._exclusive is not None or self._upgrading:
+                    self._wait(idle)
+                self._shared.add(me)
+            self._upgrading = True
+            try:
+                while len(self._shared) > 1:
+                    self._wait(idle)
+            finally:
+                self._upgrading = False
+                self._cond.notify_all()
+            self._shared.discard(me)
+            self._exclusive = me
+            return kept
+
+    def downgrade(self):
+        """turn the exclusive lock held by the caller into a shared lock"""
+        with self._cond:
+            self._exclusive = None
+            self._shared.add(threading.current_thread())
+            self._cond.notify_all()
+
+# if not None, the Manifest_cache used by send() and recv()
+manifest_cache = None
+
+# if not None, the Blob_store used by recv()
+blob_store = None
+
+# minimal size of the files sent by send() with block delta if the judge
+# supports it, or 0 to always send whole files
+delta_min_size = 0
+
+# the codec used by send() to compress the tar file, see parse_codec()
+codec = ("gzip", _GZIP_LEVEL)
+
+# minimal total size of the files sent by send() with OFTP instead of a
+# stream if the judge supports OFTP version 2, so that the transfer could
+# be resumed after the connection is lost, or 0 to always stream
+resume_min_size = 0
+
+# the codecs chosen by "auto" for the OFTP transfers not finished yet, so
+# that the same tar file is made again when retrying and the transfer is
+# resumed: dict of (<path>, <tuple of file names>) => <codec>
+_resume_codec = dict()
+_resume_codec_lock = threading.Lock()
+
 class _thread_get_file_list(threading.Thread):
-    def __init__(self, path, return_list = True):
+    def __init__(self, path, return_list = True, cache = None):
         """@return_list: whether to return the result as list of tuple(<filename>, <checksum>)
         or dict(<filename> => <checksum>)
+        @cache: the Manifest_cache to use, or None
         self.result would be the requested result, or None on error"""
         threading.Thread.__init__(self)
         self.result = None # public, and should not be modified
         self._path = path
         self._ret_list = return_list
+        self._cache = cache
 
     def run(self):
-        def _sha1_file(path):
-            with open(path, 'rb') as f:
-                sha1_ctx = hashlib.sha1()
-                while True:
-                    buf = f.read(sha1_ctx.block_size)
-                    if not buf:
-                        return sha1_ctx.digest()
-                    sha1_ctx.update(buf)
-
         try:
-            rlist = self._ret_list
             path = self._path
-            if rlist:
-                ret = list()
+            if self._cache:
+                ret = self._cache.file_list(path)
             else:
-                ret = dict()
-            for i in os.listdir(path):
-                pf = os.path.join(path, i)
-                if os.path.isfile(pf):
-                    checksum = _sha1_file(pf)
-                    if rlist:
-                        tmp = (i, checksum)
-                        ret.append(tmp)
-                    else:
-                        ret[i] = checksum
+                ret = list()
+                for i in os.listdir(path):
+                    pf = os.path.join(path, i)
+                    if os.path.isfile(pf):
+                        ret.append((i, _sha1_file(pf)))
+            if not self._ret_list:
+                ret = dict(ret)
             self.result = ret
                 
         except Exception as e:
             log.error("failed to obtain file list of: {0}" . format(e))
 
+class _Pipe:
+    """a pipe of chunks between two threads with file-like interfaces, the
+    writer waiting if _STREAM_QUEUE chunks have not been read; if one end
+    fails and calls abort(), the other end gets Error"""
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._chunks = deque()
+        self._closed = False
+        self._aborted = False
+        self._wbuf = list()
+        self._wsize = 0
+        self._rbuf = ""
+        self._rpos = 0
+
+    def write(self, s):
+        self._wbuf.append(s)
+        self._wsize += len(s)
+        if self._wsize >= _STREAM_CHUNK:
+            self.put("" . join(self._wbuf))
+            self._wbuf = list()
+            self._wsize = 0
+
+    def put(self, chunk):
+        with self._cond:
+            while len(self._chunks) >= _STREAM_QUEUE and not self._aborted:
+                self._cond.wait()
+            if self._aborted:
+                raise Error
+            self._chunks.append(chunk)
+            self._cond.notify_all()
+
+    def close(self):
+        """no more data will be written"""
+        if self._wsize:
+            self.put("" . join(self._wbuf))
+            self._wbuf = list()
+            self._wsize = 0
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def abort(self):
+        with self._cond:
+            self._aborted = True
+            self._cond.notify_all()
+
+    def get(self):
+        """return the next chunk, or None if the pipe is closed and empty"""
+        with self._cond:
+            while not self._chunks and not self._closed and not self._aborted:
+                self._cond.wait()
+            if self._aborted:
+                raise Error
+            if not self._chunks:
+                return None
+            self._cond.notify_all()
+            return self._chunks.popleft()
+
+    def read(self, size = -1):
+        ret = list()
+        while size != 0:
+            if self._rpos == len(self._rbuf):
+                self._rbuf = self.get()
+                self._rpos = 0
+                if self._rbuf is None:
+                    self._rbuf = ""
+                    break
+            if size < 0:
+                end = len(self._rbuf)
+            else:
+                end = min(len(self._rbuf), self._rpos + size)
+                size -= end - self._rpos
+            ret.append(self._rbuf[self._rpos:end])
+            self._rpos = end
+        return "" . join(ret)
+
 class _thread_make_tar(threading.Thread):
-    def __init__ (self, fobj, dirpath, flist):
+    def __init__ (self, fobj, dirpath, flist, codec):
         threading.Thread.__init__(self)
         self._fobj = fobj
         self._dirpath = dirpath
         self._flist = flist
+        self._codec = codec
         self.error = False
 
     def run(self):
         try:
-            tf = tarfile.open(mode = 'w:gz', fileobj = self._fobj, dereference = True)
+            writer = _Compress_writer(self._fobj, _compressor(self._codec))
+            tf = tarfile.open(mode = 'w|', fileobj = writer, dereference = True)
             for f in self._flist:
                 tf.add(os.path.join(self._dirpath, f), f)
             tf.close()
+            writer.close()
         except Exception as e:
             log.error("failed to create tar file: {0}" . format(e))
             self.error = True
@@ -106,9 +562,120 @@ class _thread_extract_tar(threading.Thread):
             log.error("failed to extract tar file: {0}" . format(e))
             self.error = True
 
-def send(path, conn):
+def parse_codec(s):
+    """parse codec specification @s, one of "none", "gzip[:<level>]",
+    "bz2[:<level>]" and "auto" (choose for each transfer, see
+    _choose_codec), into tuple(<name>, <level>); raise ValueError if
+    invalid"""
+    fields = s.split(":")
+    name = fields[0]
+    if name in ("none", "auto"):
+        if len(fields) != 1:
+            raise ValueError("codec {0!r} takes no level" . format(name))
+        return (name, 0)
+    if name not in ("gzip", "bz2"):
+        raise ValueError("unknown codec: {0!r}" . format(name))
+    if name == "bz2" and bz2 is None:
+        raise ValueError("bz2 is not available")
+    if len(fields) == 1:
+        return (name, _BZ2_LEVEL if name == "bz2" else _GZIP_LEVEL)
+    if len(fields) != 2 or not fields[1].isdigit() or not 1 <= int(fields[1]) <= 9:
+        raise ValueError("invalid codec level: {0!r}" . format(s))
+    return (name, int(fields[1]))
+
+def _codec_str(codec):
+    if codec[0] in ("none", "auto"):
+        return codec[0]
+    return "{0}:{1}" . format(*codec)
+
+def _compressor(codec):
+    """return a compressor object for @codec, or None if no compression"""
+    (name, level) = codec
+    if name == "gzip":
+        return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    if name == "bz2":
+        return bz2.BZ2Compressor(level)
+    return None
+
+class _Compress_writer:
+    """file-like object writing the data compressed by @compressor (or as
+    is if it is None) to @fobj; close() must be called after the last
+    write"""
+    def __init__(self, fobj, compressor):
+        self._fobj = fobj
+        self._compressor = compressor
+
+    def write(self, s):
+        if self._compressor:
+            s = self._compressor.compress(s)
+        if s:
+            self._fobj.write(s)
+
+    def close(self):
+        if self._compressor:
+            s = self._compressor.flush()
+            if s:
+                self._fobj.write(s)
+
+class Link_stats:
+    """measured throughput of the connection to a judge, used by codec
+    "auto" """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.speed = None # bytes per second, or None if not measured yet
+
+    def update(self, nbyte, seconds):
+        """record that @nbyte bytes were sent in @seconds"""
+        if nbyte < _LINK_MIN_BYTES or seconds <= 0:
+            return
+        speed = nbyte / seconds
+        with self._lock:
+            if self.speed is None:
+                self.speed = speed
+            else:
+                self.speed += (speed - self.speed) * _LINK_ALPHA
+
+def _choose_codec(path, flist, features, link, pipelined):
+    """choose the codec in _AUTO_CODECS with the least estimated time to
+    send files in list @flist in directory @path: the compression speed and
+    ratio of each codec are measured on a sample of the files, and the
+    speed of the link is taken from Link_stats @link; if @pipelined,
+    compression and transfer are done at the same time"""
+    sizes = sorted(((os.path.getsize(os.path.join(path, f)), f) for f in flist), reverse = True)
+    total = sum(i[0] for i in sizes)
+    sample = list()
+    for (size, f) in sizes[:_SAMPLE_FILES]:
+        with open(os.path.join(path, f), "rb") as fobj:
+            fobj.seek(max(size / 2 - _SAMPLE_SIZE / 2, 0))
+            sample.append(fobj.read(_SAMPLE_SIZE))
+    sample = "" . join(sample)
+    if not sample:
+        return ("none", 0)
+
+    speed = link.speed if link and link.speed else _LINK_SPEED_DEFAULT
+    best = None
+    for codec in _AUTO_CODECS:
+        if codec[0] == "bz2" and "syncdir-bz2" not in features:
+            continue
+        c = _compressor(codec)
+        if c is None:
+            (t_cpu, ratio) = (0, 1)
+        else:
+            t = time.time()
+            n = len(c.compress(sample)) + len(c.flush())
+            t_cpu = (time.time() - t) * total / len(sample)
+            ratio = n / float(len(sample))
+        t_net = total * ratio / speed
+        t = max(t_cpu, t_net) if pipelined else t_cpu + t_net
+        if best is None or t < best[0]:
+            best = (t, codec)
+    return best[1]
+
+def send(path, conn, features = (), link = None):
     """send the directory at @path via snc connection @conn,
-    return the speed in kb/s, or None if no file transferred"""
+    return the speed in kb/s, or None if no file transferred
+    @features: the features of the judge (see msg.FEATURES_QUERY)
+    @link: the Link_stats of the judge, or None"""
 
     def _write_msg(m):
         msg.write_msg(conn, m)
@@ -139,7 +706,7 @@ def send(path, conn):
                 raise Error
             return
 
-    flist = _thread_get_file_list(path)
+    flist = _thread_get_file_list(path, True, manifest_cache)
     flist.start()
     while flist.is_alive():
         flist.join(msg.TELL_ONLINE_INTERVAL)
@@ -162,16 +729,67 @@ def send(path, conn):
             _check_msg(msg.SYNCDIR_DONE)
             return None
 
-        flist_req = list()
-        while nfile:
-            nfile -= 1
-            flist_req.append(flist[_read_uint32()][0])
+        req = [_read_uint32() for i in range(nfile)]
+
+        if "syncdir-delta" in features and delta_min_size:
+            offers = list()
+            for i in req:
+                size = os.path.getsize(os.path.join(path, flist[i][0]))
+                if size >= delta_min_size:
+                    offers.append((i, _delta_block_size(size)))
+            if offers:
+                time_start = time.time()
+                _write_msg(msg.SYNCDIR_DELTA)
+                _write_uint32(len(offers))
+                for (i, block) in offers:
+                    _write_uint32(i)
+                    _write_uint32(block)
+                _check_msg(msg.SYNCDIR_SIGNATURES)
+                sigs = [_read_str() for i in offers]
+                nbyte = 0
+                for ((i, block), sig) in zip(offers, sigs):
+                    if sig:
+                        nbyte += _send_delta(os.path.join(path, flist[i][0]), block, sig, conn)
+                _check_msg(msg.SYNCDIR_FILELIST)
+                req = [_read_uint32() for i in range(_read_uint32())]
+                if not req:
+                    _check_msg(msg.SYNCDIR_DONE)
+                    return nbyte / 1024.0 / max(time.time() - time_start, 1e-6)
+
+        flist_req = [flist[i][0] for i in req]
+
+        stream = "syncdir-stream" in features
+        resume_key = None
+        if "oftp-2" in features and resume_min_size and sum(os.path.getsize(
+                os.path.join(path, f)) for f in flist_req) >= resume_min_size:
+            stream = False
+            resume_key = (path, tuple(flist_req))
+        time_start = time.time()
+        c = codec
+        if c[0] == "auto":
+            with _resume_codec_lock:
+                c = _resume_codec.get(resume_key)
+            if c is None:
+                c = _choose_codec(path, flist_req, features, link, stream)
+                if resume_key:
+                    with _resume_codec_lock:
+                        _resume_codec[resume_key] = c
+        elif c[0] == "bz2" and "syncdir-bz2" not in features:
+            c = ("gzip", _GZIP_LEVEL)
+
+        if stream:
+            _write_msg(msg.SYNCDIR_STREAM)
+            nbyte = _send_stream(path, flist_req, conn, c, link)
+            speed = nbyte / 1024.0 / max(time.time() - time_start, 1e-6)
+            _check_msg(msg.SYNCDIR_DONE)
+            _log_transfer(path, flist_req, c, nbyte, time.time() - time_start)
+            return speed
 
         ftar = tempfile.mkstemp('orzoj')
 
         try:
             with open(ftar[1], 'wb') as f:
-                th_mktar = _thread_make_tar(f, path, flist_req)
+                th_mktar = _thread_make_tar(f, path, flist_req, c)
                 th_mktar.start()
                 while th_mktar.is_alive():
                     th_mktar.join(msg.TELL_ONLINE_INTERVAL)
@@ -180,8 +798,15 @@ def send(path, conn):
                     raise Error
 
             _write_msg(msg.SYNCDIR_FTRANS)
-            speed = filetrans.send(ftar[1], conn)
+            speed = filetrans.send(ftar[1], conn, features)
+            if resume_key:
+                with _resume_codec_lock:
+                    _resume_codec.pop(resume_key, None)
+            nbyte = os.path.getsize(ftar[1])
+            if link and speed:
+                link.update(nbyte, nbyte / 1024.0 / speed)
             _check_msg(msg.SYNCDIR_DONE)
+            _log_transfer(path, flist_req, c, nbyte, time.time() - time_start)
             return speed
 
         finally:
@@ -207,9 +832,361 @@ def send(path, conn):
         raise Error
 
 
-def recv(path, conn):
+def _log_transfer(path, flist, codec, nbyte, seconds):
+    size = sum(os.path.getsize(os.path.join(path, f)) for f in flist)
+    log.info("sent {0} file(s) in {1!r} with codec {2}: {3:.2f} MB compressed to "
+            "{4:.2f} MB, {5:.2f} MB/s" . format(len(flist), path, _codec_str(codec),
+                size / 1e6, nbyte / 1e6, size / 1e6 / max(seconds, 1e-6)))
+
+def _send_stream(path, flist, conn, codec, link):
+    """send the tar stream, compressed with @codec, of the files in list
+    @flist in directory @path; return the number of bytes sent"""
+    pipe = _Pipe()
+    def _make_tar():
+        try:
+            writer = _Compress_writer(pipe, _compressor(codec))
+            tf = tarfile.open(mode = "w|", fileobj = writer, dereference = True)
+            for f in flist:
+                tf.add(os.path.join(path, f), f)
+            tf.close()
+            writer.close()
+            pipe.close()
+        except Exception as e:
+            if not isinstance(e, Error):
+                log.error("failed to create tar stream: {0}" . format(e))
+            pipe.abort()
+
+    th = threading.Thread(target = _make_tar, name = "sync_dir._send_stream")
+    th.start()
+    sha_ctx = hashlib.sha1()
+    nbyte = 0
+    time_write = 0 # time spent in sending, to measure the speed of the link
+    try:
+        while True:
+            try:
+                chunk = pipe.get()
+            except Error:
+                conn.write_uint32(_STREAM_ABORT)
+                raise
+            if chunk is None:
+                break
+            t = time.time()
+            conn.write_uint32(len(chunk))
+            conn.write(chunk)
+            time_write += time.time() - t
+            sha_ctx.update(chunk)
+            nbyte += len(chunk)
+        conn.write_uint32(0)
+        conn.write(sha_ctx.digest())
+    finally:
+        pipe.abort() # stop _make_tar on error
+        th.join()
+    if link:
+        link.update(nbyte, time_write)
+    return nbyte
+
+def _recv_ftrans(path, conn):
+    """receive the tar file with filetrans and extract it to @path;
+    return the speed"""
+    ftar = tempfile.mkstemp('orzoj')
+    try:
+        speed = filetrans.recv(ftar[1], conn)
+        with open(ftar[1], 'r') as f:
+            th_extar = _thread_extract_tar(f, path)
+            th_extar.start()
+            while th_extar.is_alive():
+                th_extar.join(msg.TELL_ONLINE_INTERVAL)
+                msg.write_msg(conn, msg.TELL_ONLINE)
+            if th_extar.error:
+                raise Error
+        return speed
+
+    finally:
+        os.close(ftar[0])
+        os.remove(ftar[1])
+
+def _recv_stream(path, conn):
+    """receive the tar stream and extract it to @path while receiving;
+    return the speed
+
+    The files are extracted to a temporary directory next to @path, and
+    moved into @path only after the SHA-1 digest is checked."""
+    time_start = time.time()
+    tmpdir = tempfile.mkdtemp(".tmp", ".orzoj-stream.",
+            os.path.dirname(os.path.abspath(path)))
+    try:
+        speed = _recv_stream_to(tmpdir, conn, time_start)
+        for i in os.listdir(tmpdir):
+            os.rename(os.path.join(tmpdir, i), os.path.join(path, i))
+        return speed
+    finally:
+        shutil.rmtree(tmpdir, True)
+
+def _recv_stream_to(path, conn, time_start):
+    pipe = _Pipe()
+    result = [False]
+    def _extract_tar():
+        try:
+            tf = tarfile.open(mode = "r|*", fileobj = pipe)
+            tf.extractall(path)
+            tf.close()
+            # the padding after the end of the archive
+            while pipe.get() is not None:
+                pass
+            result[0] = True
+        except Exception as e:
+            if not isinstance(e, Error):
+                log.error("failed to extract tar stream: {0}" . format(e))
+            pipe.abort()
+
+    th = threading.Thread(target = _extract_tar, name = "sync_dir._recv_stream")
+    th.start()
+    sha_ctx = hashlib.sha1()
+    nbyte = 0
+    try:
+        while True:
+            size = conn.read_uint32()
+            if size == 0:
+                break
+            if size == _STREAM_ABORT:
+                log.warning("orzoj-server failed to send tar stream")
+                raise Error
+            if size > _STREAM_CHUNK_MAX:
+                log.warning("invalid chunk size in tar stream: {0}" . format(size))
+                raise Error
+            chunk = conn.read(size)
+            sha_ctx.update(chunk)
+            nbyte += size
+            pipe.put(chunk)
+        pipe.close()
+        digest = conn.read(sha_ctx.digest_size)
+    except:
+        pipe.abort()
+        raise
+    finally:
+        th.join()
+    if not result[0]:
+        raise Error
+    if digest != sha_ctx.digest():
+        log.warning("SHA1 check failed while receiving tar stream")
+        raise Error
+    return nbyte / 1024.0 / max(time.time() - time_start, 1e-6)
+
+def _delta_block_size(size):
+    """block size for the delta of a file of @size bytes, about sqrt(size) so
+    that both the signature and the data of changed blocks are small"""
+    block = int(math.sqrt(size)) / 1024 * 1024
+    return min(max(block, _DELTA_BLOCK_MIN), _DELTA_BLOCK_MAX)
+
+def _adler32(s):
+    return zlib.adler32(s) & 0xffffffff
+
+def _bitmap_index(weak):
+    return ((weak * 2654435761) & 0xffffffff) >> _DELTA_BITMAP_SHIFT
+
+def _py_find(data, start, end, block, bitmap, weaks):
+    """return (<offset>, <weak checksum>) of the first block of @data
+    beginning in [@start, @end) whose weak checksum (adler32) is a key of
+    dict @weaks, or (-1, 0) if none; @bitmap is a filter of the keys of
+    @weaks (indexed by _bitmap_index) used by the C version"""
+    n = len(data)
+    if start < 0 or start >= end or block <= 0 or start + block > n:
+        return (-1, 0)
+    weak = _adler32(data[start:start + block])
+    (a, b) = (weak & 0xffff, weak >> 16)
+    nmod = block % 65521
+    pos = start
+    while True:
+        if weak in weaks:
+            return (pos, weak)
+        if pos + 1 >= end or pos + block >= n:
+            return (-1, 0)
+        (x0, xn) = (ord(data[pos]), ord(data[pos + block]))
+        a = (a - x0 + xn) % 65521
+        b = (b + a - 1 - nmod * x0) % 65521
+        weak = (b << 16) | a
+        pos += 1
+
+if _delta_speedups is not None:
+    _find = _delta_speedups.find
+else:
+    _find = _py_find
+
+def _signature(fpath, block):
+    """return the signature of file @fpath: (weak checksum, MD5) of each
+    whole block of @block bytes, packed by _DELTA_SIG"""
+    ret = list()
+    with open(fpath, "rb") as f:
+        while True:
+            buf = f.read(block)
+            if len(buf) < block:
+                return "" . join(ret)
+            ret.append(_DELTA_SIG.pack(_adler32(buf), hashlib.md5(buf).digest()))
+
+def _send_delta(fpath, block, sig, conn):
+    """send the instructions to rebuild file @fpath from a file with
+    signature @sig, each of which is
+        (_DELTA_COPY:uint32, first block:uint32, number of blocks:uint32)
+        (_DELTA_LITERAL:uint32, data:string)
+    and then _DELTA_END:uint32; return the number of literal bytes"""
+    if len(sig) % _DELTA_SIG.size:
+        log.warning("invalid block signature size: {0}" . format(len(sig)))
+        raise Error
+    weaks = dict() # dict of <weak checksum> => list of (<MD5>, <block index>)
+    bitmap = bytearray(1 << (32 - _DELTA_BITMAP_SHIFT) >> 3)
+    for i in range(len(sig) / _DELTA_SIG.size):
+        (weak, strong) = _DELTA_SIG.unpack_from(sig, i * _DELTA_SIG.size)
+        weaks.setdefault(weak, list()).append((strong, i))
+        h = _bitmap_index(weak)
+        bitmap[h >> 3] |= 1 << (h & 7)
+    bitmap = str(bitmap)
+
+    with open(fpath, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        data = mmap.mmap(f.fileno(), size, access = mmap.ACCESS_READ) if size else ""
+        try:
+            copy = None # [<first block>, <number of blocks>] not sent yet
+            nliteral = 0
+            pos = lit = 0
+            while pos < size:
+                end = min(pos + _DELTA_SCAN, size)
+                (off, weak) = _find(data, pos, end, block, bitmap, weaks)
+                if off >= 0:
+                    strong = hashlib.md5(data[off:off + block]).digest()
+                    idx = None
+                    for (s, i) in weaks[weak]:
+                        if s == strong:
+                            idx = i
+                            break
+                    if idx is None:
+                        pos = off + 1
+                        continue
+                    end = off
+                if end > lit:
+                    if copy:
+                        conn.write_uint32(_DELTA_COPY)
+                        conn.write_uint32(copy[0])
+                        conn.write_uint32(copy[1])
+                        copy = None
+                    for i in range(lit, end, _STREAM_CHUNK):
+                        conn.write_uint32(_DELTA_LITERAL)
+                        conn.write_str(data[i:min(i + _STREAM_CHUNK, end)])
+                    nliteral += end - lit
+                    lit = end
+                if off < 0:
+                    pos = end
+                    continue
+                if copy and copy[0] + copy[1] == idx:
+                    copy[1] += 1
+                else:
+                    if copy:
+                        conn.write_uint32(_DELTA_COPY)
+                        conn.write_uint32(copy[0])
+                        conn.write_uint32(copy[1])
+                    copy = [idx, 1]
+                pos = lit = off + block
+            if copy:
+                conn.write_uint32(_DELTA_COPY)
+                conn.write_uint32(copy[0])
+                conn.write_uint32(copy[1])
+            conn.write_uint32(_DELTA_END)
+            return nliteral
+        finally:
+            if size:
+                data.close()
+
+def _apply_delta(fpath, block, conn, checksum):
+    """rebuild file @fpath with the instructions sent by _send_delta; return
+    tuple(<whether the result has @checksum>, <number of literal bytes>);
+    @fpath is replaced (not modified, since it may be linked from the blob
+    store) only on success"""
+    (fd, tmp) = tempfile.mkstemp(".tmp", ".orzoj-delta-", os.path.dirname(fpath))
+    try:
+        ok = True
+        nbyte = 0
+        sha1_ctx = hashlib.sha1()
+        with os.fdopen(fd, "wb") as fout:
+            os.fchmod(fout.fileno(), stat.S_IMODE(os.stat(fpath).st_mode))
+            with open(fpath, "rb") as fold:
+                while True:
+                    op = conn.read_uint32()
+                    if op == _DELTA_END:
+                        break
+                    if op == _DELTA_COPY:
+                        first = conn.read_uint32()
+                        cnt = conn.read_uint32()
+                        fold.seek(first * block)
+                        for i in range(cnt):
+                            buf = fold.read(block)
+                            if len(buf) != block:
+                                ok = False
+                            fout.write(buf)
+                            sha1_ctx.update(buf)
+                    elif op == _DELTA_LITERAL:
+                        buf = conn.read_str()
+                        fout.write(buf)
+                        sha1_ctx.update(buf)
+                        nbyte += len(buf)
+                    else:
+                        log.warning("invalid block delta instruction: {0}" . format(op))
+                        raise Error
+        if not ok or sha1_ctx.digest() != checksum:
+            log.warning("checksum mismatch after applying block delta to {0!r}" . format(fpath))
+            os.remove(tmp)
+            return (False, nbyte)
+        os.rename(tmp, fpath)
+        return (True, nbyte)
+    except:
+        os.remove(tmp)
+        raise
+
+def _recv_delta(conn, flist_remote, stale):
+    """answer SYNCDIR_DELTA and rebuild the offered files from their stale
+    copies in @stale, a dict of <index in @flist_remote> => <path>; return
+    tuple(<set of indices of the files rebuilt>, <number of literal bytes>)"""
+    offers = list()
+    for i in range(conn.read_uint32()):
+        idx = conn.read_uint32()
+        block = conn.read_uint32()
+        if idx >= len(flist_remote) or block < _DELTA_BLOCK_MIN or block > _DELTA_BLOCK_MAX:
+            log.warning("invalid block delta offer: ({0}, {1})" . format(idx, block))
+            raise Error
+        offers.append((idx, block))
+
+    sigs = list()
+    def _make_signatures():
+        for (idx, block) in offers:
+            pf = stale.get(idx)
+            sigs.append(_signature(pf, block) if pf else "")
+    th = threading.Thread(target = _make_signatures, name = "sync_dir._recv_delta")
+    th.start()
+    while th.is_alive():
+        th.join(msg.TELL_ONLINE_INTERVAL)
+        msg.write_msg(conn, msg.TELL_ONLINE)
+    if len(sigs) != len(offers):
+        log.error("failed to compute block signatures")
+        raise Error
+
+    msg.write_msg(conn, msg.SYNCDIR_SIGNATURES)
+    for s in sigs:
+        conn.write_str(s)
+
+    done = set()
+    nbyte = 0
+    for ((idx, block), sig) in zip(offers, sigs):
+        if sig:
+            (ok, n) = _apply_delta(stale[idx], block, conn, flist_remote[idx][1])
+            nbyte += n
+            if ok:
+                done.add(idx)
+    return (done, nbyte)
+
+def recv(path, conn, lock = None):
     """save the directory to @path via snc connection @conn,
-    return the speed in kb/s, or None if no file transferred"""
+    return the speed in kb/s, or None if no file transferred
+
+    @lock, if not None, is the Dir_lock of @path, whose shared lock is held
+    by the caller; it is upgraded while the directory is modified"""
     def _write_msg(m):
         msg.write_msg(conn, m)
 
@@ -239,68 +1216,150 @@ def recv(path, conn):
                 raise Error
             return
 
+    def _list_local():
+        """return the local file list as a dict, or None if @path is not a
+        directory"""
+        if not os.path.isdir(path):
+            return None
+        th_hash = _thread_get_file_list(path, False, manifest_cache)
+        th_hash.start()
+        while th_hash.is_alive():
+            th_hash.join(msg.TELL_ONLINE_INTERVAL)
+            _write_msg(msg.TELL_ONLINE)
+        if th_hash.result is None:
+            raise Error
+        return th_hash.result
+
+    exclusive = False
     try:
-        if os.path.isdir(path):
-            th_hash = _thread_get_file_list(path, False)
-            th_hash.start()
-            while th_hash.is_alive():
-                th_hash.join(msg.TELL_ONLINE_INTERVAL)
-                _write_msg(msg.TELL_ONLINE)
-            flist_local = th_hash.result
-        else:
+        flist_local = _list_local()
+
+        _check_msg(msg.SYNCDIR_BEGIN)
+        flist_remote = list()
+        for i in range(_read_uint32()):
+            fname = _read_str()
+            checksum = _read_str()
+            flist_remote.append((fname, checksum))
+
+        if lock and flist_local != dict(flist_remote):
+            if not lock.upgrade(lambda: _write_msg(msg.TELL_ONLINE)):
+                flist_local = _list_local()
+            exclusive = True
+
+        if flist_local is None:
             if os.path.exists(path):
                 os.remove(path)
             os.mkdir(path)
             flist_local = dict()
-        if flist_local is None:
-            raise Error
 
         flist_needed = list()
-        _check_msg(msg.SYNCDIR_BEGIN)
-        
-        for i in range(_read_uint32()):
-            fname = _read_str()
-            checksum = _read_str()
-            try:
-                if checksum != flist_local[fname]:
-                    os.remove(os.path.join(path, fname))
-                    flist_needed.append(i)
-                del flist_local[fname]
-            except KeyError:
-                flist_needed.append(i)
+        # with a blob store, each checksum is requested only once, and the
+        # other files with it are linked after receiving
+        checksum_needed = set()
+        flist_dup = list()
+        # the outdated local copies of the requested files, kept for block
+        # delta transfer: dict of <index> => <path>
+        stale = dict()
+        # the files not written by this synchronization, whose checksums
+        # have been computed by _list_local()
+        flist_same = list()
+
+        for (i, (fname, checksum)) in enumerate(flist_remote):
+            pf = os.path.join(path, fname)
+            local = flist_local.pop(fname, None)
+            if local == checksum:
+                flist_same.append((fname, checksum))
+                if blob_store:
+                    blob_store.add(checksum, pf)
+                continue
+            if blob_store:
+                if checksum in checksum_needed:
+                    if local is not None:
+                        os.remove(pf)
+                    flist_dup.append((fname, checksum))
+                    continue
+                if blob_store.has(checksum):
+                    if local is not None:
+                        os.remove(pf)
+                        local = None
+                    if blob_store.get(checksum, pf):
+                        continue
+                checksum_needed.add(checksum)
+            if local is not None:
+                stale[i] = pf
+            flist_needed.append(i)
 
-        for i in flist_local:
-            os.remove(os.path.join(path, i))
+        def _remove_extra():
+            # the files not on orzoj-server are removed only after the
+            # transfer succeeds, so that a failed stream changes nothing
+            for i in flist_local:
+                os.remove(os.path.join(path, i))
 
         _write_msg(msg.SYNCDIR_FILELIST)
         _write_uint32(len(flist_needed))
 
         if len(flist_needed) == 0:
+            _remove_extra()
+            if manifest_cache:
+                manifest_cache.set_files(path, flist_same)
             _write_msg(msg.SYNCDIR_DONE)
             return None
 
         for i in flist_needed:
             _write_uint32(i)
 
-        _check_msg(msg.SYNCDIR_FTRANS)
+        flist_requested = flist_needed
+        while True:
+            m = _read_msg()
+            if m != msg.TELL_ONLINE:
+                break
+        if m == msg.SYNCDIR_DELTA:
+            time_start = time.time()
+            (done, nbyte) = _recv_delta(conn, flist_remote, stale)
+            flist_needed = [i for i in flist_needed if i not in done]
+            _write_msg(msg.SYNCDIR_FILELIST)
+            _write_uint32(len(flist_needed))
+            for i in flist_needed:
+                _write_uint32(i)
+            speed = nbyte / 1024.0 / max(time.time() - time_start, 1e-6)
+            if flist_needed:
+                while True:
+                    m = _read_msg()
+                    if m != msg.TELL_ONLINE:
+                        break
 
-        try:
-            ftar = tempfile.mkstemp('orzoj')
-            speed = filetrans.recv(ftar[1], conn)
-            with open(ftar[1], 'r') as f:
-                th_extar = _thread_extract_tar(f, path)
-                th_extar.start()
-                while th_extar.is_alive():
-                    th_extar.join(msg.TELL_ONLINE_INTERVAL)
-                    _write_msg(msg.TELL_ONLINE)
-                if th_extar.error:
-                    raise Error
-            _write_msg(msg.SYNCDIR_DONE)
-            return speed
+        if flist_needed:
+            if m == msg.SYNCDIR_STREAM:
+                # the received files replace the stale copies by rename()
+                speed = _recv_stream(path, conn)
+            elif m == msg.SYNCDIR_FTRANS:
+                # the stale copies must be removed instead of being
+                # overwritten by the extracted files, since they may be
+                # linked from the blob store
+                needed = set(flist_needed)
+                for (i, pf) in stale.iteritems():
+                    if i in needed:
+                        os.remove(pf)
+                speed = _recv_ftrans(path, conn)
+            else:
+                log.warning("message check error: expecting {0} or {1}, got {2}" .
+                        format(msg.SYNCDIR_FTRANS, msg.SYNCDIR_STREAM, m))
+                raise Error
+        _remove_extra()
 
-        finally:
-            os.close(ftar[0])
-            os.remove(ftar[1])
+        if blob_store:
+            for i in flist_requested:
+                (fname, checksum) = flist_remote[i]
+                blob_store.add(checksum, os.path.join(path, fname))
+            for (fname, checksum) in flist_dup:
+                if not blob_store.get(checksum, os.path.join(path, fname)):
+                    raise Error
+        if manifest_cache:
+            # the checksums sent by orzoj-server are not trusted for the
+            # files just written, which are hashed by the next synchronization
+            manifest_cache.set_files(path, flist_same)
+        _write_msg(msg.SYNCDIR_DONE)
+        return speed
 
     except Error as e:
         raise e
@@ -318,4 +1377,8 @@ def recv(path, conn):
         log.debug(traceback.format_exc())
         raise Error
 
+    finally:
+        if exclusive:
+            lock.downgrade()
+
 
@@ -0,0 +1,326 @@
+#!/usr/bin/env python2
+# end-to-end load test: orzoj-server is started on loopback with the
+# stand-in website (fake_website.py) and simulated judges, which receive
+# the data and answer like orzoj-judge after spending the given time on
+# compiling and on each case; a synthetic workload of submissions is fed
+# to the website, and the throughput and the latency of each stage
+# (measured from the reports the website receives) are printed
+#
+# usage: bench-end-to-end.py [options] [cert dir]
+# the cert dir (default: cert next to this script, see cert/mkcert.sh)
+# should contain ca.crt, server.crt, server.key, client.crt and client.key
+
+import sys, os, os.path, threading, time, random, tempfile, shutil, signal
+import socket, subprocess, optparse, urllib2
+
+from orzoj import conf, snc, msg, mux, sync_dir, structures, phpserialize
+import fake_website
+
+_ROOT = os.path.dirname(os.path.abspath(__file__))
+_SERVER_CONF = """
+LogFile {tmp}/server.log
+LogLevel info
+PidFile {tmp}/server.pid
+Listen {port}
+DataDir {tmp}/data
+Password {passwd}
+WebAddress http://127.0.0.1:{web_port}
+CertificateFile {cert}/server.crt
+PrivateKeyFile {cert}/server.key
+CAFile {cert}/ca.crt
+JournalFile {tmp}/server.journal
+CostFile {tmp}/server.cost
+ServerMode {mode}
+RefreshInterval 1
+LongPollWait {long_poll}
+ReportBatchInterval {batch}
+WebCompressMin {compress}
+"""
+_JUDGE_CONF = """
+LogFile {tmp}/judge.log
+LogLevel warning
+CertificateFile {cert}/client.crt
+PrivateKeyFile {cert}/client.key
+CAFile {cert}/ca.crt
+"""
+
+# (name, start event, end event) of the stages reported
+_STAGES = (("pickup", "submitted", "fetched"),
+        ("queue", "fetched", "sync_data"),
+        ("sync", "sync_data", "compiling"),
+        ("compile", "compiling", "compile_success"),
+        ("run", "compile_success", "prob_result"),
+        ("total", "submitted", "prob_result"))
+
+def _parse_opt():
+    parser = optparse.OptionParser(usage = "usage: %prog [options] [cert dir]")
+    parser.add_option("-j", "--judges", type = "int", default = 4,
+            help = "number of judges [default: %default]")
+    parser.add_option("-s", "--slots", type = "int", default = 1,
+            help = "worker slots of each judge [default: %default]")
+    parser.add_option("-n", "--tasks", type = "int", default = 200,
+            help = "number of submissions [default: %default]")
+    parser.add_option("-r", "--rate", type = "float", default = 0,
+            help = "submissions per second, 0 to submit all at once [default: %default]")
+    parser.add_option("-p", "--probs", type = "int", default = 10,
+            help = "number of problems [default: %default]")
+    parser.add_option("-c", "--cases", type = "int", default = 10,
+            help = "cases of each problem [default: %default]")
+    parser.add_option("--compile-time", type = "float", default = 0.05,
+            help = "seconds spent on compiling [default: %default]")
+    parser.add_option("--case-time", type = "float", default = 0.01,
+            help = "seconds spent on each case [default: %default]")
+    parser.add_option("-m", "--mode", default = "thread",
+            help = "ServerMode of orzoj-server [default: %default]")
+    parser.add_option("--long-poll", type = "float", default = 0,
+            help = "LongPollWait of orzoj-server [default: %default]")
+    parser.add_option("--batch", type = "float", default = 0,
+            help = "ReportBatchInterval of orzoj-server [default: %default]")
+    parser.add_option("--compress", type = "int", default = 0,
+            help = "WebCompressMin of orzoj-server [default: %default]")
+    parser.add_option("--info-size", type = "int", default = 0,
+            help = "bytes of checker output in the result of each case [default: %default]")
+    parser.add_option("--web-latency", type = "float", default = fake_website.REQUEST_COST,
+            help = "seconds the website spends on each request [default: %default]")
+    parser.add_option("--error-rate", type = "float", default = 0,
+            help = "probability of an error answer from the website [default: %default]")
+    parser.add_option("--drop-rate", type = "float", default = 0,
+            help = "probability of a request dropped by the website [default: %default]")
+    parser.add_option("--relogin-rate", type = "float", default = 0,
+            help = "probability of a relogin request from the website [default: %default]")
+    parser.add_option("--outage", action = "append", default = [],
+            metavar = "BEGIN,DURATION",
+            help = "make the website unavailable for DURATION seconds from "
+            "BEGIN seconds after start; could be given more than once")
+    parser.add_option("--port", type = "int", default = 0,
+            help = "port of orzoj-server, and the next one for the website; "
+            "0 to use unused ports [default: %default]")
+    return parser.parse_args()
+
+def _unused_port():
+    s = socket.socket()
+    try:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+    finally:
+        s.close()
+
+def _make_data(path, nprob):
+    for i in range(nprob):
+        d = os.path.join(path, "p{0}" . format(i))
+        os.makedirs(d)
+        for j in range(3):
+            with open(os.path.join(d, "{0}.in" . format(j)), "w") as f:
+                f.write(os.urandom(16 * 1024))
+
+def _checker_output(size):
+    lines = list()
+    n = 0
+    while n < size:
+        lines.append("line {0}: expected {1}, read {2}\n" . format(len(lines) + 1,
+            random.randrange(10 ** 6), random.randrange(10 ** 6)))
+        n += len(lines[-1])
+    return "" . join(lines)[:size]
+
+def _make_workload(opt):
+    random.seed(1)
+    ret = list()
+    t = 0
+    for i in range(opt.tasks):
+        if opt.rate > 0:
+            t += random.expovariate(opt.rate)
+        ret.append((t, {"id" : i + 1, "prob" : "p{0}" . format(random.randrange(opt.probs)),
+            "lang" : "gcc", "src" : os.urandom(512).encode("hex"),
+            "input" : "", "output" : ""}))
+    return ret
+
+class _Judge:
+    """a simulated orzoj-judge"""
+    def __init__(self, idx, sock, opt, cache):
+        self._opt = opt
+        self._cache = cache
+        self._sock = sock
+        self._conn = snc.snc(sock)
+        c = self._conn
+        msg.write_msg(c, msg.HELLO)
+        c.write_str("judge-{0}" . format(idx))
+        if opt.slots > 1:
+            c.write_uint32(msg.PROTOCOL_VERSION_MUX)
+        else:
+            c.write_uint32(msg.PROTOCOL_VERSION)
+        c.write_uint32(1)
+        c.write_str("gcc")
+        if opt.slots > 1:
+            c.write_uint32(opt.slots)
+        if msg.read_msg(c) != msg.CONNECT_OK:
+            raise Exception("judge-{0} refused" . format(idx))
+        threading.Thread(target = self._run).start()
+
+    def _run(self):
+        try:
+            nslot = self._serve(self._conn, 0)
+            if nslot is None:
+                return
+            m = mux.Mux(self._conn, nslot)
+            threads = [threading.Thread(target = self._serve, args = (m.channel(i), i))
+                    for i in range(nslot)]
+            for i in threads:
+                i.start()
+            for i in threads:
+                i.join()
+            m.close()
+        except snc.Error:
+            pass # orzoj-server stopped
+
+    def _serve(self, conn, slot):
+        """judge tasks on @conn until it is closed; return the number of
+        slots if the server starts multiplexing"""
+        opt = self._opt
+        info = _checker_output(opt.info_size)
+        cache = os.path.join(self._cache, str(slot))
+        if not os.path.isdir(cache): # slot 0 is served again after MUX_BEGIN
+            os.makedirs(cache)
+        try:
+            while True:
+                m = msg.read_msg(conn)
+                if m == msg.TELL_ONLINE:
+                    continue
+                if m == msg.QUERY_INFO:
+                    q = conn.read_str()
+                    msg.write_msg(conn, msg.ANS_QUERY)
+                    if q == msg.FEATURES_QUERY:
+                        conn.write_str(" " . join(sync_dir.FEATURES))
+                    else:
+                        conn.write_str("bench")
+                    continue
+                if m == msg.MUX_BEGIN:
+                    return conn.read_uint32()
+                if m != msg.PREPARE_DATA:
+                    raise Exception("unexpected message {0}" . format(m))
+                prob = conn.read_str()
+                sync_dir.recv(os.path.join(cache, prob), conn)
+                msg.write_msg(conn, msg.DATA_OK)
+                conn.write_uint32(opt.cases)
+                if msg.read_msg(conn) != msg.START_JUDGE:
+                    raise Exception("START_JUDGE expected")
+                for i in range(4): # lang, src, input, output
+                    conn.read_str()
+                msg.write_msg(conn, msg.START_JUDGE_OK)
+                time.sleep(opt.compile_time)
+                msg.write_msg(conn, msg.COMPILE_SUCCEED)
+                for i in range(opt.cases):
+                    time.sleep(opt.case_time)
+                    r = structures.case_result()
+                    r.exe_status = structures.EXESTS_NORMAL
+                    r.score = r.full_score = 10
+                    r.time = int(opt.case_time * 1000000)
+                    r.memory = 1024
+                    r.extra_info = info
+                    msg.write_msg(conn, msg.REPORT_CASE)
+                    r.write(conn)
+                msg.write_msg(conn, msg.REPORT_JUDGE_FINISH)
+        except snc.Error:
+            pass
+
+def _get(url):
+    f = urllib2.urlopen(url, timeout = 10)
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+def _report(opt, stats, duration):
+    tasks = stats["tasks"]
+    done = [t for t in tasks.itervalues() if "prob_result" in t]
+    print "judges: {0} x {1} slot(s), server mode: {2}, website latency: {3}s" . format(
+            opt.judges, opt.slots, opt.mode, opt.web_latency)
+    print "finished {0} of {1} tasks in {2:.2f}s: {3:.1f} tasks/s" . format(len(done),
+            opt.tasks, duration, len(done) / duration)
+    print "website requests: {0} ({1:.2f} per task), logins: {2}" . format(stats["nrequest"],
+            stats["nrequest"] / float(max(len(done), 1)), stats["nlogin"])
+    print "website traffic: {0:.1f} KiB ({1:.1f} KiB per task)" . format(stats["nbyte"] / 1024.0,
+            stats["nbyte"] / 1024.0 / max(len(done), 1))
+    print "{0:>10} {1:>10} {2:>10} {3:>10} {4:>10}" . format("stage", "mean(ms)",
+            "p50(ms)", "p99(ms)", "max(ms)")
+    for (name, begin, end) in _STAGES:
+        v = sorted((t[end] - t[begin]) * 1000 for t in done if begin in t and end in t)
+        if not v:
+            continue
+        print "{0:>10} {1:>10.1f} {2:>10.1f} {3:>10.1f} {4:>10.1f}" . format(name,
+                sum(v) / len(v), v[len(v) / 2], v[len(v) * 99 / 100], v[-1])
+
+def main():
+    (opt, args) = _parse_opt()
+    cert = os.path.abspath(args[0] if args else os.path.join(_ROOT, "cert"))
+    if opt.port:
+        (port, web_port) = (opt.port, opt.port + 1)
+    else:
+        (port, web_port) = (_unused_port(), _unused_port())
+
+    tmp = tempfile.mkdtemp(prefix = "orzoj-bench-")
+    server = None
+    web_pid = None
+    try:
+        _make_data(os.path.join(tmp, "data"), opt.probs)
+        with open(os.path.join(tmp, "server.conf"), "w") as f:
+            f.write(_SERVER_CONF.format(tmp = tmp, port = port, web_port = web_port,
+                passwd = fake_website.PASSWD, cert = cert, mode = opt.mode,
+                long_poll = opt.long_poll, batch = opt.batch, compress = opt.compress))
+        with open(os.path.join(tmp, "judge.conf"), "w") as f:
+            f.write(_JUDGE_CONF.format(tmp = tmp, cert = cert))
+        conf.parse_file(os.path.join(tmp, "judge.conf"))
+        # like orzoj-judge, which does not hash the files it has received
+        sync_dir.manifest_cache = sync_dir.Manifest_cache()
+
+        fake_website.REQUEST_COST = opt.web_latency
+        fake_website.ERROR_RATE = opt.error_rate
+        fake_website.DROP_RATE = opt.drop_rate
+        fake_website.RELOGIN_RATE = opt.relogin_rate
+        fake_website.add_tasks(_make_workload(opt))
+        for i in opt.outage:
+            fake_website.add_outage(*map(float, i.split(",")))
+        web_pid = fake_website.start(web_port)
+        web_addr = "http://127.0.0.1:{0}/orz.php" . format(web_port)
+
+        server = subprocess.Popen([sys.executable, os.path.join(_ROOT, "..", "..", "orzoj-server"),
+            "-c", os.path.join(tmp, "server.conf"), "-d"])
+        deadline = time.time() + 10
+        for i in range(opt.judges):
+            while True:
+                try:
+                    sock = snc.socket("127.0.0.1", port)
+                    break
+                except snc.Error:
+                    if time.time() > deadline or server.poll() is not None:
+                        raise Exception("orzoj-server failed to start, see {0}/server.log" . format(tmp))
+                    time.sleep(0.1)
+            _Judge(i, sock, opt, os.path.join(tmp, "judge-{0}" . format(i)))
+
+        _get(web_addr + "?start")
+        time_start = time.time()
+        timeout = 60 + (opt.tasks / opt.rate if opt.rate > 0 else 0)
+        while True:
+            time.sleep(0.5)
+            stats = phpserialize.loads(_get(web_addr + "?stats"))
+            ndone = sum(1 for t in stats["tasks"].itervalues() if "prob_result" in t)
+            if ndone == opt.tasks or time.time() - time_start > timeout:
+                break
+        last = max([t["prob_result"] for t in stats["tasks"].itervalues()
+            if "prob_result" in t] or [0])
+        _report(opt, stats, max(last, 1e-3))
+    finally:
+        if server is not None and server.poll() is None:
+            server.send_signal(signal.SIGTERM)
+            deadline = time.time() + 10
+            while server.poll() is None and time.time() < deadline:
+                time.sleep(0.1)
+            if server.poll() is None:
+                server.kill()
+                server.wait()
+        if web_pid is not None:
+            os.kill(web_pid, signal.SIGKILL)
+            os.waitpid(web_pid, 0)
+        shutil.rmtree(tmp, True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python2
+# benchmark for the manifest cache of sync_dir: the time to get the file
+# list with checksums of a problem directory, as sync_dir.send does before
+# every synchronization, without the cache, with a cold cache, with a warm
+# cache, and with a cache loaded from a file; the results are checked to be
+# the same
+#
+# usage: bench-manifest-cache.py [number of files] [total size in MB]
+
+import os, sys, time, tempfile, shutil
+
+from orzoj import sync_dir
+
+def make_dir(path, nfile, size):
+    for i in range(nfile):
+        with open(os.path.join(path, "{0}.in" . format(i)), "wb") as f:
+            f.write(os.urandom(size / nfile))
+
+def measure(path, cache):
+    t = time.time()
+    th = sync_dir._thread_get_file_list(path, True, cache)
+    th.run()
+    return (time.time() - t, sorted(th.result))
+
+if __name__ == "__main__":
+    nfile = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    size = int(sys.argv[2] if len(sys.argv) > 2 else 256) * 1024 * 1024
+    tmp = tempfile.mkdtemp(prefix = "orzoj-bench-")
+    try:
+        path = os.path.join(tmp, "prob")
+        os.mkdir(path)
+        make_dir(path, nfile, size)
+        # files modified just now are not cached
+        t = time.time() - sync_dir._RACY_TIME - 1
+        for i in os.listdir(path):
+            os.utime(os.path.join(path, i), (t, t))
+
+        cache = sync_dir.Manifest_cache()
+        (t0, ret) = measure(path, None)
+        (t1, ret1) = measure(path, cache)
+        (t2, ret2) = measure(path, cache)
+        fcache = os.path.join(tmp, "manifest")
+        cache.save(fcache, True)
+        cache_loaded = sync_dir.Manifest_cache()
+        cache_loaded.load(fcache)
+        (t3, ret3) = measure(path, cache_loaded)
+        assert ret == ret1 == ret2 == ret3
+        assert cache_loaded.miss == 0
+        print "{0} files, {1} MB" . format(nfile, size / 1024 / 1024)
+        print "{0:>20} {1:>10}" . format("", "time(ms)")
+        for (name, t) in (("no cache", t0), ("cold cache", t1), ("warm cache", t2),
+                ("loaded cache", t3)):
+            print "{0:>20} {1:>10.2f}" . format(name, t * 1000)
+    finally:
+        shutil.rmtree(tmp, True)
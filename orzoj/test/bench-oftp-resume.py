@@ -0,0 +1,178 @@
+#!/usr/bin/env python2
+# benchmark of resuming interrupted file transfers: a file is sent with
+# filetrans through a simulated lossy link, a proxy on loopback with limited
+# bandwidth which cuts the connection after a random number of bytes
+# (exponentially distributed), and sent again after each cut until it is
+# received; this is done with OFTP version 1, which restarts from the
+# beginning, and with version 2, which resumes (see filetrans.resume_dir),
+# using the same cuts, and the number of attempts, the bytes through the
+# link and the time are printed
+#
+# usage: bench-oftp-resume.py [options] [cert dir]
+# the cert dir (default: cert next to this script, see cert/mkcert.sh)
+# should contain ca.crt, server.crt and server.key
+
+import sys, os, os.path, threading, time, random, tempfile, shutil, socket, optparse, hashlib, struct
+
+from orzoj import conf, snc, filetrans
+
+_ROOT = os.path.dirname(os.path.abspath(__file__))
+_CONF = """
+LogFile {tmp}/bench.log
+LogLevel critical
+NetworkTimeout 5
+CertificateFile {cert}/server.crt
+PrivateKeyFile {cert}/server.key
+CAFile {cert}/ca.crt
+"""
+
+def _parse_opt():
+    parser = optparse.OptionParser(usage = "usage: %prog [options] [cert dir]")
+    parser.add_option("--size", type = "float", default = 64,
+            help = "size of the file in MB [default: %default]")
+    parser.add_option("--rate", type = "float", default = 32,
+            help = "bandwidth of the link in MB/s [default: %default]")
+    parser.add_option("--mtbf", type = "float", default = 24,
+            help = "mean number of MB sent before the connection is cut [default: %default]")
+    parser.add_option("--max-attempts", type = "int", default = 50,
+            help = "give up after so many attempts [default: %default]")
+    parser.add_option("--seed", type = "int", default = 1,
+            help = "random seed of the cuts [default: %default]")
+    return parser.parse_args()
+
+def _unused_port():
+    s = socket.socket()
+    s.bind(("127.0.0.1", 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+class _Link:
+    """forward the connections to @port on loopback to @target, at most
+    @rate bytes per second, cutting each one after a number of bytes taken
+    from @cuts"""
+    def __init__(self, port, target, rate, cuts):
+        self.nbyte = 0
+        self._target = target
+        self._rate = rate
+        self._cuts = cuts
+        self._lock = threading.Lock()
+        self._sock = socket.socket()
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(("127.0.0.1", port))
+        self._sock.listen(5)
+        th = threading.Thread(target = self._serve)
+        th.daemon = True
+        th.start()
+
+    def _serve(self):
+        while True:
+            (a, addr) = self._sock.accept()
+            b = socket.create_connection(("127.0.0.1", self._target))
+            state = {"budget" : next(self._cuts), "time" : time.time(), "sent" : 0}
+            for (src, dest) in ((a, b), (b, a)):
+                th = threading.Thread(target = self._forward, args = (src, dest, a, b, state))
+                th.daemon = True
+                th.start()
+
+    def _forward(self, src, dest, a, b, state):
+        try:
+            while True:
+                buf = src.recv(16384)
+                if not buf:
+                    break
+                with self._lock:
+                    state["sent"] += len(buf)
+                    self.nbyte += len(buf)
+                    cut = state["sent"] > state["budget"]
+                    delay = state["time"] + state["sent"] / self._rate - time.time()
+                if cut:
+                    break
+                if delay > 0:
+                    time.sleep(delay)
+                dest.sendall(buf)
+        except socket.error:
+            pass
+        # reset both connections, as a broken link does after timeouts
+        for i in (a, b):
+            try:
+                i.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+                i.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            i.close()
+
+def _attempt(src, dst, ls, link_port, features):
+    """return whether the file is received, sending it to the connection
+    accepted on listening socket @ls"""
+    def _send():
+        try:
+            (sock, addr) = ls.accept()
+            conn = snc.snc(sock, True)
+            filetrans.send(src, conn, features)
+            conn.close()
+            sock.close()
+        except (snc.Error, filetrans.OFTPError):
+            pass
+    th = threading.Thread(target = _send)
+    th.start()
+    try:
+        sock = snc.socket("127.0.0.1", link_port)
+        conn = snc.snc(sock)
+        filetrans.recv(dst, conn)
+        conn.close()
+        sock.close()
+        return True
+    except (snc.Error, filetrans.OFTPError):
+        return False
+    finally:
+        th.join()
+
+def _sha1(fpath):
+    with open(fpath, "rb") as f:
+        return hashlib.sha1(f.read()).digest()
+
+def main():
+    (opt, args) = _parse_opt()
+    cert = os.path.abspath(args[0] if args else os.path.join(_ROOT, "cert"))
+    tmp = tempfile.mkdtemp(prefix = "orzoj-bench-")
+    try:
+        with open(os.path.join(tmp, "bench.conf"), "w") as f:
+            f.write(_CONF.format(tmp = tmp, cert = cert))
+        conf.parse_file(os.path.join(tmp, "bench.conf"))
+
+        src = os.path.join(tmp, "src")
+        with open(src, "wb") as f:
+            f.write(os.urandom(int(opt.size * 1e6)))
+        checksum = _sha1(src)
+
+        print "{0:>10} {1:>10} {2:>10} {3:>10} {4:>10}" . format(
+                "version", "attempts", "link(MB)", "time(s)", "MB/s")
+        for (name, features, resume) in (("1", (), False), ("2", ("oftp-2", ), True)):
+            rnd = random.Random(opt.seed)
+            cuts = iter(lambda: int(rnd.expovariate(1 / (opt.mtbf * 1e6))), None)
+            (port, link_port) = (_unused_port(), _unused_port())
+            ls = snc.socket(None, port)
+            link = _Link(link_port, port, opt.rate * 1e6, cuts)
+            filetrans.resume_dir = None
+            if resume:
+                filetrans.resume_dir = os.path.join(tmp, "resume")
+                os.mkdir(filetrans.resume_dir)
+            dst = os.path.join(tmp, "dst")
+
+            time_start = time.time()
+            ok = False
+            for attempt in range(1, opt.max_attempts + 1):
+                if _attempt(src, dst, ls, link_port, features):
+                    ok = _sha1(dst) == checksum
+                    break
+            t = time.time() - time_start
+            print "{0:>10} {1:>10} {2:>10.1f} {3:>10.2f} {4:>10}" . format(name,
+                    attempt, link.nbyte / 1e6, t,
+                    "{0:.2f}" . format(opt.size / t) if ok else "failed")
+            ls.close()
+    finally:
+        shutil.rmtree(tmp, True)
+
+if __name__ == "__main__":
+    main()
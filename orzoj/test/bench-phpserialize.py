@@ -0,0 +1,98 @@
+#!/usr/bin/env python2
+# benchmark for orzoj.phpserialize with payloads like those exchanged with
+# the website: the number of payloads encoded / decoded per second, both the
+# data and the envelope containing it as in web._read, is measured for the
+# pure Python code,
+# the C extension (orzoj._phpserialize, see orzoj/lib/setup.py) and, for
+# loads, the file-object reader (load); the results of all the
+# implementations are checked to be the same
+
+import time, random
+from StringIO import StringIO
+
+from orzoj import phpserialize
+
+DURATION = 1 # seconds for each measurement
+
+_CHECKSUM = "0123456789abcdef0123456789abcdef01234567"
+
+def _text(n):
+    words = ("line", "expected", "read", "wrong", "answer", "1024", "-7", "ok")
+    return " " . join(random.choice(words) for i in range(n / 6))
+
+def payloads():
+    random.seed(1)
+    ret = list()
+
+    ncase = 50
+    data = {"action" : "report_prob_result", "task" : 1234,
+            "exe_status" : [random.randrange(8) for i in range(ncase)],
+            "score" : [random.randrange(11) for i in range(ncase)],
+            "full_score" : [10] * ncase,
+            "time" : [random.randrange(10 ** 6) for i in range(ncase)],
+            "memory" : [random.randrange(65536) for i in range(ncase)],
+            "extra_info" : [_text(2000) for i in range(ncase)]}
+    ret.append(("report_prob_result", data))
+
+    data = {"action" : "report_compile_failure", "task" : 1234,
+            "info" : _text(64 * 1024)}
+    ret.append(("compile log", data))
+
+    data = {"action" : "report_batch", "reports" : [
+        {"action" : "report_judge_progress", "task" : i, "now" : i % 10}
+        for i in range(32)]}
+    ret.append(("report_batch", data))
+
+    tasks = [{"id" : str(i), "prob" : "prob{0}" . format(i % 20),
+        "lang" : random.choice(("gcc", "g++", "fpc")), "src" : _text(2000),
+        "input" : "", "output" : ""} for i in range(64)]
+    data = {"type" : "tasks", "tasks" : tasks}
+    ret.append(("tasks reply", data))
+    return ret
+
+def rate(func, arg):
+    n = 0
+    end = time.time() + DURATION
+    while time.time() < end:
+        for i in range(10):
+            func(arg)
+        n += 10
+    return n / float(DURATION)
+
+def encoder(dumps):
+    def f(data):
+        return dumps({"thread_id" : 3, "data" : dumps(data), "checksum" : _CHECKSUM})
+    return f
+
+def decoder(loads):
+    def f(s):
+        return loads(loads(s)["data"])
+    return f
+
+def _py_dumps(data):
+    return phpserialize._dumps(data, "utf-8", "strict", None)
+
+def _py_loads(s):
+    return phpserialize._loads(s, "utf-8", "strict", False, None, None)
+
+def _stream_loads(s):
+    return phpserialize.load(StringIO(s))
+
+if __name__ == "__main__":
+    speedups = phpserialize._speedups
+    if speedups is None:
+        print "orzoj._phpserialize is not available, only the pure Python code is measured"
+    print "{0:>20} {1:>8} {2:>10} {3:>10} {4:>10} {5:>10} {6:>10}" . format(
+            "payload", "bytes", "dumps py", "dumps C", "loads file", "loads py", "loads C")
+    for (name, data) in payloads():
+        s = encoder(_py_dumps)(data)
+        obj = decoder(_stream_loads)(s)
+        assert decoder(_py_loads)(s) == obj
+        row = [rate(encoder(_py_dumps), data), None,
+                rate(decoder(_stream_loads), s), rate(decoder(_py_loads), s), None]
+        if speedups:
+            assert encoder(speedups.dumps)(data) == s and decoder(speedups.loads)(s) == obj
+            row[1] = rate(encoder(speedups.dumps), data)
+            row[4] = rate(decoder(speedups.loads), s)
+        print "{0:>20} {1:>8} {2:>10} {3:>10} {4:>10} {5:>10} {6:>10}" . format(name, len(s),
+                *["-" if i is None else "{0:.0f}" . format(i) for i in row])
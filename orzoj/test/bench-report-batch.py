@@ -0,0 +1,81 @@
+#!/usr/bin/env python2
+# benchmark for batched reporting (ReportBatchInterval / ReportBatchSize):
+# threads send the reports of tasks like the judges do to a local stand-in
+# website, which spends some time on each request (see fake_website.py),
+# and the numbers of tasks and website requests per second are measured
+
+import time, threading
+
+from orzoj import structures
+from orzoj.server import web
+import fake_website
+
+PORT = 9473
+NTHREAD = (8, 32, 64)
+NCASE = 10
+DURATION = 3 # seconds for each measurement
+
+def _judge(task, end, cnt):
+    class judge:
+        id_num = 1
+    n = 0
+    res = list()
+    for i in range(NCASE):
+        r = structures.case_result()
+        r.exe_status = r.score = r.full_score = r.time = r.memory = 0
+        r.extra_info = ""
+        res.append(r)
+    while time.time() < end:
+        web.report_sync_data(task, judge)
+        web.report_compiling(task)
+        web.report_compile_success(task, NCASE)
+        for i in range(NCASE):
+            web.report_judge_progress(task, i)
+        web.report_prob_result(task, res)
+        n += 1
+    cnt.append(n)
+
+_nrequest = [0]
+_urlopen = web._urlopen
+def _count_urlopen(*args):
+    _nrequest[0] += 1
+    return _urlopen(*args)
+
+def bench(nthread, interval):
+    web._batcher = None
+    if interval:
+        web._batcher = web._Report_batcher(interval / 1000.0, 32)
+    _nrequest[0] = 0
+    cnt = list()
+    end = time.time() + DURATION
+    threads = list()
+    for i in range(nthread):
+        task = structures.task()
+        task.id = i
+        threads.append(threading.Thread(target = _judge, args = (task, end, cnt)))
+    for i in threads:
+        i.start()
+    for i in threads:
+        i.join()
+    return (sum(cnt) / float(DURATION), _nrequest[0] / float(DURATION))
+
+if __name__ == "__main__":
+    web._passwd = fake_website.PASSWD
+    web._timeout = 5
+    web._retry_cnt = 1
+    web._retry_wait = 1
+    web._urlopen = _count_urlopen
+    pid = fake_website.start(PORT)
+    web._web_addr = "http://127.0.0.1:{0}/orz.php" . format(PORT)
+    web._pool = web._Conn_pool(web._web_addr, 8)
+    try:
+        print "{0:>8} {1:>10} {2:>10} {3:>14}" . format("threads", "batch(ms)",
+                "tasks/s", "requests/s")
+        for n in NTHREAD:
+            for interval in (0, 5, 20):
+                print "{0:>8} {1:>10} {2:>10.1f} {3:>14.1f}" . format(n, interval,
+                        *bench(n, interval))
+    finally:
+        import os, signal
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
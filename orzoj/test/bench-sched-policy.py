@@ -0,0 +1,80 @@
+#!/usr/bin/env python2
+# simulation of the scheduling policies (SchedPolicy fifo / sjf):
+# judges run a burst of submissions where a few problems are much heavier
+# than the others, and the turnaround time (from being queued to finished)
+# is measured on a simulated clock
+
+import random, heapq
+from orzoj.server import sched, cost, work
+
+NJUDGE = 4
+NTASK = 2000
+ARRIVAL_RATE = 2.1 # tasks per second, while the judges could finish about 2.35
+PROBS = [("easy-{0}" . format(i), 0.5) for i in range(8)] + \
+        [("medium-{0}" . format(i), 2.0) for i in range(3)] + [("heavy", 8.0)]
+LANGS = (("gcc", 0.3), ("fpc", 0.1))
+
+class Clock:
+    now = 0.0
+    def time(self):
+        return self.now
+
+class Task:
+    def __init__(self, id, prob, lang, lang_id):
+        self.id = id
+        self.prob = prob
+        self.lang = lang
+        self.lang_id = lang_id
+
+def simulate(policy, weight):
+    random.seed(1)
+    clock = Clock()
+    sched.time = clock
+    cost._run.clear()
+    cost._prob.clear()
+    cost._compile.clear()
+    cost._all = None
+    work._sjf_cost_weight = weight
+    q = sched.Task_queue()
+    if policy == "sjf":
+        q.key_func = work._sjf_key
+    judges = [q.register("judge-{0}" . format(i), range(len(LANGS))) for i in range(NJUDGE)]
+
+    events = list() # (time, kind, arg)
+    t = 0
+    for i in range(NTASK):
+        t += random.expovariate(ARRIVAL_RATE)
+        (prob, run) = random.choice(PROBS)
+        lid = random.randrange(len(LANGS))
+        heapq.heappush(events, (t, 0, Task(i, prob, LANGS[lid][0], lid)))
+    idle = list(judges)
+    turnaround = list()
+    while events:
+        (clock.now, kind, arg) = heapq.heappop(events)
+        if kind == 0:
+            q.put(arg)
+        else:
+            (judge, task, stages) = arg
+            q.task_done(judge, task, stages)
+            cost.task_done(task, stages)
+            turnaround.append((task.prob, clock.now - task.time_queued))
+            idle.append(judge)
+        while idle:
+            task = q.get(idle[-1])
+            if task is None:
+                break
+            judge = idle.pop()
+            compile = dict(LANGS)[task.lang] * random.uniform(0.8, 1.2)
+            run = dict(PROBS)[task.prob] * random.uniform(0.8, 1.2)
+            stages = {"compile" : compile, "run" : run}
+            heapq.heappush(events, (clock.now + compile + run, 1, (judge, task, stages)))
+
+    all = sorted(i[1] for i in turnaround)
+    heavy = sorted(i[1] for i in turnaround if i[0] == "heavy")
+    return (sum(all) / len(all), all[len(all) * 99 / 100], sum(heavy) / len(heavy), heavy[-1])
+
+print "{0:>8} {1:>8} {2:>10} {3:>10} {4:>12} {5:>12}" . format("policy", "weight",
+        "mean(s)", "p99(s)", "heavy mean", "heavy max")
+for (policy, weight) in (("fifo", 0), ("sjf", 2), ("sjf", 10), ("sjf", 50)):
+    print "{0:>8} {1:>8} {2:>10.2f} {3:>10.2f} {4:>12.2f} {5:>12.2f}" . format(policy,
+            weight, *simulate(policy, weight))
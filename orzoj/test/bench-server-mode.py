@@ -0,0 +1,209 @@
+#!/usr/bin/env python2
+# benchmark for the server modes (ServerMode thread / event):
+# connect many idle judges to the server and measure its memory, CPU time
+# and number of threads per connected judge; then keep many judges busy
+# with tasks taking a fixed time, and measure how many run at the same time
+#
+# usage: bench-server-mode.py [cert dir]
+# the cert dir should contain ca.crt, server.crt, server.key, client.crt and
+# client.key (see cert/mkcert.sh); the website is replaced by no-op functions
+
+import sys, os, time, socket, ssl, select, struct, subprocess, signal, threading
+
+PORT = 9361
+NJUDGE = (50, 200, 400)
+WINDOW = 5 # seconds to measure CPU time
+NJUDGE_BUSY = 64
+NTASK = 256
+TASK_TIME = 0.5 # seconds
+
+class Task:
+    def __init__(self, id, lang_id):
+        self.id = id
+        self.lang_id = lang_id
+        self.prob = "prob-{0}" . format(id % 10)
+
+def _fake_solve_task(ntask):
+    """return a replacement of judge_session.solve_task which sleeps for
+    TASK_TIME, and prints the elapsed time and the maximal number of
+    running tasks after @ntask tasks"""
+    from orzoj.server import work
+    lock = threading.Lock()
+    stat = {"start": None, "running": 0, "max": 0, "done": 0}
+    def solve_task(self, slot, task):
+        with lock:
+            if stat["start"] is None:
+                stat["start"] = time.time()
+            stat["running"] += 1
+            stat["max"] = max(stat["max"], stat["running"])
+        time.sleep(TASK_TIME)
+        work._task_queue.task_done(self.sched_judge, task, dict())
+        with lock:
+            stat["running"] -= 1
+            stat["done"] += 1
+            if stat["done"] == ntask:
+                print time.time() - stat["start"], stat["max"]
+                sys.stdout.flush()
+    return solve_task
+
+def _put_tasks(njudge, ntask):
+    from orzoj.server import work
+    while len(work._judge_id_set) < njudge:
+        time.sleep(0.1)
+    time.sleep(0.5) # let the last judge finish its handshake
+    lid = work._get_lang_id("gcc")
+    for i in range(ntask):
+        work._task_queue.put(Task(i, lid))
+
+def serve(mode, port, cert, njudge, ntask):
+    import logging
+    logging.getLogger().addHandler(logging.NullHandler())
+    from orzoj import snc, control
+    from orzoj.server import work, web, evloop
+
+    snc._timeout = 30
+    snc._cert_file = os.path.join(cert, "server.crt")
+    snc._key_file = os.path.join(cert, "server.key")
+    snc._ca_file = os.path.join(cert, "ca.crt")
+    work._id_max_len = 20
+    work._max_worker_slots = 32
+    evloop._nworker = 16
+    evloop._nweb_worker = 4
+    web.get_query_list = lambda: []
+    web.register_new_judge = lambda judge, query_ans: None
+    web.remove_judge = lambda judge: None
+    if ntask:
+        work.judge_session.solve_task = _fake_solve_task(ntask)
+        th = threading.Thread(target = _put_tasks, args = (njudge, ntask))
+        th.daemon = True
+        th.start()
+
+    if mode == "event":
+        evloop.Loop(port).run()
+        return
+    s = snc.socket(None, port)
+    while not control.test_termination_flag():
+        try:
+            (conn, addr) = s.accept(1)
+        except snc.ErrorTimeout:
+            continue
+        except snc.Error:
+            break
+        work.thread_new_judge_connection(conn).start()
+    s.close()
+
+def _proc_stat(pid):
+    """return (rss in kb, cpu seconds, number of threads)"""
+    with open("/proc/{0}/status" . format(pid)) as f:
+        status = dict(l.split(":", 1) for l in f if ":" in l)
+    with open("/proc/{0}/stat" . format(pid)) as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    tick = os.sysconf("SC_CLK_TCK")
+    cpu = (int(fields[11]) + int(fields[12])) / float(tick)
+    return (int(status["VmRSS"].split()[0]), cpu, int(status["Threads"]))
+
+def _recv_exact(s, n):
+    data = ""
+    while len(data) < n:
+        buf = s.recv(n - len(data))
+        assert buf
+        data += buf
+    return data
+
+def _connect_judges(n, cert):
+    ctx = ssl.SSLContext(ssl.PROTOCOL_TLSv1)
+    ctx.verify_mode = ssl.CERT_REQUIRED
+    ctx.load_verify_locations(os.path.join(cert, "ca.crt"))
+    ctx.load_cert_chain(os.path.join(cert, "client.crt"), os.path.join(cert, "client.key"))
+    from orzoj import msg
+    judges = list()
+    for i in range(n):
+        s = ctx.wrap_socket(socket.create_connection(("127.0.0.1", PORT)))
+        jid = "bench-{0}" . format(i)
+        s.sendall(struct.pack("!II", msg.HELLO, len(jid)) + jid +
+                struct.pack("!III", msg.PROTOCOL_VERSION, 1, 3) + "gcc")
+        assert struct.unpack("!I", _recv_exact(s, 4))[0] == msg.CONNECT_OK
+        # answer the features query with no feature
+        (m, l) = struct.unpack("!II", _recv_exact(s, 8))
+        assert m == msg.QUERY_INFO
+        _recv_exact(s, l)
+        s.sendall(struct.pack("!II", msg.ANS_QUERY, 0))
+        s.setblocking(False)
+        judges.append(s)
+    return judges
+
+def _drain(judges, seconds, stop = None):
+    """read and discard TELL_ONLINE messages, until @stop (a file) is
+    readable if it is not None"""
+    end = time.time() + seconds
+    while time.time() < end:
+        if stop is None:
+            (r, w, x) = select.select(judges, [], [], 0.1)
+        else:
+            (r, w, x) = select.select(judges + [stop], [], [], 0.1)
+            if stop in r:
+                return True
+        for s in r:
+            try:
+                while s.recv(4096):
+                    pass
+            except ssl.SSLWantReadError:
+                pass
+    return False
+
+def bench(mode, n, cert):
+    server = subprocess.Popen([sys.executable, __file__, "serve", mode, str(PORT), cert, "0", "0"])
+    try:
+        time.sleep(1)
+        (rss0, cpu0, nthread0) = _proc_stat(server.pid)
+        judges = _connect_judges(n, cert)
+        _drain(judges, 1)
+        (rss1, cpu1, nthread1) = _proc_stat(server.pid)
+        _drain(judges, WINDOW)
+        (rss2, cpu2, nthread2) = _proc_stat(server.pid)
+        for s in judges:
+            s.close()
+        return ((rss2 - rss0) / float(n), (cpu2 - cpu1) / WINDOW / n * 1e3,
+                nthread2 - nthread0)
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait()
+
+def bench_busy(mode, cert):
+    """return (elapsed time, maximal number of running tasks)"""
+    server = subprocess.Popen([sys.executable, __file__, "serve", mode, str(PORT), cert,
+        str(NJUDGE_BUSY), str(NTASK)], stdout = subprocess.PIPE)
+    try:
+        time.sleep(1)
+        judges = _connect_judges(NJUDGE_BUSY, cert)
+        assert _drain(judges, 120, server.stdout)
+        (elapsed, nmax) = server.stdout.readline().split()
+        for s in judges:
+            s.close()
+        return (float(elapsed), int(nmax))
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait()
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        serve(sys.argv[2], int(sys.argv[3]), sys.argv[4], int(sys.argv[5]), int(sys.argv[6]))
+        sys.exit()
+    cert = "cert"
+    if len(sys.argv) > 1:
+        cert = sys.argv[1]
+    print "{0:>8} {1:>8} {2:>14} {3:>20} {4:>10}" . format("mode", "judges",
+            "rss/judge(kb)", "cpu/judge(ms/s)", "threads")
+    for n in NJUDGE:
+        for mode in ("thread", "event"):
+            (rss, cpu, nthread) = bench(mode, n, cert)
+            print "{0:>8} {1:>8} {2:>14.1f} {3:>20.3f} {4:>10}" . format(mode, n,
+                    rss, cpu, nthread)
+
+    print
+    print "{0} busy judges, {1} tasks of {2}s each (ideal: {3:.1f}s)" . format(
+            NJUDGE_BUSY, NTASK, TASK_TIME, NTASK * TASK_TIME / NJUDGE_BUSY)
+    print "{0:>8} {1:>12} {2:>14}" . format("mode", "elapsed(s)", "max running")
+    for mode in ("thread", "event"):
+        (elapsed, nmax) = bench_busy(mode, cert)
+        print "{0:>8} {1:>12.2f} {2:>14}" . format(mode, elapsed, nmax)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python2
+# micro-benchmark for orzoj.server.sched.Task_queue:
+# measure the dispatch cost as the number of judges and languages grows,
+# compared with the per-language deques scanned by the original queue
+
+import random, time, threading
+from collections import deque
+from orzoj.server import sched
+
+NTASK = 20000
+
+class Task:
+    def __init__(self, id, lang_id):
+        self.id = id
+        self.lang_id = lang_id
+        self.prob = "prob-{0}" . format(id % 10)
+
+class Baseline_queue:
+    """the task queue of orzoj-server before sched.Task_queue: one deque per
+    language, and get() scans the deques of all the judge's languages"""
+    def __init__(self):
+        self._queue = dict()
+        self._lock = threading.Lock()
+        self._size = 0
+
+    def register(self, name, lang_id_set):
+        return set(lang_id_set)
+
+    def unregister(self, judge):
+        pass
+
+    def put(self, task):
+        with self._lock:
+            if task.lang_id not in self._queue:
+                self._queue[task.lang_id] = deque()
+            self._queue[task.lang_id].append(task)
+            self._size += 1
+
+    def get(self, lang_id_set):
+        with self._lock:
+            min_tid = None
+            for lid in lang_id_set:
+                try:
+                    q = self._queue[lid]
+                    task = q[0]
+                    if min_tid is None or task.id < min_tid:
+                        min_tid = task.id
+                        min_tid_q = q
+                except Exception:
+                    pass
+            if min_tid is not None:
+                self._size -= 1
+                return min_tid_q.popleft()
+            return None
+
+def bench(queue_class, njudge, nlang):
+    random.seed(njudge * 1000 + nlang)
+    q = queue_class()
+    judges = list()
+    judges.append(q.register("judge-0", range(nlang)))
+    for i in range(1, njudge):
+        lset = random.sample(range(nlang), max(1, nlang / 2))
+        judges.append(q.register("judge-{0}" . format(i), lset))
+
+    t0 = time.time()
+    for i in range(NTASK):
+        q.put(Task(i, random.randrange(nlang)))
+    t_put = time.time() - t0
+
+    nget = 0
+    t0 = time.time()
+    while nget < NTASK:
+        for j in judges:
+            if q.get(j) is not None:
+                nget += 1
+    t_get = time.time() - t0
+
+    for j in judges:
+        q.unregister(j)
+    return (t_put / NTASK * 1e6, t_get / NTASK * 1e6)
+
+print "{0:>8} {1:>8} {2:>14} {3:>14} {4:>14} {5:>14}" . format("judges", "langs",
+        "base put(us)", "base get(us)", "put(us)", "get(us)")
+for njudge in (4, 16, 64):
+    for nlang in (2, 8, 32):
+        (bp, bg) = bench(Baseline_queue, njudge, nlang)
+        (p, g) = bench(sched.Task_queue, njudge, nlang)
+        print "{0:>8} {1:>8} {2:>14.2f} {3:>14.2f} {4:>14.2f} {5:>14.2f}" . format(
+                njudge, nlang, bp, bg, p, g)
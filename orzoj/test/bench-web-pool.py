@@ -0,0 +1,74 @@
+#!/usr/bin/env python2
+# benchmark for the website connection pool (WebPoolSize):
+# several threads send reports to a local stand-in website (in another
+# process), which answers every request like orz.php does, and the number
+# of requests per second is measured with and without persistent connections
+#
+# usage: bench-web-pool.py [cert dir]
+# if the cert dir (containing server.crt and server.key, see cert/mkcert.sh)
+# is given, the website is also tested over HTTPS
+
+import sys, os, threading, time, ssl, signal
+
+from orzoj import structures
+from orzoj.server import web
+import fake_website
+
+PORT = 9472
+NTHREAD = (1, 8, 32)
+DURATION = 3 # seconds for each measurement
+
+def _reporter(task, end, cnt):
+    n = 0
+    while time.time() < end:
+        web.report_compiling(task)
+        n += 1
+    cnt.append(n)
+
+def bench(nthread, pool_size):
+    web._pool = None
+    if pool_size:
+        web._pool = web._Conn_pool(web._web_addr, pool_size)
+    cnt = list()
+    end = time.time() + DURATION
+    threads = list()
+    for i in range(nthread):
+        task = structures.task()
+        task.id = i
+        threads.append(threading.Thread(target = _reporter, args = (task, end, cnt)))
+    for i in threads:
+        i.start()
+    for i in threads:
+        i.join()
+    if web._pool:
+        for i in web._pool._idle:
+            i.close()
+    return sum(cnt) / float(DURATION)
+
+if __name__ == "__main__":
+    web._passwd = fake_website.PASSWD
+    # measure the cost of connections only
+    fake_website.REQUEST_COST = 0
+    fake_website.REPORT_COST = 0
+    web._timeout = 5
+    web._retry_cnt = 1
+    web._retry_wait = 1
+    # the certificate of the stand-in website is not verified
+    ssl._create_default_https_context = ssl._create_unverified_context
+
+    schemes = [("http", None)]
+    if len(sys.argv) > 1:
+        schemes.append(("https", sys.argv[1]))
+    print "{0:>8} {1:>8} {2:>16} {3:>16}" . format("scheme", "threads",
+            "no pool(req/s)", "pool(req/s)")
+    for (scheme, cert) in schemes:
+        pid = fake_website.start(PORT, cert)
+        try:
+            web._web_addr = "{0}://127.0.0.1:{1}/orz.php" . format(scheme, PORT)
+            web._thread_req_id.clear() # as after login
+            for n in NTHREAD:
+                print "{0:>8} {1:>8} {2:>16.1f} {3:>16.1f}" . format(scheme, n,
+                        bench(n, 0), bench(n, 8))
+        finally:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
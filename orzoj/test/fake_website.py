@@ -0,0 +1,314 @@
+# a stand-in for orz.php used by the benchmarks: it answers the requests of
+# orzoj-server like the website does (see the protocol in
+# orzoj/server/web.py), spending REQUEST_COST seconds on each request and
+# REPORT_COST seconds on each report (REPORT_COST * n for a report_batch
+# request of n reports), with at most NWORKER requests handled at the same
+# time (like a PHP process pool)
+#
+# errors could be injected: each request is answered with an error with
+# probability ERROR_RATE, dropped (connection closed without an answer)
+# with probability DROP_RATE, and answered with 'relogin' with probability
+# RELOGIN_RATE; during the outages given to add_outage(), every request is
+# answered with HTTP error 503
+#
+# gzip compression (see orzoj/server/web.py) is accepted if GZIP is True,
+# and responses of at least GZIP_MIN bytes are then compressed
+#
+# the tasks given to add_tasks() are submitted after a GET request of
+# orz.php?start, and orz.php?stats returns phpserialize.dumps() of
+#   {"tasks" : {<task id> : {<event> : <seconds since start>}},
+#    "nrequest" : <number of POST requests>, "nlogin" : <number of logins>,
+#    "nbyte" : <bytes of POST requests and their responses>}
+# where the events are "submitted", "fetched", and the reports received
+# ("sync_data", "compiling", "compile_success", "prob_result", ...)
+
+import os, threading, time, hashlib, cgi, ssl, random, urlparse, zlib
+import BaseHTTPServer, SocketServer
+from collections import deque
+
+from orzoj import phpserialize
+
+PASSWD = "bench" # Password in server.conf
+REQUEST_COST = 0.002
+REPORT_COST = 0.0002
+NWORKER = 4
+ERROR_RATE = 0
+DROP_RATE = 0
+RELOGIN_RATE = 0
+QUERY_LIST = ["platform"]
+GZIP = True
+GZIP_MIN = 1024
+
+_workload = list() # list of (<seconds after start>, <task dict>)
+_outages = list() # list of (<seconds after start>, <duration in seconds>)
+
+def _sha1sum(s):
+    return hashlib.sha1(s).hexdigest()
+
+def _gzip(s):
+    c = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return c.compress(s) + c.flush()
+
+def add_tasks(tasks):
+    """@tasks: list of (<seconds after start>, <dict of id, prob, lang, src,
+    input, output>); must be called before start()"""
+    _workload.extend(tasks)
+
+def add_outage(begin, duration):
+    """make the website unavailable for @duration seconds from @begin
+    seconds after start; must be called before start()"""
+    _outages.append((begin, duration))
+
+class _Website:
+    def __init__(self):
+        self.cond = threading.Condition()
+        # the password and request ids of the current and the previous
+        # login, so that requests made before a relogin could finish;
+        # PASSWD is used before any login so that the benchmarks could
+        # skip logging in by setting web._passwd
+        self.sessions = [(PASSWD, dict())]
+        self.dynamic_passwd = None
+        self.nlogin = 0
+        self.nrequest = 0
+        self.nbyte = 0
+        self.gzip = False
+        self.njudge = 0
+        self.time_start = None
+        self.waiting = deque()  # tasks submitted and not fetched
+        self.unacked = list()   # tasks in the last fetch_task reply
+        self.events = dict()
+
+    def check(self, tid, checksum, data):
+        """return (<checksum base>, <request ids>, <request id>) of the
+        session the request belongs to, or None"""
+        with self.cond:
+            for (passwd, req_id) in self.sessions:
+                rid = req_id.get(tid, 0)
+                base = "{0}${1}${2}" . format(tid, rid, passwd)
+                if checksum == _sha1sum(base + data):
+                    return (base, req_id, rid)
+        return None
+
+    def event(self, tid, name):
+        if self.time_start is None:
+            return
+        with self.cond:
+            self.events.setdefault(int(tid), dict())[name] = time.time() - self.time_start
+
+    def in_outage(self):
+        if self.time_start is None:
+            return False
+        t = time.time() - self.time_start
+        return any(begin <= t < begin + duration for (begin, duration) in _outages)
+
+    def login1(self, query):
+        if query.get("version") != ["1"]:
+            return "0"
+        self.dynamic_passwd = "{0:032x}" . format(random.getrandbits(128))
+        self.gzip = GZIP and query.get("compress") == ["gzip"]
+        if self.gzip:
+            return self.dynamic_passwd + " gzip"
+        return self.dynamic_passwd
+
+    def login2(self, query):
+        if self.dynamic_passwd is None:
+            return "0"
+        passwd = _sha1sum(self.dynamic_passwd + PASSWD)
+        if query.get("checksum") != [_sha1sum(passwd)]:
+            return "0"
+        with self.cond:
+            self.sessions = [(passwd, dict()), self.sessions[0]]
+            self.nlogin += 1
+            if "refetch" in query:
+                self._requeue(set())
+        return _sha1sum(_sha1sum(self.dynamic_passwd) + PASSWD)
+
+    def start(self):
+        with self.cond:
+            if self.time_start is not None:
+                return
+            self.time_start = time.time()
+        threading.Thread(target = self._submit).start()
+
+    def _submit(self):
+        for (t, task) in sorted(_workload, key = lambda x: x[0]):
+            delay = self.time_start + t - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            self.event(task["id"], "submitted")
+            with self.cond:
+                self.waiting.append(task)
+                self.cond.notify_all()
+
+    def _requeue(self, acked):
+        # must be called with self.cond held
+        for task in reversed(self.unacked):
+            if task["id"] not in acked:
+                self.waiting.appendleft(task)
+        self.unacked = list()
+
+    def fetch_task(self, data):
+        prev = data["prev"]
+        acked = set()
+        if prev and prev["type"] in ("src", "tasks", "rejudge"):
+            if isinstance(prev["id"], dict):
+                acked = set(prev["id"].itervalues())
+            else:
+                acked = set([prev["id"]])
+        limit = data.get("max_tasks") # None if orzoj-server is old
+        end = time.time() + float(data.get("wait", 0))
+        with self.cond:
+            self._requeue(acked)
+            while not self.waiting and time.time() < end:
+                self.cond.wait(end - time.time())
+            tasks = [self.waiting.popleft() for i in range(min(limit or 1, len(self.waiting)))]
+            self.unacked = tasks
+        for task in tasks:
+            self.event(task["id"], "fetched")
+        if not tasks:
+            return {"type" : "none"}
+        if limit is None:
+            ret = dict(tasks[0])
+            ret["type"] = "src"
+            return ret
+        return {"type" : "tasks", "tasks" : tasks}
+
+    def handle(self, data):
+        """return the answer to the request @data, after spending the time
+        of handling it"""
+        action = data["action"]
+        if action == "fetch_task":
+            time.sleep(REQUEST_COST)
+            return self.fetch_task(data)
+        if action == "report_batch":
+            reports = phpserialize.dict_to_list(data["reports"])
+        elif action.startswith("report_"):
+            reports = [data]
+        else:
+            reports = list()
+        time.sleep(REQUEST_COST + REPORT_COST * len(reports))
+        for i in reports:
+            self.event(i["task"], i["action"][len("report_"):])
+        if action == "get_query_list":
+            return QUERY_LIST
+        if action == "register_new_judge":
+            with self.cond:
+                self.njudge += 1
+                return {"id_num" : self.njudge}
+        return None
+
+    def stats(self):
+        with self.cond:
+            return phpserialize.dumps({"tasks" : self.events,
+                "nrequest" : self.nrequest, "nlogin" : self.nlogin,
+                "nbyte" : self.nbyte})
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # keep-alive
+    wbufsize = -1 # send the response in one packet
+
+    workers = threading.Semaphore(NWORKER)
+
+    def do_POST(self):
+        site = self.server.site
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        req = phpserialize.loads(cgi.parse_qs(body)["data"][0])
+        with site.cond:
+            site.nrequest += 1
+            site.nbyte += len(body)
+        if site.in_outage():
+            self.send_error(503)
+            return
+        r = random.random()
+        if r < DROP_RATE:
+            self.close_connection = 1
+            return
+        r -= DROP_RATE
+        if r < RELOGIN_RATE:
+            self._reply("relogin")
+            return
+        r -= RELOGIN_RATE
+        if "datagz" in req:
+            req["data"] = zlib.decompress(req["datagz"], 16 + zlib.MAX_WBITS)
+        session = site.check(req["thread_id"], req["checksum"], req["data"])
+        if session is None:
+            # most likely a request of a previous run of orzoj-server
+            self._reply("relogin")
+            return
+        (base, req_id, rid) = session
+        if r < ERROR_RATE:
+            # the request id is not used, so the same request could be retried
+            status = 1
+            data = "injected error"
+        else:
+            with self.workers:
+                data = phpserialize.dumps(site.handle(phpserialize.loads(req["data"])))
+            status = 0
+            with site.cond:
+                req_id[req["thread_id"]] = rid + 1
+        ret = {"status" : status, "checksum" : _sha1sum(base + str(status) + data)}
+        if site.gzip and len(data) >= GZIP_MIN:
+            ret["datagz"] = _gzip(data)
+        else:
+            ret["data"] = data
+        ret = phpserialize.dumps(ret)
+        with site.cond:
+            site.nbyte += len(ret)
+        self._reply(ret)
+
+    def do_GET(self):
+        site = self.server.site
+        query = urlparse.urlsplit(self.path).query
+        if query == "start":
+            site.start()
+            self._reply("0")
+        elif query == "stats":
+            self._reply(site.stats())
+        else:
+            query = urlparse.parse_qs(query)
+            action = query.get("action")
+            if action == ["login1"]:
+                self._reply(site.login1(query))
+            elif action == ["login2"]:
+                self._reply(site.login2(query))
+            else:
+                self._reply("0") # sched_work
+
+    def _reply(self, s):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(s)))
+        self.end_headers()
+        self.wfile.write(s)
+
+    def log_message(self, *args):
+        pass
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def handle_error(self, request, client_address):
+        pass # connections closed by the clients
+
+def serve(port, cert = None):
+    """serve on 127.0.0.1:@port forever; use HTTPS if @cert (a directory
+    containing server.crt and server.key) is not None"""
+    _Handler.workers = threading.Semaphore(NWORKER)
+    server = _Server(("127.0.0.1", port), _Handler)
+    server.site = _Website()
+    if cert:
+        server.socket = ssl.wrap_socket(server.socket, server_side = True,
+                certfile = os.path.join(cert, "server.crt"),
+                keyfile = os.path.join(cert, "server.key"))
+    server.serve_forever()
+
+def start(port, cert = None):
+    """run serve() in a child process and return its pid"""
+    pid = os.fork()
+    if pid == 0:
+        try:
+            serve(port, cert)
+        finally:
+            os._exit(0)
+    time.sleep(0.5)
+    return pid
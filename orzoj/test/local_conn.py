@@ -0,0 +1,81 @@
+# helpers used by the tests of sync_dir: a connection between two ends in
+# the same process, on a socket pair without SSL, and a synchronization of
+# two directories over it
+
+import socket, threading, os, os.path, time
+
+from orzoj import snc, sync_dir
+
+class Local_conn(snc.conn_base):
+    """one end of a connection, with the interface of snc.snc"""
+    def __init__(self, sock):
+        self._sock = sock
+
+    def read(self, size, timeout = 0):
+        ret = list()
+        while size:
+            try:
+                s = self._sock.recv(size)
+            except socket.error:
+                raise snc.Error
+            if not s:
+                raise snc.Error
+            ret.append(s)
+            size -= len(s)
+        return "" . join(ret)
+
+    def write(self, data, timeout = 0):
+        try:
+            self._sock.sendall(data)
+        except socket.error:
+            raise snc.Error
+
+    def close(self):
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self._sock.close()
+
+def pair():
+    """return a tuple of two connected Local_conn"""
+    (a, b) = socket.socketpair()
+    return (Local_conn(a), Local_conn(b))
+
+def sync(src, dest, features = sync_dir.FEATURES, lock = None):
+    """synchronize directory @dest to @src with sync_dir.send and
+    sync_dir.recv, and return a tuple(<return value of send>, <return value
+    of recv>), where an exception raised is returned instead"""
+    (cs, cr) = pair()
+    ret = list()
+    def _send():
+        try:
+            ret.append(sync_dir.send(src, cs, features))
+        except Exception as e:
+            ret.append(e)
+        cs.close()
+    th = threading.Thread(target = _send)
+    th.start()
+    try:
+        r = sync_dir.recv(dest, cr, lock)
+    except Exception as e:
+        r = e
+    cr.close()
+    th.join()
+    return (ret[0], r)
+
+def write_file(path, data, age = 0):
+    """write @data to file @path, whose mtime is set to @age seconds ago"""
+    with open(path, "wb") as f:
+        f.write(data)
+    if age:
+        t = time.time() - age
+        os.utime(path, (t, t))
+
+def read_dir(path):
+    """return a dict of <file name> => <content> of the files in @path"""
+    ret = dict()
+    for i in os.listdir(path):
+        with open(os.path.join(path, i), "rb") as f:
+            ret[i] = f.read()
+    return ret
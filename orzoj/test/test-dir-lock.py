@@ -0,0 +1,97 @@
+#!/usr/bin/env python2
+# test that sync_dir.Dir_lock stays usable when idle() raises while a thread
+# is waiting to upgrade, as it does when the connection to orzoj-server drops
+import threading
+from orzoj import sync_dir, msg
+
+msg.TELL_ONLINE_INTERVAL = 0.05
+
+class Dropped(Exception):
+    pass
+
+def _raise():
+    raise Dropped
+
+def _nothing():
+    pass
+
+def in_thread(func):
+    """run @func in a new thread, and return a function waiting for it and
+    returning its result"""
+    ret = list()
+    th = threading.Thread(target = lambda: ret.append(func()))
+    th.start()
+    def join():
+        th.join()
+        return ret[0]
+    return join
+
+def holder(lock, func):
+    """start a thread taking the shared lock and then calling func() when
+    the returned event is set; return (event, join)"""
+    acquired = threading.Event()
+    go = threading.Event()
+    def work():
+        lock.acquire_shared(_nothing)
+        acquired.set()
+        go.wait()
+        try:
+            return func()
+        finally:
+            lock.release()
+    join = in_thread(work)
+    acquired.wait()
+    return (go, join)
+
+def upgrade_raises(lock):
+    """upgrade with an idle() raising; return whether the lock was still
+    held afterwards"""
+    try:
+        lock.upgrade(_raise)
+        assert False
+    except Dropped:
+        pass
+    return lock.held()
+
+def check_usable(lock):
+    def work():
+        lock.acquire_shared(_nothing)
+        kept = lock.upgrade(_nothing)
+        lock.downgrade()
+        lock.release()
+        return kept
+    assert in_thread(work)()
+
+print "testing sync_dir.Dir_lock..."
+
+# another thread holds the shared lock, so the upgrade has to wait
+lock = sync_dir.Dir_lock()
+lock.acquire_shared(_nothing)
+(go, join) = holder(lock, lambda: upgrade_raises(lock))
+go.set()
+assert join()
+assert not lock._upgrading
+lock.release()
+check_usable(lock)
+print "upgrade interrupted while waiting for readers: ok"
+
+# another thread is upgrading, so the shared lock is given up while waiting
+lock = sync_dir.Dir_lock()
+lock.acquire_shared(_nothing)
+(go_upgrader, join_upgrader) = holder(lock, lambda: lock.upgrade(_nothing))
+(go_victim, join_victim) = holder(lock, lambda: upgrade_raises(lock))
+go_upgrader.set()
+while not lock._upgrading:
+    pass
+go_victim.set()
+assert not join_victim()
+lock.release()
+assert join_upgrader()
+check_usable(lock)
+print "upgrade interrupted while waiting for another upgrade: ok"
+
+# release() without holding the lock does nothing
+lock = sync_dir.Dir_lock()
+lock.release()
+check_usable(lock)
+print "release without holding: ok"
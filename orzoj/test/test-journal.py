@@ -0,0 +1,44 @@
+#!/usr/bin/env python2
+# test that the tasks recovered from the task journal are the unfinished
+# ones, and that the rejudge batches keep their order before new batches
+import os, os.path, tempfile, shutil
+from orzoj import structures, control
+from orzoj.server import journal
+
+def make_task(id, batch = None):
+    t = structures.task()
+    t.id = id
+    t.prob = "prob"
+    t.lang = "gcc"
+    t.src = "int main() {{ return {0}; }}" . format(id)
+    t.input = ""
+    t.output = ""
+    t.rejudge_batch = batch
+    return t
+
+print "testing journal..."
+
+tmp = tempfile.mkdtemp(prefix = "orzoj-test-")
+try:
+    journal._filename = os.path.join(tmp, "journal")
+    journal._commit_interval = 0
+    journal._init()
+    assert journal.recovered_tasks() is None
+    journal.start()
+    journal.tasks_queued([make_task(1), make_task(2), make_task(3)])
+    journal.tasks_queued([make_task(4, 7), make_task(5, 7)])
+    journal.tasks_queued([make_task(6, 8)])
+    journal.task_finished(make_task(2))
+    journal.task_finished(make_task(5))
+    control.set_termination_flag()
+    journal._journal.join()
+
+    journal._journal = None
+    journal._init()
+    tasks = journal.recovered_tasks()
+    assert [(t.id, t.rejudge_batch) for t in tasks] == \
+            [(1, None), (3, None), (4, -1), (6, 0)], [(t.id, t.rejudge_batch) for t in tasks]
+    assert tasks[0].src == make_task(1).src
+    print "unfinished tasks and their rejudge batches recovered: ok"
+finally:
+    shutil.rmtree(tmp, True)
@@ -0,0 +1,75 @@
+#!/usr/bin/env python2
+# test that both ends of a multiplexed connection could write large frames
+# at the same time without waiting for each other
+#
+# usage: test-mux-bulk.py [cert dir]
+# the cert dir should contain ca.crt, server.crt and server.key
+
+import sys, os, threading, time, socket
+from orzoj import snc, mux
+
+PORT = 9352
+SIZE = 8 * 1024 * 1024
+
+cert = "cert"
+if len(sys.argv) > 1:
+    cert = sys.argv[1]
+snc._timeout = 5
+snc._cert_file = os.path.join(cert, "server.crt")
+snc._key_file = os.path.join(cert, "server.key")
+snc._ca_file = os.path.join(cert, "ca.crt")
+
+def small_buffers(conn):
+    """make the socket buffers of snc connection @conn much smaller than
+    the frames, so that a writer blocks until the peer reads"""
+    s = socket.fromfd(conn.fileno(), socket.AF_INET, socket.SOCK_STREAM)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 16384)
+    s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 16384)
+    s.close()
+
+def exchange(m, data, result):
+    """write @data on channel 0 while reading the peer's data from channel 1"""
+    th = threading.Thread(target = lambda: m.channel(0).write_str(data))
+    th.start()
+    result.append(m.channel(1).read_str())
+    th.join()
+
+print "testing mux with large frames written by both ends..."
+
+lsock = snc.socket(None, PORT)
+server_result = list()
+server_data = os.urandom(SIZE)
+def serve():
+    (conn, addr) = lsock.accept()
+    ss = snc.snc(conn, True)
+    small_buffers(ss)
+    # the server sends on channel 1 so that each end reads what the other writes
+    m = mux.Mux(ss, 2)
+    th = threading.Thread(target = lambda: m.channel(1).write_str(server_data))
+    th.start()
+    server_result.append(m.channel(0).read_str())
+    th.join()
+    m.close()
+    ss.close()
+    conn.close()
+th_server = threading.Thread(target = serve)
+th_server.start()
+
+sock = snc.socket("127.0.0.1", PORT)
+cs = snc.snc(sock)
+small_buffers(cs)
+m = mux.Mux(cs, 2)
+client_data = os.urandom(SIZE)
+client_result = list()
+t0 = time.time()
+exchange(m, client_data, client_result)
+elapsed = time.time() - t0
+th_server.join()
+m.close()
+cs.close()
+sock.close()
+lsock.close()
+
+assert client_result == [server_data]
+assert server_result == [client_data]
+print "exchanged {0} bytes each way in {1:.3f} seconds: ok" . format(SIZE, elapsed)
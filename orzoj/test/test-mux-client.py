@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+import threading, os, time
+from orzoj import snc, conf, mux
+
+conf.parse_file("test-snc-client.conf")
+
+HOST = '127.0.0.1'
+PORT = 9351
+NCHANNEL = 4
+NMSG = 100
+
+s = snc.socket(HOST, PORT)
+ss = snc.snc(s)
+m = mux.Mux(ss, NCHANNEL)
+error = list()
+
+def work(cid):
+    c = m.channel(cid)
+    for i in range(NMSG):
+        data = os.urandom(1 + i * 1000 + cid)
+        c.write_str(data)
+        if c.read_str() != data[::-1]:
+            error.append((cid, i))
+    c.write_str("")
+
+t0 = time.time()
+threads = [threading.Thread(target = work, args = (i, )) for i in range(NCHANNEL)]
+for i in threads:
+    i.start()
+for i in threads:
+    i.join()
+print "{0} messages on {1} channels in {2:.3f} seconds, errors: {3!r}" . format(
+        NMSG * NCHANNEL, NCHANNEL, time.time() - t0, error)
+
+m.close()
+ss.close()
+s.close()
@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+# run test-mux-client.py after this; every channel echoes the reversed strings
+import threading
+from orzoj import snc, conf, mux
+
+conf.parse_file("test-snc-server.conf")
+
+PORT = 9351
+NCHANNEL = 4
+s = snc.socket(None, PORT)
+(conn, addr) = s.accept()
+print 'Connected by', addr
+ss = snc.snc(conn, True)
+m = mux.Mux(ss, NCHANNEL)
+
+def work(cid):
+    c = m.channel(cid)
+    while True:
+        data = c.read_str(-1)
+        if not data:
+            break
+        c.write_str(data[::-1])
+
+threads = [threading.Thread(target = work, args = (i, )) for i in range(NCHANNEL)]
+for i in threads:
+    i.start()
+for i in threads:
+    i.join()
+print 'all channels finished'
+m.close()
+ss.close()
+conn.close()
+s.close()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python2
+# test that an OFTP version 2 transfer interrupted by a network error is
+# resumed from the partially received file, that a damaged partial file is
+# not used twice, and that version 1 senders still work
+import os, os.path, tempfile, shutil, threading, socket, logging
+from orzoj import filetrans, snc
+from local_conn import Local_conn, write_file
+
+SIZE = 1024 * 1024
+
+# the warnings about the failed transfers are expected
+logging.getLogger().addHandler(logging.NullHandler())
+
+class Cut_conn(Local_conn):
+    """a connection counting the bytes written, and cut after @limit bytes"""
+    def __init__(self, sock, limit = None):
+        Local_conn.__init__(self, sock)
+        self.limit = limit
+        self.nbyte = 0
+
+    def write(self, data, timeout = 0):
+        if self.limit is not None and self.nbyte + len(data) > self.limit:
+            self.close()
+            raise snc.Error
+        self.nbyte += len(data)
+        Local_conn.write(self, data, timeout)
+
+def transfer(src, dest, limit = None, features = filetrans.FEATURES):
+    """send file @src to @dest; return tuple(<whether received>, <bytes
+    written by the sender>)"""
+    (a, b) = socket.socketpair()
+    cs = Cut_conn(a, limit)
+    cr = Local_conn(b)
+    def _send():
+        try:
+            filetrans.send(src, cs, features)
+        except filetrans.OFTPError:
+            pass
+        cs.close()
+    th = threading.Thread(target = _send)
+    th.start()
+    try:
+        filetrans.recv(dest, cr)
+        ok = True
+    except filetrans.OFTPError:
+        ok = False
+    cr.close()
+    th.join()
+    return (ok, cs.nbyte)
+
+def parts():
+    return [os.path.join(filetrans.resume_dir, i) for i in os.listdir(filetrans.resume_dir)]
+
+print "testing OFTP resume..."
+
+tmp = tempfile.mkdtemp(prefix = "orzoj-test-")
+try:
+    filetrans.resume_dir = os.path.join(tmp, "parts")
+    os.mkdir(filetrans.resume_dir)
+    filetrans.chunk_size = 64 * 1024
+    src = os.path.join(tmp, "src")
+    dest = os.path.join(tmp, "dest")
+    data = os.urandom(SIZE)
+    write_file(src, data)
+
+    (ok, nbyte) = transfer(src, dest, SIZE / 2)
+    assert not ok
+    (part, ) = parts()
+    received = os.path.getsize(part)
+    assert 0 < received <= SIZE / 2
+    (ok, nbyte) = transfer(src, dest)
+    assert ok and nbyte < SIZE - received + 1024
+    assert open(dest, "rb").read() == data and not parts()
+    print "interrupted transfer resumed: ok"
+
+    (ok, nbyte) = transfer(src, dest, SIZE / 2)
+    assert not ok
+    (part, ) = parts()
+    with open(part, "r+b") as f:
+        f.write("damaged")
+    (ok, nbyte) = transfer(src, dest)
+    assert not ok and not parts()
+    (ok, nbyte) = transfer(src, dest)
+    assert ok and nbyte > SIZE
+    assert open(dest, "rb").read() == data
+    print "damaged partial file discarded: ok"
+
+    (ok, nbyte) = transfer(src, dest, SIZE / 2, ())
+    assert not ok and not parts()
+    (ok, nbyte) = transfer(src, dest, None, ())
+    assert ok and open(dest, "rb").read() == data
+    print "version 1 sender: ok"
+finally:
+    filetrans.resume_dir = None
+    shutil.rmtree(tmp, True)
@@ -0,0 +1,63 @@
+#!/usr/bin/env python2
+# test that reports are sent in report_batch requests, and that a report
+# the website rejects fails alone instead of failing its whole batch
+import threading
+from orzoj.server import web
+
+requests = list()
+lock = threading.Lock()
+BAD = 3
+
+def fake_read(data):
+    if data["action"] == "report_batch":
+        reports = data["reports"]
+    else:
+        reports = [data]
+    with lock:
+        requests.append([i["task"] for i in reports])
+    if BAD in [i["task"] for i in reports]:
+        raise web.Error
+
+web._read = fake_read
+
+def send_all(batcher, tasks):
+    """send a report of each task in @tasks from its own thread, and return
+    a dict of <task> => <whether it was sent>"""
+    ret = dict()
+    start = threading.Event()
+    def work(t):
+        start.wait()
+        try:
+            batcher.send({"action": "report_compiling", "task": t})
+            ret[t] = True
+        except web.Error:
+            ret[t] = False
+    ths = [threading.Thread(target = work, args = (t, )) for t in tasks]
+    for th in ths:
+        th.start()
+    start.set()
+    for th in ths:
+        th.join()
+    return ret
+
+print "testing web._Report_batcher..."
+
+batcher = web._Report_batcher(0.5, 4)
+ret = send_all(batcher, range(10, 18))
+assert ret == dict((t, True) for t in range(10, 18))
+assert sorted(len(i) for i in requests) == [4, 4]
+assert sorted(sum(requests, [])) == range(10, 18)
+print "reports sent in full batches: ok"
+
+del requests[:]
+ret = send_all(batcher, [BAD])
+assert ret == {BAD: False} and requests == [[BAD]]
+print "report failing alone: ok"
+
+del requests[:]
+batcher = web._Report_batcher(0.5, 8)
+ret = send_all(batcher, range(8))
+assert ret == dict((t, t != BAD) for t in range(8)), ret
+assert len(requests) == 9 and sorted(requests[0]) == range(8)
+assert sorted(requests[1:]) == [[t] for t in range(8)]
+print "batch with a rejected report: ok"
@@ -0,0 +1,49 @@
+#!/usr/bin/env python2
+# test that the reports of a task are sent in order, and that a full report
+# outbox stops giving out tasks instead of blocking the judge making reports
+import threading, time, logging
+from orzoj import control
+from orzoj.server import work, web
+
+# the warning about the full outbox is expected
+logging.getLogger().addHandler(logging.NullHandler())
+web.available = lambda: True
+
+class Task:
+    def __init__(self, id):
+        self.id = id
+
+sent = list()
+website = threading.Event() # set when the website answers
+def send(name):
+    website.wait()
+    sent.append(name)
+
+print "testing work._reporter_pool..."
+
+pool = work._reporters
+pool.nthread = 2
+pool.outbox_size = 3
+pool.start()
+
+r1 = pool.open(Task(1))
+r2 = pool.open(Task(2))
+done = threading.Event()
+t0 = time.time()
+for i in range(3):
+    r1.report(send, ["1-{0}" . format(i)])
+r2.report(send, ["2-0"])
+r1.stop(done.set)
+assert time.time() - t0 < 0.5
+assert not pool.wait_not_full(0.1)
+print "full outbox does not block the judge making reports: ok"
+
+website.set()
+assert done.wait(5)
+time.sleep(0.1)
+assert pool.wait_not_full(0)
+assert [i for i in sent if i.startswith("1-")] == ["1-0", "1-1", "1-2"]
+assert "2-0" in sent
+print "reports sent in order and outbox available again: ok"
+
+control.set_termination_flag()
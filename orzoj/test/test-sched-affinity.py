@@ -0,0 +1,53 @@
+#!/usr/bin/env python2
+# test that with affinity_delay set, a task is reserved only for a judge
+# holding its data and able to take it soon
+import time
+from orzoj.server import sched
+
+class Task:
+    def __init__(self, id, prob):
+        self.id = id
+        self.lang_id = 0
+        self.prob = prob
+
+def make_queue():
+    q = sched.Task_queue()
+    q.affinity_delay = 0.5
+    warm = q.register("warm", (0, ))
+    cold = q.register("cold", (0, ))
+    q.set_data_synced(warm, "a", True)
+    return (q, warm, cold)
+
+print "testing sched.Task_queue with affinity_delay..."
+
+(q, warm, cold) = make_queue()
+q.put(Task(1, "a"))
+assert q.get(cold) is None
+t = q.get(warm)
+assert t is not None and t.id == 1
+print "task reserved for an idle judge holding the data: ok"
+
+(q, warm, cold) = make_queue()
+q.put(Task(1, "b"))
+q.put(Task(2, "a"))
+t = q.get(warm)
+assert t is not None and t.id == 2
+t = q.get(cold)
+assert t is not None and t.id == 1
+print "judge prefers tasks whose data it holds: ok"
+
+(q, warm, cold) = make_queue()
+q.put(Task(1, "b"))
+assert q.get(warm).id == 1
+q.put(Task(2, "a"))
+t = q.get(cold)
+assert t is not None and t.id == 2
+print "task not reserved for a busy judge: ok"
+
+(q, warm, cold) = make_queue()
+q.put(Task(1, "a"))
+t0 = time.time()
+t = q.get(cold, 2)
+assert t is not None and t.id == 1
+assert 0.4 < time.time() - t0 < 1.5
+print "task released after affinity_delay: ok"
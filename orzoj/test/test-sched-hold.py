@@ -0,0 +1,56 @@
+#!/usr/bin/env python2
+# test that with balance_alpha set, a slow judge leaves a task only to
+# faster judges able to run it
+from orzoj.server import sched
+
+class Task:
+    def __init__(self, id, lang_id):
+        self.id = id
+        self.lang_id = lang_id
+        self.prob = "prob-{0}" . format(id)
+
+def make_queue(lang_slow, lang_fast):
+    q = sched.Task_queue()
+    q.balance_alpha = 0.5
+    slow = q.register("slow", lang_slow)
+    fast = q.register("fast", lang_fast)
+    q.task_done(slow, Task(0, 0), {"run": 4.0})
+    q.task_done(fast, Task(0, 0), {"run": 1.0})
+    return (q, slow, fast)
+
+print "testing sched.Task_queue with balance_alpha..."
+
+(q, slow, fast) = make_queue((0, 1), (0, ))
+q.put(Task(1, 1))
+assert q.get(fast) is None
+t = q.get(slow)
+assert t is not None and t.id == 1
+print "task in a language the faster judge does not support: ok"
+
+(q, slow, fast) = make_queue((0, 1), (0, ))
+q.put(Task(1, 0))
+assert q.get(slow) is None
+t = q.get(fast)
+assert t is not None and t.id == 1
+print "task the faster judge could run: ok"
+
+(q, slow, fast) = make_queue((0, 1), (0, ))
+q.put(Task(1, 0))
+q.put(Task(2, 1))
+t = q.get(slow)
+assert t is not None and t.id == 1
+t = q.get(fast)
+assert t is None
+t = q.get(slow)
+assert t is not None and t.id == 2
+print "more tasks than faster slots: ok"
+
+q = sched.Task_queue()
+j = q.register("judge", (0, ), 2)
+q.put(Task(1, 0))
+q.put(Task(2, 0))
+t1 = q.get(j)
+t2 = q.get(j)
+q.task_done(j, t2, {"run": 1.0})
+assert j.busy_since.keys() == [1]
+print "finishing a task forgets only that task: ok"
@@ -0,0 +1,42 @@
+#!/usr/bin/env python2
+# test that rejudge tasks wait in a lane after new submissions, ordered by
+# batch and problem, and that a requeued task keeps its position
+from orzoj.server import sched
+
+class Task:
+    def __init__(self, id, prob, batch = None):
+        self.id = id
+        self.prob = prob
+        self.lang_id = 0
+        self.rejudge_batch = batch
+
+def drain(q, judge):
+    ret = list()
+    while True:
+        t = q.get(judge)
+        if t is None:
+            return ret
+        ret.append(t.id)
+
+print "testing the rejudge lane of sched.Task_queue..."
+
+q = sched.Task_queue()
+j = q.register("j", (0, ))
+q.put(Task(10, "b", 1))
+q.put(Task(11, "a", 1))
+q.put(Task(12, "b", 1))
+q.put(Task(5, "a", 2))
+q.put(Task(20, "c"))
+q.put(Task(21, "a"))
+assert drain(q, j) == [20, 21, 11, 10, 12, 5]
+print "new submissions first, then rejudges by batch and problem: ok"
+
+q.put(Task(30, "a"))
+q.put(Task(31, "a"))
+t = q.get(j)
+assert t.id == 30
+q.put(Task(32, "a"))
+# the judge failed, so the task is put back
+q.put(t, False)
+assert drain(q, j) == [30, 31, 32]
+print "requeued task keeps its position: ok"
@@ -0,0 +1,67 @@
+#!/usr/bin/env python2
+# test the cost estimates learned from finished tasks and the order of
+# tasks with SchedPolicy sjf
+import os, tempfile
+from orzoj.server import sched, cost, work
+
+class Clock:
+    now = 1000.0
+    def time(self):
+        return self.now
+
+class Task:
+    def __init__(self, id, prob, lang = "gcc"):
+        self.id = id
+        self.prob = prob
+        self.lang = lang
+        self.lang_id = 0
+
+print "testing cost estimates and sjf..."
+
+assert cost.estimate("a", "gcc") == cost._DEFAULT_COST
+cost.task_done(Task(0, "a"), {"compile": 1.0, "run": 4.0})
+assert cost.estimate("a", "gcc") == 5.0
+assert cost.estimate("a", "fpc") == 4.0
+assert cost.estimate("b", "gcc") == 5.0
+cost.task_done(Task(0, "a"), {"compile": 1.0, "run": 14.0})
+assert abs(cost.estimate("a", "gcc") - (5.0 + cost._ALPHA * 10)) < 1e-9
+cost.task_done(Task(0, "b", "fpc"), {"compile": 0.5})
+assert cost.estimate("b", "fpc") == cost._all
+print "estimates for seen and unseen problems and languages: ok"
+
+tmp = tempfile.mkstemp(prefix = "orzoj-test-")[1]
+try:
+    cost._filename = tmp
+    cost.save(True)
+    saved = (dict(cost._run), dict(cost._prob), dict(cost._compile), cost._all)
+    cost._run.clear()
+    cost._prob.clear()
+    cost._compile.clear()
+    cost._all = None
+    cost._init()
+    assert (cost._run, cost._prob, cost._compile, cost._all) == saved
+finally:
+    cost._filename = None
+    os.remove(tmp)
+print "estimates saved and loaded: ok"
+
+clock = Clock()
+sched.time = clock
+work._sjf_cost_weight = 2
+cost.task_done(Task(0, "light"), {"compile": 0.0, "run": 0.5})
+cost.task_done(Task(0, "heavy"), {"compile": 0.0, "run": 8.5})
+
+q = sched.Task_queue()
+q.key_func = work._sjf_key
+j = q.register("j", (0, ))
+q.put(Task(1, "heavy"))
+q.put(Task(2, "light"))
+assert [q.get(j).id, q.get(j).id] == [2, 1]
+print "shorter task first: ok"
+
+q.put(Task(3, "heavy"))
+# queued more than 2 * (8.5 - 0.5) seconds after the heavy task
+clock.now += 17
+q.put(Task(4, "light"))
+assert [q.get(j).id, q.get(j).id] == [3, 4]
+print "long waiting task not overtaken: ok"
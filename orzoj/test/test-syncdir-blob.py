@@ -0,0 +1,62 @@
+#!/usr/bin/env python2
+# test that with a blob store, files shared by problems are received once
+# and linked, that changing a shared file in one problem leaves the others
+# alone, and that gc() removes only the files no problem uses
+import os, os.path, tempfile, shutil
+from orzoj import sync_dir
+from local_conn import sync, write_file, read_dir
+
+def inode(path):
+    return os.stat(path).st_ino
+
+print "testing sync_dir with a blob store..."
+
+tmp = tempfile.mkdtemp(prefix = "orzoj-test-")
+try:
+    server = os.path.join(tmp, "server")
+    judge = os.path.join(tmp, "judge")
+    os.mkdir(server)
+    os.mkdir(judge)
+    store = sync_dir.Blob_store(os.path.join(tmp, "blobs"), judge)
+    assert store.linked
+    sync_dir.blob_store = store
+
+    shared = os.urandom(50000)
+    for p in ("a", "b"):
+        os.mkdir(os.path.join(server, p))
+        write_file(os.path.join(server, p, "shared.in"), shared)
+    write_file(os.path.join(server, "a", "own.in"), os.urandom(50000))
+    write_file(os.path.join(server, "b", "1.out"), "same")
+    write_file(os.path.join(server, "b", "2.out"), "same")
+
+    for p in ("a", "b"):
+        (s, r) = sync(os.path.join(server, p), os.path.join(judge, p))
+        assert r is not None
+        assert read_dir(os.path.join(judge, p)) == read_dir(os.path.join(server, p))
+    assert store.hit == 2
+    assert inode(os.path.join(judge, "a", "shared.in")) == inode(os.path.join(judge, "b", "shared.in"))
+    assert inode(os.path.join(judge, "b", "1.out")) == inode(os.path.join(judge, "b", "2.out"))
+    print "shared files received once and linked: ok"
+
+    for delta in (0, 1):
+        sync_dir.delta_min_size = delta
+        data = list(shared)
+        data[100 + delta] = chr(ord(data[100 + delta]) ^ 1)
+        write_file(os.path.join(server, "a", "shared.in"), "" . join(data))
+        (s, r) = sync(os.path.join(server, "a"), os.path.join(judge, "a"))
+        assert read_dir(os.path.join(judge, "a")) == read_dir(os.path.join(server, "a"))
+        assert read_dir(os.path.join(judge, "b")) == read_dir(os.path.join(server, "b"))
+        print "shared file changed in one problem (delta_min_size = {0}): ok" . format(delta)
+    sync_dir.delta_min_size = 0
+
+    # the first changed version is no longer used
+    assert store.gc() == 1
+    shutil.rmtree(os.path.join(judge, "b"))
+    assert store.gc() == 2
+    assert store.gc() == 0
+    (s, r) = sync(os.path.join(server, "a"), os.path.join(judge, "a"))
+    assert r is None
+    print "gc removes only unused files: ok"
+finally:
+    sync_dir.blob_store = None
+    shutil.rmtree(tmp, True)
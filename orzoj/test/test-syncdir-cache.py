@@ -0,0 +1,42 @@
+#!/usr/bin/env python2
+# test that the manifest cache of sync_dir notices changed files on both
+# ends, and never trusts checksums it has not computed itself
+import os, os.path, tempfile, shutil
+from orzoj import sync_dir
+from local_conn import sync, write_file, read_dir
+
+print "testing sync_dir with the manifest cache..."
+
+sync_dir.manifest_cache = sync_dir.Manifest_cache()
+tmp = tempfile.mkdtemp(prefix = "orzoj-test-")
+try:
+    src = os.path.join(tmp, "src")
+    dest = os.path.join(tmp, "dest")
+    os.mkdir(src)
+    for i in range(4):
+        write_file(os.path.join(src, "{0}.in" . format(i)), os.urandom(4096), 60)
+
+    (s, r) = sync(src, dest)
+    assert r is not None and read_dir(dest) == read_dir(src)
+    # a received file damaged on the judge, keeping its size, mtime and
+    # inode, is found only if the checksums sent by orzoj-server are not
+    # recorded as those of the received files
+    pf = os.path.join(dest, "2.in")
+    st = os.stat(pf)
+    with open(pf, "r+b") as f:
+        f.write("x" * 16)
+    os.utime(pf, (st.st_atime, st.st_mtime))
+    (s, r) = sync(src, dest)
+    assert r is not None and read_dir(dest) == read_dir(src)
+    print "received file damaged on the judge is sent again: ok"
+
+    (s, r) = sync(src, dest)
+    assert s is None and r is None
+    print "unchanged directory is not sent again: ok"
+
+    write_file(os.path.join(src, "1.in"), os.urandom(4096), 30)
+    (s, r) = sync(src, dest)
+    assert r is not None and read_dir(dest) == read_dir(src)
+    print "file changed on orzoj-server is sent: ok"
+finally:
+    shutil.rmtree(tmp, True)
@@ -0,0 +1,44 @@
+#!/usr/bin/env python2
+# test the parsing of codec specifications and that directories are
+# synchronized with every codec, and with bz2 to judges not supporting it
+import os, os.path, tempfile, shutil
+from orzoj import sync_dir
+from local_conn import sync, write_file, read_dir
+
+print "testing sync_dir codecs..."
+
+p = sync_dir.parse_codec
+assert p("none") == ("none", 0)
+assert p("auto") == ("auto", 0)
+assert p("gzip:1") == ("gzip", 1)
+assert p("gzip") == p("gzip:{0}" . format(sync_dir._GZIP_LEVEL))
+assert sync_dir.codec == p("gzip")
+for s in ("gzip:0", "gzip:10", "gzip:x", "gzip:1:2", "none:1", "lzma"):
+    try:
+        p(s)
+        assert False, s
+    except ValueError:
+        pass
+print "parse_codec: ok"
+
+codecs = ["none", "gzip:1", "gzip", "auto"]
+if sync_dir.bz2:
+    codecs.append("bz2")
+features = tuple(i for i in sync_dir.FEATURES if i != "syncdir-bz2")
+tmp = tempfile.mkdtemp(prefix = "orzoj-test-")
+try:
+    src = os.path.join(tmp, "src")
+    os.mkdir(src)
+    write_file(os.path.join(src, "random"), os.urandom(100000))
+    write_file(os.path.join(src, "text"), "1 2 3\n" * 100000)
+    write_file(os.path.join(src, "empty"), "")
+    for c in codecs:
+        sync_dir.codec = p(c)
+        for f in (sync_dir.FEATURES, features):
+            dest = os.path.join(tmp, "dest")
+            shutil.rmtree(dest, True)
+            (s, r) = sync(src, dest, f)
+            assert r is not None and read_dir(dest) == read_dir(src), (c, f)
+        print "codec {0}: ok" . format(c)
+finally:
+    shutil.rmtree(tmp, True)
@@ -0,0 +1,84 @@
+#!/usr/bin/env python2
+# test that files rebuilt from block deltas are identical to the files on
+# orzoj-server, for edge cases of sizes and changes, with both the C and the
+# Python block search
+import os, os.path, tempfile, shutil, threading, hashlib, random
+from orzoj import sync_dir
+from local_conn import pair, sync, write_file, read_dir
+
+BLOCK = sync_dir._DELTA_BLOCK_MIN
+
+def delta(old, new, tmp):
+    """rebuild a file with content @old into @new by a block delta; return
+    the number of literal bytes sent"""
+    fold = os.path.join(tmp, "old")
+    fnew = os.path.join(tmp, "new")
+    write_file(fold, old)
+    write_file(fnew, new)
+    sig = sync_dir._signature(fold, BLOCK)
+    (cs, cr) = pair()
+    ret = list()
+    th = threading.Thread(target = lambda: ret.append(
+        sync_dir._send_delta(fnew, BLOCK, sig, cs)))
+    th.start()
+    (ok, nbyte) = sync_dir._apply_delta(fold, BLOCK, cr, hashlib.sha1(new).digest())
+    th.join()
+    cs.close()
+    cr.close()
+    assert ok and ret == [nbyte]
+    with open(fold, "rb") as f:
+        assert f.read() == new
+    return nbyte
+
+random.seed(1)
+base = "" . join(chr(random.randrange(256)) for i in range(BLOCK * 20 + 100))
+def change(s, pos, data, nremove = 0):
+    return s[:pos] + data + s[pos + nremove:]
+
+# (name, old, new, maximal number of literal bytes)
+cases = [
+    ("identical", base, base, 100),
+    ("one byte changed", base, change(base, BLOCK * 7 + 5, "x", 1), BLOCK + 100),
+    ("byte inserted at the start", base, "x" + base, 200),
+    ("bytes removed in the middle", base, change(base, BLOCK * 3 + 9, "", 100), BLOCK + 100),
+    ("truncated to a partial block", base, base[:BLOCK * 5 + 7], 7),
+    ("appended", base, base + "tail" * 1000, 4100),
+    ("emptied", base, "", 0),
+    ("old shorter than a block", base[:100], base, len(base)),
+    ("all different", base, base[::-1], len(base)),
+    ("repeated blocks", "\0" * BLOCK * 8, "\0" * BLOCK * 3 + "x" + "\0" * BLOCK * 6, BLOCK + 1),
+]
+
+print "testing sync_dir block deltas..."
+
+finds = [("python", sync_dir._py_find)]
+if sync_dir._find is not sync_dir._py_find:
+    finds.append(("C", sync_dir._find))
+find = sync_dir._find
+tmp = tempfile.mkdtemp(prefix = "orzoj-test-")
+try:
+    for (fname, f) in finds:
+        sync_dir._find = f
+        for (name, old, new, maxlit) in cases:
+            nbyte = delta(old, new, tmp)
+            assert nbyte <= maxlit, (fname, name, nbyte)
+        print "{0} block search: ok" . format(fname)
+    sync_dir._find = find
+
+    src = os.path.join(tmp, "src")
+    dest = os.path.join(tmp, "dest")
+    os.mkdir(src)
+    os.mkdir(dest)
+    for (i, (name, old, new, maxlit)) in enumerate(cases):
+        write_file(os.path.join(dest, str(i)), old)
+        write_file(os.path.join(src, str(i)), new)
+    write_file(os.path.join(dest, "empty"), "")
+    write_file(os.path.join(src, "empty"), base)
+    sync_dir.delta_min_size = 1
+    (s, r) = sync(src, dest)
+    assert r is not None and read_dir(dest) == read_dir(src)
+    print "directory synchronized with block deltas: ok"
+finally:
+    sync_dir._find = find
+    sync_dir.delta_min_size = 0
+    shutil.rmtree(tmp, True)
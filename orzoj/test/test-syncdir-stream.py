@@ -0,0 +1,54 @@
+#!/usr/bin/env python2
+# test that a directory streamed as tar is synchronized, and that a stream
+# failing the digest check leaves the directory untouched
+import os, os.path, tempfile, shutil, logging
+from orzoj import sync_dir
+from local_conn import sync, write_file, read_dir
+
+_send_stream = sync_dir._send_stream
+def bad_digest(path, flist, conn, codec, link):
+    """like sync_dir._send_stream, but send a wrong digest"""
+    write = conn.write
+    def _write(data, *args):
+        if len(data) == 20:
+            data = "\0" * 20
+        write(data, *args)
+    conn.write = _write
+    try:
+        return _send_stream(path, flist, conn, codec, link)
+    finally:
+        conn.write = write
+
+# the warning about the digest is expected
+logging.getLogger().addHandler(logging.NullHandler())
+
+print "testing sync_dir with tar streams..."
+
+tmp = tempfile.mkdtemp(prefix = "orzoj-test-")
+try:
+    src = os.path.join(tmp, "src")
+    dest = os.path.join(tmp, "dest")
+    os.mkdir(src)
+    os.mkdir(dest)
+    write_file(os.path.join(src, "same.in"), "same")
+    write_file(os.path.join(dest, "same.in"), "same")
+    write_file(os.path.join(src, "changed.in"), os.urandom(300000))
+    write_file(os.path.join(dest, "changed.in"), "old")
+    write_file(os.path.join(src, "new.in"), os.urandom(1000))
+    write_file(os.path.join(dest, "removed.in"), "removed")
+    before = read_dir(dest)
+
+    sync_dir._send_stream = bad_digest
+    (s, r) = sync(src, dest)
+    sync_dir._send_stream = _send_stream
+    assert isinstance(r, sync_dir.Error), r
+    assert read_dir(dest) == before
+    assert sorted(os.listdir(tmp)) == ["dest", "src"]
+    print "stream with a wrong digest leaves the directory untouched: ok"
+
+    (s, r) = sync(src, dest)
+    assert r is not None and read_dir(dest) == read_dir(src)
+    print "directory synchronized with a stream: ok"
+finally:
+    sync_dir._send_stream = _send_stream
+    shutil.rmtree(tmp, True)
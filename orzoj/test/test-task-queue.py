@@ -0,0 +1,78 @@
+#!/usr/bin/env python2
+# test that sched.Task_queue gives each judge the first task in the
+# languages it supports, whatever the judges registered before or after
+import threading, time
+from orzoj.server import sched
+
+class Task:
+    def __init__(self, id, lang_id):
+        self.id = id
+        self.lang_id = lang_id
+        self.prob = "prob-{0}" . format(id)
+
+def drain(q, judge):
+    ret = list()
+    while True:
+        t = q.get(judge)
+        if t is None:
+            return ret
+        ret.append(t.id)
+
+print "testing sched.Task_queue..."
+
+q = sched.Task_queue()
+a = q.register("a", (0, 1))
+for (i, lang) in enumerate((2, 0, 1, 2, 0, 1)):
+    q.put(Task(i, lang))
+b = q.register("b", (1, 2))
+c = q.register("c", (1, 2))
+assert len(q) == 6
+assert q.get(b).id == 0
+assert q.get(a).id == 1
+assert q.get(c).id == 2
+assert drain(q, a) == [4, 5]
+assert drain(q, b) == [3]
+assert drain(q, c) == []
+assert len(q) == 0
+print "tasks given in order to judges with overlapping languages: ok"
+
+q.unregister(b)
+q.put(Task(10, 2))
+assert q.get(a) is None
+assert q.get(c).id == 10
+q.unregister(c)
+q.put(Task(11, 2))
+d = q.register("d", (2, ))
+assert q.get(d).id == 11
+q.unregister(a)
+q.unregister(d)
+print "views shared and released by judges: ok"
+
+q = sched.Task_queue(2)
+j = q.register("j", (0, ))
+q.put(Task(1, 0))
+q.put(Task(2, 0))
+assert q.nfree() == 0
+q.put(Task(3, 0), False)
+assert len(q) == 3
+th = threading.Thread(target = lambda: q.put(Task(4, 0)))
+th.start()
+time.sleep(0.2)
+assert th.is_alive()
+assert q.get(j).id == 1
+assert q.get(j).id == 2
+th.join(5)
+assert not th.is_alive()
+assert drain(q, j) == [3, 4]
+print "put() blocks while the queue is full: ok"
+
+ret = list()
+th = threading.Thread(target = lambda: ret.append(q.get(j, 5)))
+th.start()
+time.sleep(0.2)
+q.put(Task(5, 0))
+th.join()
+assert ret[0].id == 5
+t0 = time.time()
+assert q.get(j, 0.2) is None and time.time() - t0 >= 0.2
+print "get() waits for a task: ok"
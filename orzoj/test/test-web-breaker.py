@@ -0,0 +1,55 @@
+#!/usr/bin/env python2
+# test the state changes of the circuit breaker for website requests
+import time, logging
+from orzoj.server import web
+
+# the warnings about the website being unavailable are expected
+logging.getLogger().addHandler(logging.NullHandler())
+web._retry_wait = 0.2
+web._retry_max_wait = 0.4
+
+print "testing web._Breaker..."
+
+b = web._Breaker()
+b.threshold = 3
+b.failure()
+b.failure()
+assert not b.is_open() and b.allow()
+b.success()
+b.failure()
+b.failure()
+assert not b.is_open()
+print "failures below the threshold or interrupted by a success: ok"
+
+b.failure()
+assert b.is_open() and not b.allow() and not b.available()
+# requests sent before the circuit was opened fail later
+b.failure()
+assert b._backoff == 0.2
+print "circuit opened after consecutive failures: ok"
+
+t0 = time.time()
+b.wait(5)
+assert 0.09 < time.time() - t0 < 0.5
+assert b.available() and b.allow()
+assert not b.allow() and not b.available()
+b.failure()
+assert b.is_open() and b._backoff == 0.4
+print "only one probe let through, backoff doubled when it fails: ok"
+
+b.wait(5)
+assert b.allow()
+b.failure()
+assert b._backoff == 0.4
+b.wait(5)
+assert b.allow()
+b.success()
+assert not b.is_open() and b.allow() and b.allow()
+print "backoff limited and circuit closed by a successful probe: ok"
+
+b = web._Breaker()
+b.threshold = 0
+for i in range(10):
+    b.failure()
+assert not b.is_open() and b.allow()
+print "breaker disabled with threshold 0: ok"
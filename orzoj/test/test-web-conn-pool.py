@@ -0,0 +1,62 @@
+#!/usr/bin/env python2
+# test that web._Conn_pool sends a request again only if the website closed
+# the kept-alive connection before the request reached it
+
+import threading, time, socket, BaseHTTPServer
+from orzoj.server import web
+
+PORT = 9353
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    handled = list()
+
+    def do_GET(self):
+        Handler.handled.append(self.path)
+        if self.path.endswith("slow"):
+            time.sleep(1)
+        body = "ok"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        if self.path.endswith("drop"):
+            # close the connection without telling the client
+            self.close_connection = 1
+
+    def log_message(self, *args):
+        pass
+
+class Server(BaseHTTPServer.HTTPServer):
+    allow_reuse_address = True
+
+    def handle_error(self, request, client_address):
+        # the client gives up on the slow request, so writing the reply fails
+        pass
+
+server = Server(("127.0.0.1", PORT), Handler)
+th = threading.Thread(target = server.serve_forever)
+th.daemon = True
+th.start()
+
+print "testing web._Conn_pool..."
+
+pool = web._Conn_pool("http://127.0.0.1:{0}/" . format(PORT), 1)
+assert pool.open("drop", timeout = 5) == "ok"
+time.sleep(0.2)
+assert pool.open("after-drop", timeout = 5) == "ok"
+assert Handler.handled == ["/?drop", "/?after-drop"], Handler.handled
+print "request on a connection closed by the website is sent again: ok"
+
+del Handler.handled[:]
+assert pool.open("fast", timeout = 5) == "ok"
+try:
+    pool.open("slow", timeout = 0.3)
+    assert False
+except socket.timeout:
+    pass
+time.sleep(1)
+assert Handler.handled == ["/?fast", "/?slow"], Handler.handled
+print "request timed out on a kept-alive connection is not sent again: ok"
+
+server.shutdown()